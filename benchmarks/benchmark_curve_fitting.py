@@ -0,0 +1,48 @@
+"""
+Benchmarks fitting the biomass curves of a 384 well plate with the batch fitter against lmfit
+
+Run from the root folder with `python -m benchmarks.benchmark_curve_fitting`. The lmfit time is extrapolated
+from a subset of the curves.
+"""
+import time
+
+import numpy as np
+
+from impact.curve_fitting import curve_fit_dict
+
+
+def generate_growth_curves(number_of_wells=384, number_of_time_points=40):
+    """
+    Generates noisy gompertz growth curves with random parameters
+    """
+    rs = np.random.RandomState(0)
+    t = np.linspace(0, 20, number_of_time_points)
+    A = rs.uniform(0.8, 2, number_of_wells)
+    growth_rate = rs.uniform(0.1, 0.5, number_of_wells)
+    lam = rs.uniform(1, 5, number_of_wells)
+    data = curve_fit_dict['gompertz'].growthEquation(t[None, :], A[:, None], growth_rate[:, None], lam[:, None])
+    return t, data + 0.05 + rs.normal(0, 0.01, data.shape)
+
+
+def benchmark_curve_fit(fit_types=('gompertz', 'janoschek', 'richard_5', 'growthEquation_generalized_logistic',
+                                   'three_param'), lmfit_subset=10):
+    t, data = generate_growth_curves()
+    results = []
+    for fit_type in fit_types:
+        t0 = time.time()
+        result = curve_fit_dict[fit_type].calcFitBatch(t, data)
+        batch_time = time.time() - t0
+
+        t0 = time.time()
+        for curve in data[:lmfit_subset]:
+            curve_fit_dict[fit_type].calcFit(t, curve)
+        lmfit_time = (time.time() - t0) / lmfit_subset * len(data)
+
+        results.append((fit_type, batch_time, lmfit_time, np.sum(result.fallback)))
+    return results
+
+
+if __name__ == '__main__':
+    print('%40s %10s %10s %10s' % ('fit type', 'batch (s)', 'lmfit (s)', 'fallbacks'))
+    for fit_type, batch_time, lmfit_time, fallbacks in benchmark_curve_fit():
+        print('%40s %10.2f %10.2f %10i' % (fit_type, batch_time, lmfit_time, fallbacks))
@@ -0,0 +1,99 @@
+"""
+Benchmarks the scaling of the parsing pipeline with the number of wells, from columnar arrays and from plate reader
+sheets of 96, 384 and 1536 well plates
+
+Run from the root folder with `python -m benchmarks.benchmark_parsers`, the time per well should remain
+roughly constant
+"""
+import contextlib
+import io
+import time
+
+import numpy as np
+
+import impact
+from impact.parsers import parse_time_point_arrays, plate_geometries, SpectromaxOD, SpectromaxOD384, \
+    SpectromaxOD1536
+
+
+def generate_plate_arrays(number_of_wells, number_of_time_points=10, replicates=4):
+    """
+    Generates columnar OD data for a number of wells, grouped into replicates of `replicates` wells
+    """
+    trial_identifiers = []
+    for well in range(number_of_wells):
+        trial_identifier = impact.TimeCourseIdentifier()
+        trial_identifier.parse_identifier('strain:strain_%i|rep:%i' % (well // replicates, well % replicates + 1))
+        trial_identifier.analyte_name = 'OD600'
+        trial_identifier.analyte_type = 'biomass'
+        trial_identifiers.append(trial_identifier)
+
+    identifier_index = np.tile(np.arange(number_of_wells), number_of_time_points)
+    times = np.repeat(np.arange(number_of_time_points, dtype=float), number_of_wells)
+    values = np.random.rand(len(times))
+    return trial_identifiers, identifier_index, times, values
+
+
+def benchmark_parse_time_point_arrays(well_counts=(96, 384, 1536, 10000)):
+    results = []
+    for number_of_wells in well_counts:
+        data = generate_plate_arrays(number_of_wells)
+
+        t0 = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            replicate_trial_list = parse_time_point_arrays(*data)
+        elapsed = time.time() - t0
+
+        assert len(replicate_trial_list) == number_of_wells // 4
+        results.append((number_of_wells, elapsed))
+    return results
+
+
+def generate_plate_sheets(number_of_wells, number_of_time_points=100, replicates=4):
+    """
+    Generates the identifiers and data sheets of a Spectromax export, grouped into replicates of `replicates` wells
+    """
+    rows, cols = plate_geometries[number_of_wells]
+    identifiers = [['strain:strain_%i|rep:%i' % ((row * cols + col) // replicates, col % replicates + 1)
+                    for col in range(cols)] for row in range(rows)]
+
+    data = [[None] * (cols + 2) for _ in range(3)]
+    for i in range(number_of_time_points):
+        time_label = '%i:%02i:00' % (i // 6, i % 6 * 10)
+        for row in range(rows):
+            data.append([time_label if row == 0 else None, None] + list(np.random.rand(cols)))
+        data.append([None] * (cols + 2))
+    data.append(['~End'] + [None] * (cols + 1))
+    return {'identifiers': identifiers, 'data': data}
+
+
+def benchmark_plate_layouts(number_of_time_points=100):
+    parsers = {96  : SpectromaxOD,
+               384 : SpectromaxOD384,
+               1536: SpectromaxOD1536}
+    results = []
+    for number_of_wells, parser in parsers.items():
+        data = generate_plate_sheets(number_of_wells, number_of_time_points)
+
+        experiment = impact.Experiment()
+        t0 = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.parse_data(experiment, {'identifiers': data['identifiers'], 'data': iter(data['data'])},
+                              id_type='traverse')
+        elapsed = time.time() - t0
+
+        assert len(experiment.replicate_trial_dict) == number_of_wells // 4
+        results.append((number_of_wells, elapsed))
+    return results
+
+
+if __name__ == '__main__':
+    print('Columnar arrays')
+    print('%8s %10s %14s' % ('wells', 'time (s)', 'ms per well'))
+    for number_of_wells, elapsed in benchmark_parse_time_point_arrays():
+        print('%8i %10.2f %14.3f' % (number_of_wells, elapsed, elapsed / number_of_wells * 1000))
+
+    print('\nPlate reader sheets')
+    print('%8s %10s %14s' % ('wells', 'time (s)', 'ms per well'))
+    for number_of_wells, elapsed in benchmark_plate_layouts():
+        print('%8i %10.2f %14.3f' % (number_of_wells, elapsed, elapsed / number_of_wells * 1000))
@@ -1,16 +1,16 @@
 # coding=utf-8
 
 from .TrialIdentifier import TimeCourseIdentifier
+from .features import MultiAnalyteFeature
 
 from ..curve_fitting import *
 
 import pandas as pd
 
-from scipy.signal import savgol_filter
-
 from ..database import Base
 from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Float
-from sqlalchemy.orm import relationship, reconstructor
+from sqlalchemy.orm import relationship, reconstructor, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy import event
 
@@ -109,12 +109,8 @@ class TimeCourse(Base):
         'polymorphic_on': type
     }
 
-    @reconstructor
     def __init__(self, **kwargs):
-        # Get the default parameters
-        from .settings import settings
-
-        self.pd_series = None
+        self._init_data()
 
         if 'time_points' in kwargs:
             for time_point in kwargs['time_points']:
@@ -134,6 +130,44 @@ class TimeCourse(Base):
 
         self.fit_params = dict()
 
+        self.stages = []
+
+        self._init_options()
+
+    @reconstructor
+    def init_on_load(self):
+        """
+        Initializes the attributes which aren't persisted when the time course is loaded from the database. The
+        loaded attributes are left unchanged, and the data is built from the time points when it is first read.
+        """
+        self._init_data()
+        self._init_options()
+        self._load_time_points = True
+
+        # The calculated attributes aren't persisted, they are redone after loading
+        set_committed_value(self, 'calculations_uptodate', False)
+
+    def _init_data(self):
+        # The data is held in either a pd.Series or sorted time and data buffers which grow as time points are
+        # added. Once there are buffers they hold the data, and the series is a copy cached until the next change
+        self._pd_series = None
+        self._times = None
+        self._values = None
+        self._size = 0
+
+        # TimePoint objects are only generated from the pd_series when the time course is persisted
+        self._time_points_pending = False
+
+        # Blank subtracted from the data at each time, by `subtract_blank`
+        self._subtracted_blank = None
+
+        # Set when the time course is loaded, the data is then built from the loaded time points
+        self._load_time_points = False
+
+    def _init_options(self):
+        # Get the default parameters
+        from .settings import settings
+
         self._gradient = []
 
         # Options
@@ -146,15 +180,42 @@ class TimeCourse(Base):
         self.death_phase_start = None
         self.blankSubtractionFlag = True
 
-        self.stages = []
         self._stage_indices = None
 
-        # Declare the default curve fit
-        self.fit_type = None
+        # Declare the default curve fit, set as a class attribute by the analyte types which are fit
+        self.fit_type = getattr(self.__class__, 'fit_type', None)
+
+        # Set when the fit parameters were calculated by `batch_curve_fit`, `calculate` will not refit
+        self._prefit = False
 
     def __str__(self):
         return str(self.trial_identifier.unique_analyte_data())
 
+    @classmethod
+    def from_arrays(cls, trial_identifier, time_vector, data_vector):
+        """
+        Build a time course directly from time and data arrays, without creating a :class:`~TimePoint` for each
+        measurement. The time points are only created if the time course is persisted.
+
+        Parameters
+        ----------
+        trial_identifier : :class:`~TimeCourseIdentifier`
+            Identifier for the time course, with the analyte_name and analyte_type set
+        time_vector : array
+            Sorted time vector, without duplicates
+        data_vector : array
+            Data corresponding to each time
+
+        Returns
+        -------
+        :class:`~TimeCourse`
+        """
+        time_course = cls()
+        time_course.trial_identifier = trial_identifier
+        time_course.pd_series = pd.Series(data_vector, index=time_vector)
+        time_course._time_points_pending = True
+        return time_course
+
     @property
     def unique_id(self):
         return ','.join([self.trial_identifier.strain,self.trial_identifier.media,self.trial_identifier.id_1,
@@ -196,18 +257,197 @@ class TimeCourse(Base):
     @trial_identifier.setter
     def trial_identifier(self, trial_identifier):
         self._trial_identifier = trial_identifier
-        #
-        # self.analyte_name = trial_identifier.analyte_name
-        # self.analyte_type = trial_identifier.analyte_type
+
+        # The analyte_dict of a loaded SingleTrial is keyed by these columns
+        if trial_identifier is not None:
+            self.analyte_name = trial_identifier.analyte_name
+            self.analyte_type = trial_identifier.analyte_type
         # if self.analyte_type == 'product':
         #     self.fit_type = 'productionEquation_generalized_logistic'
         # if self.analyte_type == 'biomass':
         #     self.fit_type = 'janoschek_no_limits'
         #     #'janoschek'#'gompertz'#'richard_5','growthEquation_generalized_logistic'
 
+    @property
+    def pd_series(self):
+        if getattr(self, '_load_time_points', False):
+            self.set_time_point_arrays([time_point.time for time_point in self.time_points],
+                                       [time_point.data for time_point in self.time_points])
+
+        if getattr(self, '_pd_series', None) is None and getattr(self, '_times', None) is not None:
+            self._pd_series = pd.Series(self._values[:self._size].copy(), index=self._times[:self._size].copy())
+        return getattr(self, '_pd_series', None)
+
+    @pd_series.setter
+    def pd_series(self, pd_series):
+        self._pd_series = pd_series
+        self._times = None
+        self._values = None
+        self._size = 0
+        self._load_time_points = False
+        # New data hasn't had a blank subtracted
+        self._subtracted_blank = None
+
+    def set_time_point_arrays(self, times, values):
+        """
+        Sets the data from the time and value of each persisted time point, in any order. The data isn't marked to
+        be persisted again.
+
+        Parameters
+        ----------
+        times : array
+        values : array
+        """
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(times, kind='mergesort')
+        self.pd_series = pd.Series(values[order], index=times[order])
+
+    def _init_buffers(self, capacity=0):
+        """
+        Moves the data from the pd_series to the time and data buffers, and grows them to hold at least capacity
+        points
+        """
+        if self._times is None:
+            series = self.pd_series
+            size = 0 if series is None else len(series)
+            self._times = np.empty(max(16, 2 * size, capacity))
+            self._values = np.empty(max(16, 2 * size, capacity))
+            if size:
+                self._times[:size] = series.index
+                self._values[:size] = series.values
+            self._size = size
+            self._pd_series = None
+        elif capacity > len(self._times):
+            capacity = max(capacity, 2 * len(self._times))
+            self._times = np.concatenate([self._times[:self._size], np.empty(capacity - self._size)])
+            self._values = np.concatenate([self._values[:self._size], np.empty(capacity - self._size)])
+
+    def _insert_point(self, time, data):
+        """
+        Insert a point in the time and data buffers, keeping them sorted by time
+
+        Returns
+        -------
+        int
+            Index of the point
+        """
+        self._init_buffers()
+
+        size = self._size
+        if size == 0 or time > self._times[size - 1]:
+            index = size
+        else:
+            index = int(np.searchsorted(self._times[:size], time))
+            if self._times[index] == time:
+                raise Exception('Duplicate time points found, this is not supported - likely an identifier input '
+                                'error')
+
+        # Grow the buffers geometrically, so appends are amortized constant time
+        if size == len(self._times):
+            self._times = np.concatenate([self._times, np.empty(size)])
+            self._values = np.concatenate([self._values, np.empty(size)])
+
+        self._times[index + 1:size + 1] = self._times[index:size]
+        self._values[index + 1:size + 1] = self._values[index:size]
+        self._times[index] = time
+        self._values[index] = np.nan if data is None else data
+        self._size = size + 1
+        self._pd_series = None
+        return index
+
+    def append_arrays(self, times, values):
+        """
+        Adds measurements from time and data arrays, without creating a :class:`~TimePoint` for each. Measurements
+        after the last time point are appended in amortized constant time per point. The gradient is updated from
+        the first changed point, the death phase and curve fit are redone by the next `calculate`.
+
+        Parameters
+        ----------
+        times : array
+        values : array
+
+        Returns
+        -------
+        int
+            Index of the first added point
+        """
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(times, kind='mergesort')
+        times, values = times[order], values[order]
+
+        gradient = self._gradient
+        self._init_buffers(self._size + len(times))
+        size = self._size
+        if len(times) == 0:
+            return size
+
+        if (size == 0 or times[0] > self._times[size - 1]) and np.all(np.diff(times) > 0):
+            self._times[size:size + len(times)] = times
+            self._values[size:size + len(times)] = values
+            start = size
+        else:
+            # Checked before anything is written, so the data is unchanged if there are duplicates
+            index = np.searchsorted(self._times[:size], times)
+            if np.any(np.diff(times) == 0) \
+                    or (size > 0 and np.any(self._times[np.minimum(index, size - 1)] == times)):
+                raise Exception('Duplicate time points found, this is not supported - likely an identifier input '
+                                'error')
+            self._times[:size + len(times)] = np.insert(self._times[:size], index, times)
+            self._values[:size + len(times)] = np.insert(self._values[:size], index, values)
+            start = int(index[0])
+        self._size = size + len(times)
+        self._pd_series = None
+
+        # Time point list is filled when persisted
+        self._time_points_pending = True
+        self.invalidate_calculations()
+        self._gradient = self._update_gradient(gradient, size, start)
+        return start
+
+    def _update_gradient(self, gradient, previous_size, start):
+        """
+        Returns the gradient after points were added from index start. Each point depends on its neighbours, so
+        only the points from the one before start are recalculated.
+        """
+        from .settings import settings
+
+        size = self._size
+        if size <= 2:
+            return []
+        if settings.use_filtered_data or len(gradient) != previous_size or previous_size <= 2:
+            return np.gradient(self.data_vector) / np.gradient(self.time_vector)
+
+        first = max(0, start - 2)
+        window = np.gradient(self._values[first:size]) / np.gradient(self._times[first:size])
+        return np.concatenate([gradient[:max(0, start - 1)], window[max(0, start - 1) - first:]])
+
+    def time_at(self, index):
+        """
+        Returns the time of the measurement at index
+        """
+        if getattr(self, '_times', None) is not None:
+            return float(self._times[:self._size][index])
+        return float(self.pd_series.index[index])
+
+    def tail(self, time):
+        """
+        Returns the time and data arrays of the measurements at or after time, without copying the data
+        """
+        if getattr(self, '_times', None) is not None:
+            index = int(np.searchsorted(self._times[:self._size], time))
+            return self._times[index:self._size], self._values[index:self._size]
+
+        series = self.pd_series
+        index = int(series.index.searchsorted(time))
+        return np.asarray(series.index[index:], dtype=float), np.asarray(series.values[index:], dtype=float)
+
     @property
     def time_vector(self):
-        if hasattr(self,'pd_series') and self.pd_series is not None:
+        if getattr(self, '_times', None) is not None:
+            return self._times[:self._size].copy()
+        if self.pd_series is not None:
             return np.array(self.pd_series.index)
         return None
 
@@ -216,24 +456,31 @@ class TimeCourse(Base):
         if self.pd_series is None:
             self.pd_series = pd.Series(index=time_vector)
         else:
-            self.pd_series.index = time_vector
+            self.pd_series = pd.Series(self.pd_series.values, index=time_vector)
 
         if sum(self.pd_series.index.duplicated()) > 0:
             print(self.pd_series.index)
             raise Exception('Duplicate time points found, this is not supported')
 
-        # Fill time point list
-        self.generate_time_point_list()
+        # Time point list is filled when persisted
+        self._time_points_pending = True
+        self.invalidate_calculations()
 
     @property
     def data_vector(self):
         from .settings import settings
 
+        if getattr(self, '_times', None) is not None:
+            data_vector = self._values[:self._size].copy()
+        else:
+            data_vector = np.array(self.pd_series)
+
         # Filter data to smooth noise from the signal
-        if settings.use_filtered_data and len(self.pd_series)>self.savgol_filter_window_size:
-            return savgol_filter(np.array(self.pd_series), self.savgol_filter_window_size, 3)
+        if settings.use_filtered_data and len(data_vector)>self.savgol_filter_window_size:
+            from scipy.signal import savgol_filter
+            return savgol_filter(data_vector, self.savgol_filter_window_size, 3)
         else:
-            return np.array(self.pd_series)
+            return data_vector
 
     @data_vector.setter
     def data_vector(self, data_vector):
@@ -246,25 +493,78 @@ class TimeCourse(Base):
         else:
             self.pd_series = pd.Series(data_vector, index=self.pd_series.index)
 
-        # Convert vectors to list format (for db)
-        self.generate_time_point_list()
+        # Convert vectors to list format (for db) when persisted
+        self._time_points_pending = True
 
         # Instantiate death phase to be not detected (last point of the vector)
         self.death_phase_start = len(data_vector)
+        self.invalidate_calculations()
         if live_calculations:   self.calculate()
 
     @property
     def gradient(self):
-        if self._gradient == []:
+        if len(self._gradient) == 0:
             # if self.time_vector is not None and len(self.time_vector) > 2:
             self._gradient = np.gradient(self.data_vector) / np.gradient(self.time_vector)
 
         return self._gradient
 
     def generate_time_point_list(self):
-        # TODO, ensure new time point aren't created and previous ones are referenced
-        self.time_points = [TimePoint(time=time, data=data)
-                            for time, data in zip(self.pd_series.index, self.pd_series)]
+        # The persisted time points are kept, so only the added measurements are inserted
+        persisted = {time_point.time: time_point for time_point in self.time_points}
+        time_points = []
+        for time, data in zip(self.pd_series.index, self.pd_series):
+            time_point = persisted.get(time)
+            if time_point is None:
+                time_point = TimePoint(time=time, data=data)
+            elif time_point.data != data:
+                time_point.data = data
+            time_points.append(time_point)
+        self.time_points = time_points
+        self._time_points_pending = False
+
+    def subtract_blank(self, blank):
+        """
+        Subtracts the data of a blank time course at the same times. Only the change in the blank since the last
+        subtraction is subtracted, so the subtraction can be repeated as data is added to the time course or the
+        blank. Points without blank data at their time are subtracted once the blank has them.
+
+        Parameters
+        ----------
+        blank : :class:`~TimeCourse`
+            e.g. the average of the blank replicate trial
+        """
+        times = self.time_vector
+        subtracted = np.zeros(len(times)) if getattr(self, '_subtracted_blank', None) is None \
+            else self._subtracted_blank.reindex(times).fillna(0).values
+        blank_data = blank.pd_series.reindex(times).values
+        blank_data = np.where(np.isnan(blank_data), subtracted, blank_data)
+
+        if np.any(blank_data != subtracted):
+            self.data_vector = self.pd_series.values - (blank_data - subtracted)
+            self._subtracted_blank = pd.Series(blank_data, index=times)
+
+    def invalidate_calculations(self):
+        """
+        Marks the calculations of this time course, and of the single trial, replicate trial and experiment it
+        belongs to, to be redone by the next `calculate`
+        """
+        self.calculations_uptodate = False
+        self._gradient = []
+        # A batch fit or loaded fit no longer matches the data
+        self._prefit = False
+        self.reset_features()
+
+        if self.parent is not None:
+            self.parent.invalidate_calculations()
+
+    def reset_features(self):
+        """
+        Clears the calculated features, e.g. the specific productivity, they are calculated again when next read
+        """
+        for feature in list(self.__dict__.values()):
+            if isinstance(feature, MultiAnalyteFeature):
+                feature.reset()
 
     def calculate(self):
         from .settings import settings
@@ -276,7 +576,48 @@ class TimeCourse(Base):
             self.find_death_phase(self.data_vector)
 
         if len(self.data_vector) > self.minimum_points_for_curve_fit and perform_curve_fit:
-            self.curve_fit_data()
+            if self._prefit:
+                self._prefit = False
+            else:
+                self.curve_fit_data()
+
+        self.calculations_uptodate = True
+
+    def get_calculation_copy(self):
+        """
+        Returns a copy with only the data and options used by `calculate`, without references to the parent
+        objects. Used to calculate in another process.
+        """
+        trial_identifier = TimeCourseIdentifier()
+        trial_identifier.analyte_name = self.trial_identifier.analyte_name
+        trial_identifier.analyte_type = self.trial_identifier.analyte_type
+
+        time_course = self.__class__()
+        time_course.trial_identifier = trial_identifier
+        time_course.pd_series = self.pd_series
+        for attr in ['remove_death_phase_flag', 'use_filtered_data', 'minimum_points_for_curve_fit',
+                     'savgol_filter_window_size', 'death_phase_start', 'fit_type', '_prefit']:
+            setattr(time_course, attr, getattr(self, attr))
+        time_course.fit_params = {name: FitParameter(name, self.fit_params[name].parameter_value)
+                                  for name in self.fit_params}
+        return time_course
+
+    def get_calculation_results(self):
+        """
+        Returns the results of `calculate`, to be set with `set_calculation_results`
+        """
+        return {'gradient'         : self._gradient,
+                'death_phase_start': self.death_phase_start,
+                'fit_params'       : {name: self.fit_params[name].parameter_value for name in self.fit_params}}
+
+    def set_calculation_results(self, results):
+        """
+        Sets the results of `calculate` performed on a copy of this time course
+        """
+        self._gradient = results['gradient']
+        self.death_phase_start = results['death_phase_start']
+        self.fit_params = {name: FitParameter(name, value) for name, value in results['fit_params'].items()}
+        self.calculations_uptodate = True
 
     def find_death_phase(self, data_vector):
         from .settings import settings
@@ -298,6 +639,7 @@ class TimeCourse(Base):
             if verbose: print('Growth range: ', (np.max(data_vector) - np.min(data_vector)) / np.min(data_vector))
 
             if use_filtered_data:
+                from scipy.signal import savgol_filter
                 filteredData = savgol_filter(data_vector, 51, 3)
             else:
                 filteredData = np.array(data_vector)
@@ -343,42 +685,31 @@ class TimeCourse(Base):
     def data_curve_fit(self, t):
         return curve_fit_dict[self.fit_type].growthEquation(np.array(t), **self.fit_params)
 
-    @event.listens_for(TimePoint, 'load')
     def add_timepoint(self, time_point):
         from .settings import settings
         live_calculations = settings.live_calculations
 
-        time_point.parent = self
-
-        self.time_points.append(time_point)
-        if len(self.time_points) == 1:
+        # Time courses built from arrays have data but no time points until they are persisted
+        if len(self.time_points) == 0 and not self._time_points_pending:
             self.trial_identifier = time_point.trial_identifier
-            self.pd_series = pd.Series([time_point.data],index=[time_point.time])
+            self.pd_series = None
         else:
-            if self.time_points[-1].trial_identifier.unique_single_trial() \
-                    != self.time_points[-2].trial_identifier.unique_single_trial():
-                print(self.time_points[-1].trial_identifier)
-                print(self.time_points[-2].trial_identifier)
+            trial_identifier = self.time_points[0].trial_identifier if self.time_points else self.trial_identifier
+            if time_point.trial_identifier.unique_single_trial() != trial_identifier.unique_single_trial():
+                print(time_point.trial_identifier)
+                print(trial_identifier)
 
                 raise Exception("Attempted to add time point with non-matching identifier")
 
-            # Check if ordering is broken
-            if self.time_points[-1].time < self.time_points[-2].time:
-                self.time_points.sort(key=lambda timePoint: timePoint.time)
-                self.pd_series = pd.Series([timePoint.data for timePoint in self.time_points],
-                                           index=[timePoint.time for timePoint in self.time_points])
-            else:
-                # Otherwise simply append
-                self.pd_series = self.pd_series.append(pd.Series([time_point.data],index=[time_point.time]))
-
-        if sum(self.pd_series.index.duplicated()) > 0:
-            print(self.pd_series)
-            print(self.trial_identifier)
-            print(time_point.trial_identifier)
-            raise Exception('Duplicate time points found, this is not supported - likely an identifier input error')
+        # Inserted in order, duplicate times raise an exception
+        index = self._insert_point(time_point.time, time_point.data)
+        time_point.parent = self
+        if not self._time_points_pending:
+            self.time_points.insert(index, time_point)
+        self.invalidate_calculations()
 
-        if len(self.time_points) > 6 and live_calculations:
-            self.gradient = np.gradient(self.data_vector) / np.gradient(self.time_vector)
+        if self._size > 6 and live_calculations:
+            self._gradient = np.gradient(self.data_vector) / np.gradient(self.time_vector)
 
     def curve_fit_data(self):
         raise Exception('This must be implemented in a child')
@@ -432,6 +763,19 @@ class TimeCourse(Base):
         #           'to be appropriate to the analyte type.')
 
 
+@event.listens_for(Session, 'before_flush')
+def generate_pending_time_points(session, flush_context, instances):
+    """
+    Create the :class:`~TimePoint` objects for time courses which were built from arrays, before they are flushed
+    """
+    # Adding data invalidates the calculations, so persisted time courses with new data are dirty
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, TimeCourse) \
+                and getattr(instance, '_time_points_pending', False) \
+                and instance.pd_series is not None:
+            instance.generate_time_point_list()
+
+
 class Biomass(TimeCourse):
     fit_type = 'gompertz'
     id = Column(Integer,ForeignKey('time_course.id'),primary_key=True)
@@ -445,16 +789,6 @@ class Biomass(TimeCourse):
         'polymorphic_identity': 'biomass',
     }
 
-    @property
-    def trial_identifier(self):
-        return self._trial_identifier
-
-    @trial_identifier.setter
-    def trial_identifier(self, trial_identifier):
-        self._trial_identifier = trial_identifier
-
-
-
     def curve_fit_data(self):
         if self.trial_identifier.analyte_type == 'biomass':
             from .settings import settings
@@ -477,26 +811,97 @@ class Biomass(TimeCourse):
                 print('Started fit')
                 print('Death phase start: ', self.death_phase_start)
 
-            result = curve_fit_dict[self.fit_type].calcFit(self.time_vector[0:self.death_phase_start],
-                                                           self.data_vector[0:self.death_phase_start])
-            # ,fit_kws = {'xatol':1E-10, 'fatol':1E-10})  # , fit_kws = {'maxfev': 20000, 'xtol': 1E-12, 'ftol': 1E-12})
-            if verbose: print('Finished fit')
-
-            for key in result.best_values:
-                temp_param = FitParameter(key, result.best_values[key])
+            t = self.time_vector[0:self.death_phase_start]
+            data = self.data_vector[0:self.death_phase_start]
+            curve_fit = curve_fit_dict[self.fit_type]
+
+            # Unchanged curves are not refit, e.g. when recalculating after changing blanks or stages
+            cache_key = None
+            fit = None
+            if settings.use_fit_cache:
+                cache_key = fit_cache.make_key(self.fit_type, curve_fit.method, t, data,
+                                               curve_fit.get_parameter_hints(t, data))
+                fit = fit_cache.get(cache_key)
+
+            if fit is None:
+                result = curve_fit.calcFit(t, data)
+                # ,fit_kws = {'xatol':1E-10, 'fatol':1E-10})  # , fit_kws = {'maxfev': 20000, 'xtol': 1E-12, 'ftol': 1E-12})
+                if verbose: print('Finished fit')
+                if verbose: print(result.fit_report())
+
+                fit = {'best_values': dict(result.best_values),
+                       'chisqr'     : result.chisqr,
+                       'nfev'       : result.nfev,
+                       'success'    : bool(getattr(result, 'success', True))}
+                if cache_key is not None:
+                    fit_cache.put(cache_key, fit)
+            elif verbose:
+                print('Found fit in cache')
+
+            for key in fit['best_values']:
+                temp_param = FitParameter(key, fit['best_values'][key])
                 self.fit_params[key] = temp_param  # result.best_values[key]
 
             if verbose:
                 import matplotlib.pyplot as plt
                 plt.figure()
-                plt.plot(self.time_vector[0:self.death_phase_start], self.data_vector[0:self.death_phase_start], 'bo')
-                plt.plot(self.time_vector[0:self.death_phase_start], result.best_fit, 'r-')
-
-            if verbose: print(result.fit_report())
+                plt.plot(t, data, 'bo')
+                plt.plot(t, curve_fit.growthEquation(t, **fit['best_values']), 'r-')
         else:
             raise Exception('Incorrect analyte_type')
 
 
+def batch_curve_fit(time_courses):
+    """
+    Fit the biomass time courses at once with :meth:`CurveFitObject.calcFitBatch`, grouped by fit type. The fit
+    parameters are set on the time courses, which are then not refit by `calculate`.
+
+    Parameters
+    ----------
+    time_courses : list of :class:`~TimeCourse`
+        Time courses which are not biomass, or have too few points to fit, are skipped
+    """
+    groups = {}
+    for time_course in time_courses:
+        if isinstance(time_course, Biomass) \
+                and time_course.trial_identifier.analyte_type == 'biomass' \
+                and time_course.pd_series is not None \
+                and len(time_course.data_vector) > time_course.minimum_points_for_curve_fit:
+            groups.setdefault(time_course.fit_type, []).append(time_course)
+
+    from .settings import settings
+
+    for fit_type, group in groups.items():
+        curve_fit = curve_fit_dict[fit_type]
+        fits = [None] * len(group)
+        cache_keys = [None] * len(group)
+        t_list, data_list = [], []
+        for i, time_course in enumerate(group):
+            if time_course.remove_death_phase_flag:
+                time_course.find_death_phase(time_course.data_vector)
+            t_list.append(time_course.time_vector[0:time_course.death_phase_start])
+            data_list.append(time_course.data_vector[0:time_course.death_phase_start])
+            if settings.use_fit_cache:
+                cache_keys[i] = fit_cache.make_key(fit_type, 'batch', t_list[i], data_list[i],
+                                                   curve_fit.get_parameter_hints(t_list[i], data_list[i]))
+                fits[i] = fit_cache.get(cache_keys[i])
+
+        # Only fit the curves which weren't found in the cache
+        missing = [i for i, fit in enumerate(fits) if fit is None]
+        if missing:
+            result = curve_fit.calcFitBatch([t_list[i] for i in missing], [data_list[i] for i in missing])
+            for i, best_values, chisqr, nfev, success in zip(missing, result.best_values, result.chisqr,
+                                                             result.nfev, result.success):
+                fits[i] = {'best_values': best_values, 'chisqr': float(chisqr), 'nfev': int(nfev),
+                           'success': bool(success)}
+                if cache_keys[i] is not None:
+                    fit_cache.put(cache_keys[i], fits[i])
+
+        for time_course, fit in zip(group, fits):
+            time_course.fit_params = {key: FitParameter(key, value) for key, value in fit['best_values'].items()}
+            time_course._prefit = True
+
+
 class Substrate(TimeCourse):
     fit_type = None
     id = Column(Integer,ForeignKey('time_course.id'),primary_key=True)
@@ -1,18 +1,11 @@
 import sqlite3 as sql
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from .AnalyteData import TimeCourse, Biomass, Product, Substrate, Reporter
+from .AnalyteData import TimeCourse, Biomass, Product, Substrate, Reporter, batch_curve_fit
 from .ReplicateTrial import ReplicateTrial
 from .SingleTrial import SingleTrial
 
-try:
-    from pyexcel_xlsx import get_data
-except ImportError as e:
-    print('Could not import pyexcel')
-    print(e)
-    pass
-
-import matplotlib.pyplot as plt
 import numpy as np
 
 from warnings import warn
@@ -56,6 +49,9 @@ class Experiment(Base):
         self.stage_indices = []
         self.blank = None
 
+        # Whether the calculations need to be redone, see `invalidate_calculations`
+        self.calculations_uptodate = False
+
         # self.info_keys = ['import_date', 'experiment_start_date', 'experiment_end_date', 'experiment_title',
         #                   'primary_scientist_name', 'secondary_scientist_name', 'medium_base', 'medium_supplements',
         #                   'notes']
@@ -123,23 +119,116 @@ class Experiment(Base):
     def replicate_trials(self):
         return list(self.replicate_trial_dict.values())
 
-    def calculate(self):
+    def calculate(self, workers=None, recalculate_all=False):
+        """
+        Calculate the replicate trials which changed since the last calculation. Blanks are calculated first, since
+        they are required for subtraction, and the replicate trials using a recalculated blank are recalculated.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of processes used to calculate the replicate trials which are not blanks,
+            defaults to settings.calculation_workers
+        recalculate_all : bool
+            Recalculate all replicate trials, e.g. after the settings were changed
+        """
+        from .settings import settings
+        if workers is None:
+            workers = settings.calculation_workers
+
+        if recalculate_all:
+            self.invalidate_calculations(recursive=True)
+
         t0 = time.time()
         print('Analyzing data...', end='')
 
+        changed_keys = [replicate_key for replicate_key, replicate in self.replicate_trial_dict.items()
+                        if not getattr(replicate, 'calculations_uptodate', False)]
+
+        if settings.perform_curve_fit and settings.batch_curve_fit:
+            batch_curve_fit([time_course for replicate_key in changed_keys
+                             for time_course in self.replicate_trial_dict[replicate_key].get_time_courses()
+                             if not time_course.calculations_uptodate])
+
         # Precalculate the blank stats, otherwise they won't be available for subtraction
-        if self.blank_key_list:
-            for replicate_key in self.blank_key_list:
+        calculated_blanks = []
+        for replicate_key in self.blank_key_list:
+            if replicate_key in changed_keys:
+                self.replicate_trial_dict[replicate_key].calculate()
+                if self.stage_indices:
+                    self.replicate_trial_dict[replicate_key].calculate_stages(self.stage_indices)
+                calculated_blanks.append(self.replicate_trial_dict[replicate_key])
+
+        replicate_keys = [replicate_key for replicate_key in self.replicate_trial_dict if
+                          replicate_key not in self.blank_key_list
+                          and (replicate_key in changed_keys
+                               or any(self.replicate_trial_dict[replicate_key].blank is blank
+                                      for blank in calculated_blanks))]
+        if workers > 1:
+            self.calculate_parallel(replicate_keys, workers)
+        else:
+            for replicate_key in replicate_keys:
                 self.replicate_trial_dict[replicate_key].calculate()
                 if self.stage_indices:
                     self.replicate_trial_dict[replicate_key].calculate_stages(self.stage_indices)
 
-        for replicate_key in [replicate_key for replicate_key in self.replicate_trial_dict if
-                              replicate_key not in self.blank_key_list]:
-            self.replicate_trial_dict[replicate_key].calculate()
-            if self.stage_indices:
-                self.replicate_trial_dict[replicate_key].calculate_stages(self.stage_indices)
-        print("Ran analysis in %0.1fs\n" % ((time.time() - t0)))
+        self.calculations_uptodate = True
+        print("Ran analysis of %i replicate trials in %0.1fs\n" % (len(calculated_blanks) + len(replicate_keys),
+                                                                     time.time() - t0))
+
+    def invalidate_calculations(self, recursive=False):
+        """
+        Marks the calculations of the experiment to be redone by the next `calculate`
+
+        Parameters
+        ----------
+        recursive : bool
+            Also mark all of the replicate trials, single trials and time courses
+        """
+        self.calculations_uptodate = False
+        if recursive:
+            for replicate in self.replicate_trial_dict.values():
+                replicate.calculations_uptodate = False
+                for time_course in replicate.get_time_courses():
+                    time_course.calculations_uptodate = False
+                for single_trial in replicate.single_trial_dict.values():
+                    single_trial.calculations_uptodate = False
+
+    def calculate_parallel(self, replicate_keys, workers):
+        """
+        Subtract the blanks, calculate the analytes of replicate trials in a process pool, and merge the results
+        back into the replicate trials. The statistics are then calculated in this process.
+
+        Parameters
+        ----------
+        replicate_keys : list
+            Keys of the replicate trials to calculate
+        workers : int
+            Number of processes
+        """
+        from .settings import settings
+        settings_dict = dict(vars(settings))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for replicate_key in replicate_keys:
+                # The blank is subtracted before the analytes are copied to be calculated, a blank which was
+                # already subtracted is only subtracted again where it changed
+                if self.replicate_trial_dict[replicate_key].blank:
+                    self.replicate_trial_dict[replicate_key].substract_blank()
+                time_courses = self.replicate_trial_dict[replicate_key].get_time_courses()
+                future = executor.submit(calculate_time_courses, settings_dict,
+                                         [time_course.get_calculation_copy() for time_course in time_courses])
+                futures[future] = (replicate_key, time_courses)
+
+            for future in as_completed(futures):
+                replicate_key, time_courses = futures[future]
+                for time_course, results in zip(time_courses, future.result()):
+                    time_course.set_calculation_results(results)
+
+                self.replicate_trial_dict[replicate_key].calculate(calculate_analytes=False)
+                if self.stage_indices:
+                    self.replicate_trial_dict[replicate_key].calculate_stages(self.stage_indices)
 
     def data(self):
         data = []
@@ -189,6 +278,36 @@ class Experiment(Base):
         """
         replicateTrial.parent = self
         self.replicate_trial_dict[replicateTrial.trial_identifier.unique_replicate_trial()] = replicateTrial
+        self.invalidate_calculations()
+
+    def save(self, path, **kwargs):
+        """
+        Save the raw data and fit parameters to a directory of Parquet files, see :func:`~impact.storage.save_experiment`
+
+        Parameters
+        ----------
+        path : str
+            Directory to save to
+        """
+        from ..storage import save_experiment
+        save_experiment(self, path, **kwargs)
+
+    @classmethod
+    def load(cls, path, strains=None, analytes=None, **kwargs):
+        """
+        Load an experiment saved with :meth:`save`, see :func:`~impact.storage.load_experiment`
+
+        Parameters
+        ----------
+        path : str
+            Directory the experiment was saved to
+        strains : list of str, optional
+            Strain names to load, defaults to all strains
+        analytes : list of str, optional
+            Analyte names to load, defaults to all analytes
+        """
+        from ..storage import load_experiment
+        return load_experiment(path, strains=strains, analytes=analytes, **kwargs)
 
     def parse_raw_data(self, *args, **kwargs):
         """
@@ -203,6 +322,104 @@ class Experiment(Base):
         from ..parsers import parse_raw_data
         parse_raw_data(experiment=self, *args, **kwargs)
 
+    def parse_many(self, file_names, **kwargs):
+        """
+        Parse many files into the experiment in parallel, see :func:`~impact.parsers.parse_many`
+
+        Parameters
+        ----------
+        file_names : list
+            Paths to the files
+        """
+        from ..parsers import parse_many
+        parse_many(file_names, experiment=self, **kwargs)
+
+    def append_time_point_arrays(self, trial_identifiers, identifier_index, times, values):
+        """
+        Adds a batch of measurements, e.g. one plate read, to a running experiment. Measurements of existing time
+        courses are appended to their data, and the gradients, features and replicate statistics are updated from
+        the first added time, so the cost is proportional to the number of new measurements. New time courses are
+        added to their replicate trials, whose statistics are then calculated in full. Blank subtraction, death
+        phases and curve fits are left to the next `calculate`.
+
+        Parameters
+        ----------
+        trial_identifiers : list
+            :class:`~TimeCourseIdentifier` objects with analyte_name and analyte_type set
+        identifier_index : array
+            Index into trial_identifiers for each measurement
+        times : array
+            Time of each measurement
+        values : array
+            Value of each measurement
+        """
+        from ..parsers import parse_time_point_arrays
+
+        identifier_index = np.asarray(identifier_index, dtype=int)
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+
+        # Group the measurements by identifier, and find their time course
+        order = np.argsort(identifier_index, kind='mergesort')
+        indices, starts = np.unique(identifier_index[order], return_index=True)
+        arrays = {}
+        replicates = {}
+        new_measurements = []
+        for index, group in zip(indices, np.split(order, starts[1:])):
+            trial_identifier = trial_identifiers[index]
+            replicate = self.replicate_trial_dict.get(trial_identifier.unique_replicate_trial())
+            single_trial = None if replicate is None \
+                else replicate.single_trial_dict.get(replicate.single_trial_key(trial_identifier))
+            if single_trial is not None and trial_identifier.analyte_name in single_trial.analyte_dict:
+                arrays.setdefault(single_trial, {})[trial_identifier.analyte_name] = (times[group], values[group])
+                replicates[single_trial] = replicate
+            else:
+                new_measurements.append(group)
+
+        start_times = {}
+        for single_trial, single_trial_arrays in arrays.items():
+            start_time = single_trial.append_arrays(single_trial_arrays)
+            replicate_start_times = start_times.setdefault(replicates[single_trial], {})
+            # The features of the other analytes depend on the added data as well
+            for analyte_name in single_trial.analyte_dict:
+                replicate_start_times[analyte_name] = min(replicate_start_times.get(analyte_name, np.inf), start_time)
+
+        # Time courses which aren't in the experiment yet are added to their single and replicate trials
+        changed_replicates = []
+        if new_measurements:
+            group = np.concatenate(new_measurements)
+            for replicate in parse_time_point_arrays(trial_identifiers, identifier_index[group], times[group],
+                                                     values[group]):
+                key = replicate.trial_identifier.unique_replicate_trial()
+                if key not in self.replicate_trial_dict:
+                    self.add_replicate_trial(replicate)
+                    changed_replicates.append(replicate)
+                    continue
+
+                existing_replicate = self.replicate_trial_dict[key]
+                for single_trial in replicate.single_trials:
+                    replicate_id = existing_replicate.single_trial_key(single_trial.trial_identifier)
+                    if replicate_id in existing_replicate.single_trial_dict:
+                        for analyte_data in list(single_trial.analyte_dict.values()):
+                            existing_replicate.single_trial_dict[replicate_id].add_analyte_data(analyte_data)
+                    else:
+                        existing_replicate.add_replicate(single_trial)
+                changed_replicates.append(existing_replicate)
+
+        for replicate in changed_replicates:
+            replicate.calculate_statistics()
+        for replicate, replicate_start_times in start_times.items():
+            if not any(replicate is changed_replicate for changed_replicate in changed_replicates):
+                replicate.update_statistics(replicate_start_times)
+
+    def append_raw_data(self, *args, **kwargs):
+        """
+        Parse a file, e.g. a plate read of a running experiment, and add its measurements to the experiment, see
+        :func:`~impact.parsers.append_raw_data`
+        """
+        from ..parsers import append_raw_data
+        append_raw_data(self, *args, **kwargs)
+
     def set_blanks(self, mode='auto', common_id='environment'):
         """
         Define how to associate blanks and perform blank subtraction.
@@ -270,6 +487,25 @@ class Experiment(Base):
                 replicate.calculate_stages()
 
 
+def calculate_time_courses(settings_dict, time_courses):
+    """
+    Calculate time courses and return their results, used as the process pool worker for `Experiment.calculate`
+
+    Parameters
+    ----------
+    settings_dict : dict
+        Settings of the parent process
+    time_courses : list
+        Copies of the time courses from `TimeCourse.get_calculation_copy`
+    """
+    from .settings import settings
+    vars(settings).update(settings_dict)
+
+    for time_course in time_courses:
+        time_course.calculate()
+    return [time_course.get_calculation_results() for time_course in time_courses]
+
+
 class Stage(Experiment):
     __tablename__ = 'stage'
 
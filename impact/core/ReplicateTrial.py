@@ -1,11 +1,10 @@
 # coding=utf-8
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy import stats
 
 from .AnalyteData import TimeCourse, FitParameter
+from .outliers import find_outlier_replicates
 from .SingleTrial import SingleTrial, SpecificProductivityFactory, ProductYieldFactory
 from .TrialIdentifier import ReplicateTrialIdentifier
 from .settings import settings
@@ -19,6 +18,32 @@ from sqlalchemy import Column, Integer, ForeignKey, PickleType, String, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.collections import attribute_mapped_collection
 
+def replicate_statistics(matrix):
+    """
+    Calculates the mean and sample standard deviation of each row of a time x replicate matrix, ignoring
+    missing (NaN) values
+
+    Parameters
+    ----------
+    matrix : 2-D array
+        Rows are time points, columns are replicates
+
+    Returns
+    -------
+    mean, std : arrays
+    """
+    matrix = np.asarray(matrix, dtype=float).reshape(len(matrix), -1)
+    valid = ~np.isnan(matrix)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, matrix, 0).sum(axis=1) / count
+        deviation = np.where(valid, matrix - mean[:, None], 0)
+        std = np.sqrt((deviation ** 2).sum(axis=1) / (count - 1))
+    mean[count == 0] = np.nan
+    std[count < 2] = np.nan
+    return mean, std
+
+
 class ReplicateTrial(Base):
     """
     This object stores SingleTrial objects and calculates statistics on these replicates for each of the
@@ -70,6 +95,9 @@ class ReplicateTrial(Base):
         self.stages = []
         self.features = []
 
+        # Whether the calculations need to be redone, see `invalidate_calculations`
+        self.calculations_uptodate = False
+
         for arg in kwargs:
             setattr(self,arg,kwargs[arg])
 
@@ -81,16 +109,50 @@ class ReplicateTrial(Base):
     def single_trials(self):
         return list(self.single_trial_dict.values())
 
-    def calculate(self):
+    def calculate(self, calculate_analytes=True):
+        """
+        Subtracts the blank, calculates the analytes which changed and calculates the statistics
+
+        Parameters
+        ----------
+        calculate_analytes : bool
+            Set False if the blank has already been subtracted and the analytes calculated, e.g. in another process
+        """
+        # The analytes are calculated from the blank subtracted data
+        if self.blank and calculate_analytes:  self.substract_blank()
+
         for stage in self.stages:
-            stage.calculate()
+            stage.calculate(calculate_analytes)
 
-        for single_trial in self.single_trial_dict.values():
-            single_trial.calculate()
+        if calculate_analytes:
+            for single_trial in self.single_trial_dict.values():
+                single_trial.calculate()
 
-        if self.blank:  self.substract_blank()
         self.calculate_statistics()
 
+        # The analytes may have been calculated in another process
+        for single_trial in self.single_trial_dict.values():
+            for analyte_data in single_trial.analyte_dict.values():
+                analyte_data.calculations_uptodate = True
+            single_trial.calculations_uptodate = True
+        self.calculations_uptodate = True
+
+    def invalidate_calculations(self):
+        """
+        Marks the calculations of this replicate trial and its experiment to be redone by the next `calculate`
+        """
+        self.calculations_uptodate = False
+        if self.parent is not None:
+            self.parent.invalidate_calculations()
+
+    def get_time_courses(self):
+        """
+        Returns the analytes of all single trials, including those of the stages
+        """
+        return [analyte for stage in self.stages for analyte in stage.get_time_courses()] \
+               + [analyte for single_trial in self.single_trial_dict.values()
+                  for analyte in single_trial.analyte_dict.values()]
+
     # def serialize(self):
     #     serialized_dict = {}
     #
@@ -135,6 +197,13 @@ class ReplicateTrial(Base):
                 raise Exception(
                     "the replicates do not have the same uniqueID, either the uniqueID includes too much information or the strains don't match")
 
+    @staticmethod
+    def single_trial_key(trial_identifier):
+        """
+        Returns the key of the single trial of an identifier in the single_trial_dict, the replicate_id as a string
+        """
+        return str(1 if trial_identifier.replicate_id is None else trial_identifier.replicate_id)
+
     # @event.listens_for(SingleTrial, 'load')
     def add_replicate(self, single_trial):
         """
@@ -148,11 +217,12 @@ class ReplicateTrial(Base):
         from .settings import settings
         live_calculations = settings.live_calculations
 
-        if str(single_trial.trial_identifier.replicate_id) in self.single_trial_dict.keys():
+        key = self.single_trial_key(single_trial.trial_identifier)
+        if key in self.single_trial_dict.keys():
             print(single_trial.trial_identifier)
             print(self.trial_identifier)
             raise Exception('Duplicate replicate id: '
-                            + str(single_trial.trial_identifier.replicate_id)
+                            + key
                             + '.\nCurrent ids: '
                             + str(self.single_trial_dict.keys()))
 
@@ -160,9 +230,11 @@ class ReplicateTrial(Base):
             single_trial.trial_identifier.replicate_id = 1
 
         # Get info from single trial
-        self.single_trial_dict[str(single_trial.trial_identifier.replicate_id)] = single_trial
+        self.single_trial_dict[key] = single_trial
+        single_trial.parent = self
+        self.invalidate_calculations()
         if len(self.single_trial_dict) == 1:
-            self.t = self.single_trial_dict[str(single_trial.trial_identifier.replicate_id)].t
+            self.t = self.single_trial_dict[key].t
             self.trial_identifier = single_trial.trial_identifier.get_replicate_trial_trial_identifier()
         else:
             for attr in ['strain', 'media', 'environment', 'id_1', 'id_2']:
@@ -195,10 +267,12 @@ class ReplicateTrial(Base):
             self.avg.analyte_dict[analyte] = TimeCourse()
             self.std.analyte_dict[analyte] = TimeCourse()
 
+            # Get all the trials with the analyte
+            trial_list = [single_trial for single_trial in self.single_trial_dict.values()
+                          if analyte in single_trial.analyte_dict]
+
             # Copy a relevant trial identifier
-            first_st = [single_trial for single_trial in self.single_trial_dict.values()
-                        if analyte in single_trial.analyte_dict][0]
-            # first_st = list(self.single_trial_dict.values())[0]
+            first_st = trial_list[0]
             try:
                 self.avg.analyte_dict[analyte].trial_identifier = \
                         first_st\
@@ -215,75 +289,125 @@ class ReplicateTrial(Base):
                 print(first_st.analyte_dict)
                 raise Exception(e)
 
-            # self.std.analyte_dict[analyte].trial_identifier = \
-            #     self.single_trial_dict[list(self.single_trial_dict.keys())[0]]\
-            #         .analyte_dict[analyte]\
-            #         .trial_identifier.\
-            #         get_analyte_data_statistic_identifier()
-
-            self.replicate_df[analyte] = pd.DataFrame()
+            # Align the replicates on the union of their time indices, with one column per replicate
+            self.replicate_df[analyte] = pd.concat(
+                [trial.analyte_dict[analyte].pd_series.rename(str(trial.trial_identifier.replicate_id))
+                 for trial in trial_list], axis=1).sort_index()
 
-            # Get all the trials with the analyte
-            trial_list = [self.single_trial_dict[replicate_id] for replicate_id in self.single_trial_dict
-                          if analyte in self.single_trial_dict[replicate_id].analyte_dict]
-
-            # Merge the dataframes for relevant trials
-            for trial in trial_list:
-                self.replicate_df[analyte] = pd.merge(self.replicate_df[analyte],
-                                                      pd.DataFrame({str(trial.trial_identifier.replicate_id):
-                                                                        trial.analyte_dict[analyte].pd_series}),
-                                                      left_index=True,
-                                                      right_index=True,
-                                                      how='outer')
             # Remove outliers
             self.prune_bad_replicates(analyte)
 
             # Set statistics
-            self.avg.analyte_dict[analyte].pd_series = self.replicate_df[analyte].mean(axis=1)
-            self.std.analyte_dict[analyte].pd_series = self.replicate_df[analyte].std(axis=1)
+            avg, std = replicate_statistics(self.replicate_df[analyte].values)
+            self.avg.analyte_dict[analyte].pd_series = pd.Series(avg, index=self.replicate_df[analyte].index)
+            self.std.analyte_dict[analyte].pd_series = pd.Series(std, index=self.replicate_df[analyte].index)
 
             # Calculate statistics for features
             for feature in self.features:
                 # Get all the analytes with the feature
-                trial_list = [self.single_trial_dict[replicate_id]
-                              for replicate_id in self.single_trial_dict
-                              if analyte in self.single_trial_dict[replicate_id].analyte_dict
-                              and feature.name in self.single_trial_dict[replicate_id].analyte_dict[analyte].__dict__]
-
-
-
-                # Merge them all, in case they don't share the same index (missing data)
-                df = pd.DataFrame()
-                for trial in trial_list:
-                    df = df.merge(pd.DataFrame({
-                        str(trial.trial_identifier.replicate_id):
-                            pd.Series(getattr(trial.analyte_dict[analyte], feature.name).data,
-                                      index=trial.analyte_dict[analyte].time_vector)}),
-                                  left_index=True,right_index=True,how='outer')
+                feature_trial_list = [trial for trial in trial_list
+                                      if feature.name in trial.analyte_dict[analyte].__dict__]
+
+                # Align them all, in case they don't share the same index (missing data)
+                if feature_trial_list:
+                    df = pd.concat([pd.Series(getattr(trial.analyte_dict[analyte], feature.name).data,
+                                              index=trial.analyte_dict[analyte].time_vector,
+                                              name=str(trial.trial_identifier.replicate_id))
+                                    for trial in feature_trial_list], axis=1).sort_index()
+                    avg, std = replicate_statistics(df.values)
+                    avg, std = pd.Series(avg, index=df.index), pd.Series(std, index=df.index)
+                else:
+                    avg, std = pd.Series(dtype=float), pd.Series(dtype=float)
 
                 # Calculate and set the feature statistics
-                setattr(self.avg.analyte_dict[analyte],feature.name, pd.Series(df.mean(axis=1)))
-                setattr(self.std.analyte_dict[analyte], feature.name, pd.Series(df.std(axis=1)))
+                setattr(self.avg.analyte_dict[analyte], feature.name, avg)
+                setattr(self.std.analyte_dict[analyte], feature.name, std)
 
         # Calculate fit param stats
         for analyte in unique_analytes:
-            for stat, calc in zip(['avg', 'std'], [np.mean, np.std]):
-                # If a fit_params exists, calculate the stats
-                if None not in [self.single_trial_dict[replicate_id].analyte_dict[analyte].fit_params
-                                if analyte in self.single_trial_dict[replicate_id].analyte_dict else None
-                                for replicate_id in self.single_trial_dict]:
-                    temp = dict()
-                    for param in self.single_trial_dict[list(self.single_trial_dict.keys())[0]].analyte_dict[analyte].fit_params:
-                        temp[param] = FitParameter(param,calc(
-                            [self.single_trial_dict[replicate_id].analyte_dict[analyte].fit_params[param].parameter_value
-                             for replicate_id in self.single_trial_dict
-                             if self.single_trial_dict[replicate_id].trial_identifier.replicate_id not in self.bad_replicates]))
-
-                    getattr(self, stat).analyte_dict[analyte].fit_params = temp
-                # else:
-                #     print([self.single_trial_dict[replicate_id].analyte_dict[analyte].fit_params
-                #            for replicate_id in self.single_trial_dict
-                #            if analyte in self.single_trial_dict[replicate_id].analyte_dict])
+            # If the analyte exists in every replicate, calculate the stats
+            if all(analyte in single_trial.analyte_dict for single_trial in self.single_trial_dict.values()):
+                param_names = list(self.single_trial_dict[list(self.single_trial_dict.keys())[0]]
+                                   .analyte_dict[analyte].fit_params)
+                rows = [[single_trial.analyte_dict[analyte].fit_params[param].parameter_value
+                         for param in param_names]
+                        for single_trial in self.single_trial_dict.values()
+                        if str(single_trial.trial_identifier.replicate_id) not in self.bad_replicates]
+                values = np.array(rows, dtype=float).reshape(len(rows), len(param_names))
+
+                for stat, calc in zip(['avg', 'std'], [np.mean, np.std]):
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        param_stats = calc(values, axis=0)
+                    getattr(self, stat).analyte_dict[analyte].fit_params = \
+                        {param: FitParameter(param, value) for param, value in zip(param_names, param_stats)}
+
+    def update_statistics(self, start_times):
+        """
+        Updates the statistics from a time for each analyte, after measurements were added to the single trials.
+        Only the rows from that time are calculated, the replicates removed as outliers by the last
+        `calculate_statistics` stay removed. Analytes without statistics are calculated in full.
+
+        Parameters
+        ----------
+        start_times : dict
+            Time from which each analyte changed, see :meth:`~SingleTrial.append_arrays`
+        """
+        for analyte, start_time in start_times.items():
+            if analyte not in self.replicate_df or analyte not in self.avg.analyte_dict:
+                self.calculate_statistics()
+                return
+
+            trial_list = [single_trial for single_trial in self.single_trial_dict.values()
+                          if analyte in single_trial.analyte_dict]
+            # The columns of replicates removed as outliers are left out
+            replicate_df = self.replicate_df[analyte]
+            tail_df = self._align_tails([trial.analyte_dict[analyte].tail(start_time) for trial in trial_list],
+                                        [str(trial.trial_identifier.replicate_id) for trial in trial_list])
+            tail_df = tail_df[replicate_df.columns]
+            self.replicate_df[analyte] = pd.concat([replicate_df[replicate_df.index < start_time], tail_df])
+
+            # Set statistics
+            avg, std = replicate_statistics(tail_df.values)
+            for stat, values in zip(['avg', 'std'], [avg, std]):
+                time_course = getattr(self, stat).analyte_dict[analyte]
+                series = time_course.pd_series
+                time_course.pd_series = pd.concat([series[series.index < start_time],
+                                                   pd.Series(values, index=tail_df.index)])
+                time_course.invalidate_calculations()
+
+            # Update statistics for features
+            for feature in self.features:
+                feature_trial_list = [trial for trial in trial_list
+                                      if feature.name in trial.analyte_dict[analyte].__dict__]
+                if not feature_trial_list:
+                    continue
+
+                tails = []
+                for trial in feature_trial_list:
+                    times = trial.analyte_dict[analyte].tail(start_time)[0]
+                    data = getattr(trial.analyte_dict[analyte], feature.name).data
+                    if data is None:
+                        data = np.full(len(times), np.nan)
+                    tails.append((times, np.asarray(data, dtype=float)[len(data) - len(times):]))
+                df = self._align_tails(tails, [str(trial.trial_identifier.replicate_id)
+                                               for trial in feature_trial_list])
+                avg, std = replicate_statistics(df.values)
+                for stat, values in zip(['avg', 'std'], [avg, std]):
+                    series = getattr(getattr(self, stat).analyte_dict[analyte], feature.name)
+                    setattr(getattr(self, stat).analyte_dict[analyte], feature.name,
+                            pd.concat([series[series.index < start_time], pd.Series(values, index=df.index)]))
+
+    @staticmethod
+    def _align_tails(tails, columns):
+        """
+        Aligns the time and data arrays of several replicates on the union of their times, with one column per
+        replicate
+        """
+        times = np.unique(np.concatenate([tail_times for tail_times, _ in tails] + [[]]))
+        matrix = np.full((len(times), len(tails)), np.nan)
+        for j, (tail_times, data) in enumerate(tails):
+            matrix[np.searchsorted(times, tail_times), j] = data
+        return pd.DataFrame(matrix, index=times, columns=columns)
 
     def get_analytes(self):
         # Get all unique analytes
@@ -304,89 +428,49 @@ class ReplicateTrial(Base):
         # http://stackoverflow.com/questions/23199796/detect-and-exclude-outliers-in-pandas-dataframe
         df = self.replicate_df[analyte]
         col_names = list(df.columns.values)
-        backup = self.replicate_df[analyte]
 
         if outlier_cleaning_flag and len(col_names) > 2:
-            outlier_removal_method = 'iterative_removal'
-            # Method one for outlier removal
-            if outlier_removal_method == 'z_score':
-                fraction_outlier_pts = np.sum(np.abs(stats.zscore(df)) < 1, axis=0) / len(df)
-                print(fraction_outlier_pts)
-                bad_replicates = [col_name for i, col_name in enumerate(col_names) if fraction_outlier_pts[i] < 0.8]
-                # good_replicates = (np.abs(stats.zscore(df)) < 3).all(axis=0)  # Find any values > 3 std from mean
-                # if bad_replicates.any():
-                print(bad_replicates)
-                if bad_replicates:
-                    good_replicate_cols = [col_names[x] for x, col_name in enumerate(bad_replicates)
-                                           if col_name not in bad_replicates]
-                else:
-                    good_replicate_cols = col_names
-                bad_replicate_cols = [col_names[x] for x, col_name in enumerate(bad_replicates)
-                                      if col_name in bad_replicates]
-                print('good', good_replicate_cols)
-                print('bad: ', bad_replicate_cols)
-
-            # method 2 for outlier removal (preferred)
-            # this method removal each replicate one by one, and if the removal of a replicate reduces the std
-            # by a certain threshold, the replicate is flagged as removed
-            if outlier_removal_method == 'iterative_removal':
-                bad_replicate_cols = []
-                good_replicate_cols = []
-
-                # Determine the max number of replicates to remove
-                for _ in range(int(len(df) * max_fraction_replicates_to_remove)):
-                    # A value between 0 and 1, > 1 means removing the replicate makes the yield worse
-                    std_deviation_cutoff = 0.1
-                    # df = pd.DataFrame({key: np.random.randn(5) for key in ['a', 'b', 'c']})
-                    temp_std_by_mean = {}
-                    for temp_remove_replicate in list(df.columns.values):
-                        indices = [replicate for i, replicate in enumerate(df.columns.values) if
-                                   replicate != temp_remove_replicate]
-                        temp_remove_replicate_df = df[indices]
-                        temp_mean = temp_remove_replicate_df.mean(axis=1)
-                        temp_std = temp_remove_replicate_df.std(axis=1)
-                        temp_std_by_mean[temp_remove_replicate] = np.mean(abs(temp_std / temp_mean))
-
-                    temp_min_val = min([temp_std_by_mean[key] for key in temp_std_by_mean])
-                    if temp_min_val < std_deviation_cutoff:
-                        bad_replicate_cols.append([key for key in temp_std_by_mean if temp_std_by_mean[key] == temp_min_val][0])
-
-                    good_replicate_cols = [key for key in temp_std_by_mean if key not in bad_replicate_cols]
-                    df = df[good_replicate_cols]
+            # The preferred method (iterative_removal) removes replicates one by one, and if the removal of a
+            # replicate reduces the coefficient of variation below a threshold, the replicate is flagged as removed
+            bad_replicate_cols = [col_names[i] for i in find_outlier_replicates(
+                df.values,
+                method=settings.outlier_removal_method,
+                max_fraction_replicates_to_remove=max_fraction_replicates_to_remove)]
+            good_replicate_cols = [col_name for col_name in col_names if col_name not in bad_replicate_cols]
+
             self.replicate_df[analyte] = df[good_replicate_cols]
             self.bad_replicates = bad_replicate_cols
             # Plot the results of replicate removal
             if verbose:
+                import matplotlib.pyplot as plt
                 plt.figure()
                 try:
                     if good_replicate_cols:
-                        plt.plot(backup[good_replicate_cols], 'r')
+                        plt.plot(df[good_replicate_cols], 'r')
                     if bad_replicate_cols:
-                        plt.plot(backup[bad_replicate_cols], 'b')
+                        plt.plot(df[bad_replicate_cols], 'b')
                     plt.title(self.trial_identifier.unique_replicate_trial())
                 except Exception as e:
                     print(e)
-            del backup
 
     def set_blank(self, replicate_trial):
         self.blank = replicate_trial
+        self.invalidate_calculations()
 
     def substract_blank(self):
         # Check which analytes have blanks defined
         analytes_with_blanks = self.blank.get_analytes()
 
-        # Remove from each analyte and then redo calculations
-        self.blank_subtracted_analytes = []
-
-        # for blank_analyte in analytes_with_blanks:
+        # Remove from each analyte, the analytes which were already subtracted only change if the blank did
         for single_trial_key in self.single_trial_dict:
             single_trial = self.single_trial_dict[single_trial_key]
             for blank_analyte in analytes_with_blanks:
-                single_trial.analyte_dict[blank_analyte].data_vector = \
-                    single_trial.analyte_dict[blank_analyte].data_vector \
-                    - self.blank.avg.analyte_dict[blank_analyte].data_vector
+                if blank_analyte in single_trial.analyte_dict:
+                    single_trial.analyte_dict[blank_analyte].subtract_blank(
+                        self.blank.avg.analyte_dict[blank_analyte])
 
-        self.blank_subtracted_analytes.append(blank_analyte)
+        self.blank_subtracted_analytes = [blank_analyte for blank_analyte in analytes_with_blanks
+                                          if blank_analyte in self.get_analytes()]
 
     def get_unique_analytes(self):
         return list(set([analyte
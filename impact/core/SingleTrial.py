@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from .TrialIdentifier import SingleTrialIdentifier
@@ -45,11 +46,15 @@ class SingleTrial(Base):
         # Trial identifier with relevant features common to the trial
         self._trial_identifier = None
 
+        # Dataframe containing all of the analytes with a common index, built when first read
+        self._analyte_df = None
+
         # Analyte objects
         self.analyte_dict = dict()
 
-        # Dataframe containing all of the analytes with a common index
-        self.analyte_df = pd.DataFrame()
+        # The replicate trial to which the single trial belongs, and whether its calculations need to be redone
+        self.parent = None  # type ReplicateTrial
+        self.calculations_uptodate = False
 
         # Contains information about the stages used in the experiment, TODO
         self.stage_indices = None
@@ -109,6 +114,26 @@ class SingleTrial(Base):
             stage = self.create_stage(stage)
             self.stage_list.append(stage)
 
+    @property
+    def analyte_df(self):
+        if getattr(self, '_analyte_df', None) is None:
+            if self.analyte_dict:
+                # A single concat and reindex allows different time indices for different analytes
+                self._analyte_df = pd.concat([analyte_data.pd_series.rename(analyte_name)
+                                              for analyte_name, analyte_data in self.analyte_dict.items()],
+                                             axis=1).sort_index()
+            else:
+                self._analyte_df = pd.DataFrame()
+        return self._analyte_df
+
+    @analyte_df.setter
+    def analyte_df(self, analyte_df):
+        self._analyte_df = analyte_df
+
+    @property
+    def t(self):
+        return self.analyte_df.index
+
     @property
     def trial_identifier(self):
         return self._trial_identifier
@@ -119,9 +144,62 @@ class SingleTrial(Base):
 
         self.analyte_name = trial_identifier.analyte_name
 
+    def invalidate_calculations(self):
+        """
+        Marks the calculations of this single trial and its ancestors to be redone by the next `calculate`. The
+        features of all analytes are reset, since they depend on the other analytes.
+        """
+        self.calculations_uptodate = False
+        self._analyte_df = None
+        for analyte_data in self.analyte_dict.values():
+            analyte_data.reset_features()
+
+        if getattr(self, 'parent', None) is not None:
+            self.parent.invalidate_calculations()
+
     def calculate(self):
+        """
+        Calculates the analytes which changed since they were last calculated
+        """
         for analyte_key in self.analyte_dict:
-            self.analyte_dict[analyte_key].calculate()
+            if not self.analyte_dict[analyte_key].calculations_uptodate:
+                self.analyte_dict[analyte_key].calculate()
+        self.calculations_uptodate = True
+
+    def append_arrays(self, arrays):
+        """
+        Adds measurements to the analytes, see :meth:`~TimeCourse.append_arrays`, and updates the features of all
+        analytes from the first added point
+
+        Parameters
+        ----------
+        arrays : dict
+            Time and data arrays for each analyte name
+
+        Returns
+        -------
+        float
+            Time from which the gradients and features changed
+        """
+        # The features are cleared when the data changes, keep them to be updated
+        features = [feature for analyte_data in self.analyte_dict.values()
+                    for feature in list(vars(analyte_data).values()) if isinstance(feature, MultiAnalyteFeature)]
+        previous = [dict(vars(feature)) for feature in features]
+
+        start = None
+        start_time = np.inf
+        for analyte_name, (times, values) in arrays.items():
+            if len(times) == 0:
+                continue
+            analyte_data = self.analyte_dict[analyte_name]
+            index = analyte_data.append_arrays(times, values)
+            start = index if start is None else min(start, index)
+            start_time = min(start_time, analyte_data.time_at(max(index - 1, 0)))
+
+        if start is not None:
+            for feature, previous_attributes in zip(features, previous):
+                feature.update(start, previous_attributes)
+        return start_time
 
     def normalize_data(self, normalize_to):
         for product in self.product_names:
@@ -326,19 +404,20 @@ class SingleTrial(Base):
         analyte_data.parent = self
 
         self.trial_identifier.time = None
-
-        # Pandas support
-        temp_analyte_df = pd.DataFrame()
-        temp_analyte_df[analyte_data.trial_identifier.analyte_name] = analyte_data.pd_series
-
-        # Merging the dataframes this way will allow different time indices for different analytes
-        self.analyte_df = pd.merge(self.analyte_df,temp_analyte_df,left_index=True,right_index=True, how='outer')
-        self.t = self.analyte_df.index
+        self.invalidate_calculations()
 
     def link_identifiers(self, trial_identifier, attrs=['strain','media','environment']):
         for attr in attrs:
             setattr(self.trial_identifier,attr,getattr(trial_identifier,attr))
 
+@event.listens_for(SingleTrial.analyte_dict, 'append')
+@event.listens_for(SingleTrial.analyte_dict, 'remove')
+def invalidate_analyte_df(target, value, initiator):
+    """
+    The analyte_df is rebuilt when the analytes change
+    """
+    target._analyte_df = None
+
 # Register known features
 for feature in [ProductYieldFactory,SpecificProductivityFactory]:
     SingleTrial.register_feature(feature)
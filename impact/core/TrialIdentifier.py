@@ -1,14 +1,104 @@
 from ..database import Base, create_session
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, UniqueConstraint, event
 from sqlalchemy.orm import relationship, reconstructor
 from warnings import warn
 from sqlalchemy.orm.collections import attribute_mapped_collection
+import weakref
+
+def get_group_id(key, group_ids):
+    """
+    Returns the integer group id for a key, equal keys share the same id. The ids are interned in group_ids, which
+    is owned by the caller, e.g. for one parse, so they are released with it.
+    """
+    return group_ids.setdefault(key, len(group_ids))
+
+
+def get_key_str(value):
+    """
+    Returns the string of an identifier attribute, using the cached string for identifiers
+    """
+    if isinstance(value, TrialIdentifierMixin):
+        return value.get_cached_key('str', value.__str__)
+    return str(value)
+
 
 class TrialIdentifierMixin(object):
     # eq_attrs = []
     # __table_args__ = (UniqueConstraint(*eq_attrs),)
 
+    # Attributes used to build the cached keys, a change to any of these invalidates the cache
+    key_attrs = []
+
+    def __setattr__(self, key, value):
+        old_value = self.__dict__.get(key, None)
+        super().__setattr__(key, value)
+
+        if key in self.key_attrs and old_value is not value:
+            if isinstance(value, TrialIdentifierMixin) or old_value != value:
+                self.invalidate_keys()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_cached_keys', None)
+        state.pop('_key_owners', None)
+        return state
+
+    def get_cached_key(self, name, calculate_key):
+        """
+        Returns a cached key, calculating it if it isn't cached. The cache is invalidated when one of the key_attrs
+        of this identifier, or of the identifiers it is built from, changes.
+
+        Parameters
+        ----------
+        name : str
+            Name of the cached key
+        calculate_key : function
+            Function to calculate the key if it isn't cached
+        """
+        cached_keys = self.__dict__.get('_cached_keys')
+        if cached_keys is None:
+            cached_keys = self.__dict__['_cached_keys'] = {}
+
+        if name not in cached_keys:
+            cached_keys[name] = calculate_key()
+
+            # Invalidate this cache if any identifier it is built from changes
+            for attr in self.key_attrs:
+                value = getattr(self, attr, None)
+                if isinstance(value, dict):
+                    value = list(value.values())
+                elif not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    if isinstance(item, TrialIdentifierMixin):
+                        item._add_key_owner(self)
+
+        return cached_keys[name]
+
+    def invalidate_keys(self):
+        """
+        Clears the cached keys for this identifier and all identifiers which are built from it
+        """
+        cached_keys = self.__dict__.get('_cached_keys')
+        if cached_keys:
+            cached_keys.clear()
+
+        owners = self.__dict__.get('_key_owners')
+        if owners:
+            # Owners register again when they recalculate their keys
+            owner_list = list(owners.values())
+            owners.clear()
+            for owner in owner_list:
+                owner.invalidate_keys()
+
+    def _add_key_owner(self, owner):
+        # Keyed by id, since identifiers hash by value
+        owners = self.__dict__.get('_key_owners')
+        if owners is None:
+            owners = self.__dict__['_key_owners'] = weakref.WeakValueDictionary()
+        owners[id(owner)] = owner
+
     def __eq__(self, other):
         if not isinstance(other,self.__class__):
             return False
@@ -59,6 +149,7 @@ class Knockout(Base, TrialIdentifierMixin):
     parent = Column(Integer, ForeignKey('strain.id'))
 
     eq_attrs = ['gene','parent']
+    key_attrs = ['gene']
 
     def __str__(self):
         return str(self.gene)
@@ -71,6 +162,7 @@ class Plasmid(Base, TrialIdentifierMixin):
     strain = Column(Integer, ForeignKey('strain.id'))
 
     eq_attrs = ['name','strain']
+    key_attrs = ['name']
 
     def __str__(self):
         return str(self.name)
@@ -94,6 +186,7 @@ class Strain(Base, TrialIdentifierMixin):
     id_2 = Column(String)
 
     eq_attrs = ['name','formal_name','plasmids','knockouts','parent','id_1','id_2']
+    key_attrs = ['name','plasmids','knockouts','id_1','id_2']
     # __table_args__ = (UniqueConstraint(*eq_attrs),)
 
     # UniqueConstraint('name','formal_name','plasmids','knockouts','parent','id_1','id_2')
@@ -148,6 +241,7 @@ class MediaComponent(Base, TrialIdentifierMixin):
     name = Column(String,unique=True)
 
     eq_attrs = ['name']
+    key_attrs = ['name']
 
     def __init__(self, name):
         self.name = name
@@ -168,8 +262,10 @@ class ComponentConcentration(Base, TrialIdentifierMixin):
     component = relationship("MediaComponent", cascade='all')
 
     concentration = Column(Float)
+    unit = Column(String)
 
     eq_attrs = ['media','component','concentration']
+    key_attrs = ['media_component','concentration','unit']
 
 
     def __init__(self, component, concentration, unit='a.u.', **kwargs):
@@ -182,6 +278,10 @@ class ComponentConcentration(Base, TrialIdentifierMixin):
         self.unit = unit
         self.concentration = concentration
 
+    @reconstructor
+    def init_on_load(self):
+        self.media_component = MediaComponent(self.component_name)
+
     def _convert_units(self):
         if not self.units_converted:
             if self._unit == '%':
@@ -207,6 +307,7 @@ class Media(Base, TrialIdentifierMixin):
     # unit = Column(String)
 
     eq_attrs = ['name', 'formal_name', 'components', 'parent']
+    key_attrs = ['name', 'components', 'parent']
 
 
     def __init__(self, concentration=None, unit='a.u.', **kwargs):
@@ -262,6 +363,7 @@ class Environment(Base, TrialIdentifierMixin):
     temperature = Column(Float)
 
     eq_attrs = ['labware', 'shaking_speed', 'shaking_diameter', 'temperature']
+    key_attrs = ['labware', 'shaking_speed', 'temperature']
 
     # @reconstructor
     def __init__(self, labware=None, **kwargs):
@@ -288,6 +390,7 @@ class Labware(Base, TrialIdentifierMixin):
     name = Column(String,unique=True)
 
     eq_attrs = ['name']
+    key_attrs = ['name']
 
     def __init__(self, name=None):
         self.name = name
@@ -335,7 +438,8 @@ class ReplicateTrialIdentifier(Base, TrialIdentifierMixin):
     strain = relationship("Strain")
 
     media_name = Column(String, ForeignKey('media.name'))
-    media = relationship("Media")
+    media_id = Column(Integer, ForeignKey('media.id'))
+    media = relationship("Media", foreign_keys=[media_id])
 
     environment_id = Column(Integer, ForeignKey('environment.id'))
     environment = relationship('Environment')
@@ -345,6 +449,7 @@ class ReplicateTrialIdentifier(Base, TrialIdentifierMixin):
     id_3 = Column(String)
 
     eq_attrs = ['strain','media','environment','id_1','id_2','id_3']
+    key_attrs = ['strain','media','environment','id_1','id_2','id_3','replicate_id','analyte_name']
 
     # @reconstructor
     def __init__(self, strain=None, media=None, environment=None):
@@ -471,7 +576,8 @@ class ReplicateTrialIdentifier(Base, TrialIdentifierMixin):
                 self.time = float(tempParsedIdentifier[4])
 
     def unique_time_point(self):
-        return self.unique_single_trial()+' '+self.analyte_name
+        return self.get_cached_key('time_point',
+                                   lambda: self.unique_single_trial()+' '+self.analyte_name)
 
     def unique_analyte_data(self):
         """
@@ -482,22 +588,37 @@ class ReplicateTrialIdentifier(Base, TrialIdentifierMixin):
         else:
             an = ''
 
-        return self.unique_single_trial() + ' ' + an
+        return self.get_cached_key('analyte_data', lambda: self.unique_single_trial() + ' ' + an)
 
     def unique_single_trial(self):
         """
         Returns a string identifying the unique attribute of a single trial
         """
-        return self.unique_replicate_trial() + ' ' + str(self.replicate_id)
+        return self.get_cached_key('single_trial',
+                                   lambda: self.unique_replicate_trial() + ' ' + str(self.replicate_id))
 
     def unique_replicate_trial(self):
         """
         Returns a string identifying the unique attribute of a replicate trial
         """
-        return ' '.join([str(getattr(self, attr))
-                         for attr in ['strain', 'media', 'environment', 'id_1',
-                                      'id_2', 'id_3']
-                         if str(getattr(self, attr) != '')])
+        return self.get_cached_key('replicate_trial',
+                                   lambda: ' '.join([get_key_str(getattr(self, attr))
+                                                     for attr in ['strain', 'media', 'environment', 'id_1',
+                                                                  'id_2', 'id_3']
+                                                     if str(getattr(self, attr) != '')]))
+
+    def get_group_id(self, level, group_ids):
+        """
+        Returns an integer id for the unique key of this identifier, identifiers with equal keys share the same id
+
+        Parameters
+        ----------
+        level : str
+            'replicate_trial', 'single_trial', 'analyte_data' or 'time_point'
+        group_ids : dict
+            Ids of the keys seen so far, shared by the identifiers which are grouped together
+        """
+        return get_group_id(getattr(self, 'unique_' + level)(), group_ids)
 
     def get_analyte_data_statistic_identifier(self):
         ti = TimeCourseIdentifier()
@@ -554,3 +675,11 @@ class TimeCourseIdentifier(SingleTrialIdentifier):
     def __str__(self):
         return "strain: %s,\tmedia: %s,\tenv: %s,\tanalyte: %s,\trep: %s" % (self.strain,self.media,self.environment,self.analyte_name,self.replicate_id)
 
+
+def _invalidate_collection_keys(target, value, initiator):
+    target.invalidate_keys()
+
+# Collections are modified in place, which bypasses __setattr__
+for collection in [Strain.plasmids, Strain.knockouts, Media.components]:
+    event.listen(collection, 'append', _invalidate_collection_keys)
+    event.listen(collection, 'remove', _invalidate_collection_keys)
@@ -13,6 +13,25 @@ class MultiAnalyteFeature(object):
     def data(self):
         return 'Not implemented'
 
+    def reset(self):
+        """
+        Clears the calculated data, it is calculated again when next read
+        """
+        pass
+
+    def update(self, start, previous):
+        """
+        Updates the calculated data from index start, after measurements were added
+
+        Parameters
+        ----------
+        start : int
+            Index of the first added measurement
+        previous : dict
+            The attributes of the feature before the measurements were added
+        """
+        pass
+
 # class YieldTimePoint(object):
 #     __tablename__ = 'yield_time_point'
 #
@@ -31,9 +50,26 @@ class ProductYield(MultiAnalyteFeature):
 
     @property
     def data(self):
-        self.calculate()
+        if self.product_yield is None:
+            self.calculate()
         return self.product_yield
 
+    def reset(self):
+        self.product_yield = None
+        self.substrate_consumed = None
+
+    def update(self, start, previous):
+        product = self.product.data_vector
+        substrate = self.substrate.data_vector
+        # The yield is relative to the first measurement, and the analytes must share their time points
+        if previous['product_yield'] is None or start == 0 or len(product) != len(substrate):
+            return
+
+        substrate_consumed = substrate[0] - substrate[start:]
+        self.substrate_consumed = np.concatenate([previous['substrate_consumed'][:start], substrate_consumed])
+        self.product_yield = np.concatenate([previous['product_yield'][:start],
+                                             np.divide(product[start:] - product[0], substrate_consumed)])
+
     def calculate(self):
         self.calculate_substrate_consumed()
         try:
@@ -122,6 +158,22 @@ class SpecificProductivity(MultiAnalyteFeature):
 
         return self.specific_productivity
 
+    def reset(self):
+        self.specific_productivity = None
+
+    def update(self, start, previous):
+        if self.biomass is None or previous['specific_productivity'] is None or start == 0:
+            return
+
+        # The gradient of the point before the first added point changes as well
+        start -= 1
+        gradient = self.analyte.gradient
+        biomass = self.biomass.data_vector
+        if len(gradient) != len(biomass):
+            return
+        self.specific_productivity = np.concatenate([previous['specific_productivity'][:start],
+                                                     gradient[start:] / biomass[start:]])
+
     def calculate(self):
         """
         Calculate the specific productivity (dP/dt) given :math:`dP/dt = k_{Product} * X`
@@ -131,7 +183,7 @@ class SpecificProductivity(MultiAnalyteFeature):
 
         try:
             if len(self.analyte.data_vector) > 2:
-                self.analyte.calculate()    # Need gradient calculated before accessing
+                # The gradient is calculated when read, and cleared when the data changes
                 self.specific_productivity = self.analyte.gradient / self.biomass.data_vector
         except Exception as e:
             print(self.analyte.data_vector)
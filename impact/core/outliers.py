@@ -0,0 +1,155 @@
+"""
+Detection of outlier replicates in a time x replicate matrix
+"""
+
+import numpy as np
+
+
+def leave_one_out_statistics(matrix):
+    """
+    Calculates the mean and sample standard deviation of each row with each column left out, in closed form from
+    the row sums. Missing (NaN) values are ignored.
+
+    Parameters
+    ----------
+    matrix : 2-D array
+        Rows are time points, columns are replicates
+
+    Returns
+    -------
+    mean, std : 2-D arrays
+        The statistics of row i without column j at [i, j]
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    valid = ~np.isnan(matrix)
+
+    # Center each row, the sums of squares lose precision otherwise
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(valid, matrix, 0).sum(axis=1, keepdims=True) / valid.sum(axis=1, keepdims=True)
+    shift[np.isnan(shift)] = 0
+    x = np.where(valid, matrix - shift, 0)
+
+    count = valid.sum(axis=1, keepdims=True) - valid
+    total = x.sum(axis=1, keepdims=True) - x
+    total_squares = (x ** 2).sum(axis=1, keepdims=True) - x ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        std = np.sqrt(np.clip(total_squares - total * mean, 0, None) / (count - 1))
+    mean[count == 0] = np.nan
+    std[count < 2] = np.nan
+    return mean + shift, std
+
+
+def iterative_removal_scores(matrix, std_deviation_cutoff=0.1):
+    """
+    The mean coefficient of variation of the replicates with each replicate left out. The replicate whose removal
+    gives the lowest coefficient of variation is removed, if it is below std_deviation_cutoff.
+    """
+    mean, std = leave_one_out_statistics(matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.abs(std / mean)
+    counts = np.sum(~np.isnan(cv), axis=0)
+    scores = np.where(counts > 0, np.nansum(cv, axis=0) / np.maximum(counts, 1), np.inf)
+    candidate = int(np.argmin(scores))
+    return candidate, scores[candidate] < std_deviation_cutoff
+
+
+def z_score_scores(matrix, threshold=3, max_outlier_fraction=0.2):
+    """
+    The fraction of time points at which a replicate is more than threshold standard deviations from the mean of
+    the other replicates
+    """
+    mean, std = leave_one_out_statistics(matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        flagged = np.abs(matrix - mean) / std > threshold
+    return _outlier_fraction_candidate(matrix, flagged, max_outlier_fraction)
+
+
+def mad_scores(matrix, threshold=3.5, max_outlier_fraction=0.2):
+    """
+    The fraction of time points at which a replicate is more than threshold scaled median absolute deviations from
+    the median of the replicates
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        median = np.nanmedian(matrix, axis=1, keepdims=True)
+        mad = 1.4826 * np.nanmedian(np.abs(matrix - median), axis=1, keepdims=True)
+        flagged = np.abs(matrix - median) / mad > threshold
+    return _outlier_fraction_candidate(matrix, flagged, max_outlier_fraction)
+
+
+def grubbs_scores(matrix, alpha=0.05, max_outlier_fraction=0.2):
+    """
+    The fraction of time points at which a replicate is the outlier detected by the two-sided Grubbs test
+    """
+    from scipy import stats
+
+    valid = ~np.isnan(matrix)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, matrix, 0).sum(axis=1) / count
+        std = np.sqrt((np.where(valid, matrix - mean[:, None], 0) ** 2).sum(axis=1) / (count - 1))
+        G = np.abs(matrix - mean[:, None]) / std[:, None]
+
+        t = stats.t.ppf(1 - alpha / (2 * count), count - 2)
+        G_critical = (count - 1) / np.sqrt(count) * np.sqrt(t ** 2 / (count - 2 + t ** 2))
+
+    G = np.where(np.isnan(G), -np.inf, G)
+    flagged = np.zeros(matrix.shape, dtype=bool)
+    rows = np.flatnonzero((count > 2) & np.isfinite(G_critical))
+    worst = np.argmax(G[rows], axis=1)
+    flagged[rows, worst] = G[rows, worst] > G_critical[rows]
+    return _outlier_fraction_candidate(matrix, flagged, max_outlier_fraction)
+
+
+def _outlier_fraction_candidate(matrix, flagged, max_outlier_fraction):
+    counts = np.sum(~np.isnan(matrix), axis=0)
+    scores = np.sum(flagged, axis=0) / np.maximum(counts, 1)
+    candidate = int(np.argmax(scores))
+    return candidate, scores[candidate] > max_outlier_fraction
+
+
+outlier_methods = {'iterative_removal': iterative_removal_scores,
+                   'z_score'          : z_score_scores,
+                   'mad'              : mad_scores,
+                   'grubbs'           : grubbs_scores}
+
+
+def find_outlier_replicates(matrix, method='iterative_removal', max_fraction_replicates_to_remove=0.2,
+                            **kwargs):
+    """
+    Finds outlier replicates, removing the worst replicate one at a time
+
+    Parameters
+    ----------
+    matrix : 2-D array
+        Rows are time points, columns are replicates, missing data is NaN
+    method : str
+        One of outlier_methods: iterative_removal, z_score, mad or grubbs
+    max_fraction_replicates_to_remove : float
+        At most round(number of replicates * max_fraction_replicates_to_remove) replicates are removed, at least
+        one if the fraction isn't 0, and at least two are kept
+    kwargs
+        Passed to the method, e.g. threshold
+
+    Returns
+    -------
+    list of int
+        Columns of the outlier replicates, in the order they were removed
+    """
+    if method not in outlier_methods:
+        raise Exception('Unknown outlier removal method: ' + str(method))
+
+    matrix = np.asarray(matrix, dtype=float)
+    remaining = list(range(matrix.shape[1]))
+    removed = []
+    # Allow at least one removal, otherwise triplicates are never cleaned with the default fraction
+    max_removals = int(round(matrix.shape[1] * max_fraction_replicates_to_remove))
+    if max_fraction_replicates_to_remove > 0:
+        max_removals = max(1, max_removals)
+    max_removals = min(max_removals, matrix.shape[1] - 2)
+    for _ in range(max_removals):
+        candidate, remove = outlier_methods[method](matrix[:, remaining], **kwargs)
+        if not remove:
+            break
+        removed.append(remaining.pop(candidate))
+    return removed
@@ -1,7 +1,7 @@
 import os.path
 from ..database import Base
 
-from sqlalchemy import Column, Boolean, Float, Integer
+from sqlalchemy import Column, Boolean, Float, Integer, String
 Base = object
 
 try:
@@ -18,6 +18,7 @@ class Settings(Base):
     # general
     verbose = Column(Boolean)
     live_calculations = Column(Boolean)   # Perform calculation on the fly
+    calculation_workers = Column(Integer)   # Number of processes used by Experiment.calculate
 
     # database
     db_name = os.path.join(os.path.dirname(__file__), '../db/impact_db.sqlite3')
@@ -28,16 +29,20 @@ class Settings(Base):
     minimum_points_for_curve_fit = Column(Integer)
     savgolFilterWindowSize = Column(Integer)  # Must be odd
     perform_curve_fit = Column(Boolean)
+    batch_curve_fit = Column(Boolean)   # Fit all biomass curves at once in Experiment.calculate
+    use_fit_cache = Column(Boolean)     # Reuse fits of unchanged curves, see curve_fitting.fit_cache
 
     # replicate
     max_fraction_replicates_to_remove = Column(Float)
     default_outlier_cleaning_flag = Column(Boolean)
     outlier_cleaning_flag = Column(Boolean)
+    outlier_removal_method = Column(String)  # iterative_removal, z_score, mad or grubbs
 
     def __init__(self):
         # general
         self.verbose = False
         self.live_calculations = False  # Perform calculation on the fly
+        self.calculation_workers = 1    # Number of processes used by Experiment.calculate
 
         # database
         self.db_name = os.path.join(os.path.dirname(__file__), '../db/impact_db.sqlite3')
@@ -48,11 +53,14 @@ class Settings(Base):
         self.minimum_points_for_curve_fit = 5
         self.savgolFilterWindowSize = 17  # Must be odd
         self.perform_curve_fit = False
+        self.batch_curve_fit = False    # Fit all biomass curves at once in Experiment.calculate
+        self.use_fit_cache = True       # Reuse fits of unchanged curves, see curve_fitting.fit_cache
 
         # replicate
         self.max_fraction_replicates_to_remove = 1/5
         self.default_outlier_cleaning_flag = False
         self.outlier_cleaning_flag = False
+        self.outlier_removal_method = 'iterative_removal'   # iterative_removal, z_score, mad or grubbs
 
         # curve_fitting
         self.fit_type = {}
@@ -1,2 +1,4 @@
 from .core import *
-from .methods import curve_fit_dict
\ No newline at end of file
+from .batch import BatchFitResult, stack_curves
+from .cache import FitCache, fit_cache
+from .methods import curve_fit_dict
@@ -0,0 +1,163 @@
+"""
+Functions for fitting many curves at once
+"""
+
+import numpy as np
+
+
+class BatchFitResult(object):
+    """
+    Results of fitting a stack of curves with :meth:`CurveFitObject.calcFitBatch`
+
+    Attributes:
+        param_names: names of the fit parameters, in the order of the columns of values
+        values: best fit values, shape (n_curves, n_params)
+        success: True where the fit converged
+        fallback: True where the curve was refit with lmfit
+        nfev: number of function evaluations for each curve
+        chisqr: sum of squared residuals for each curve
+    """
+
+    def __init__(self, param_names, values, success, nfev, chisqr):
+        self.param_names = param_names
+        self.values = values
+        self.success = success
+        self.nfev = nfev
+        self.chisqr = chisqr
+        self.fallback = np.zeros(len(values), dtype=bool)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def best_values(self):
+        return [dict(zip(self.param_names, row)) for row in self.values]
+
+
+def stack_curves(t_list, data_list):
+    """
+    Stack curves of different lengths into 2-D arrays, padded with NaN
+
+    Parameters:
+        t_list: list of time vectors
+        data_list: list of data vectors
+
+    Returns:
+        t, data: arrays of shape (n_curves, max_points)
+    """
+    n_points = max([len(t) for t in t_list] + [0])
+    t = np.full((len(t_list), n_points), np.nan)
+    data = np.full((len(t_list), n_points), np.nan)
+    for i, (t_i, data_i) in enumerate(zip(t_list, data_list)):
+        t[i, :len(t_i)] = t_i
+        data[i, :len(data_i)] = data_i
+    return t, data
+
+
+def levenberg_marquardt(func, t, data, p0, lower, upper, vary, jacobian=None,
+                        max_iter=200, ftol=1.5e-8, xtol=1.5e-8):
+    """
+    Bounded Levenberg-Marquardt least squares, vectorized over a stack of curves. Steps are clipped to the
+    bounds, and each curve keeps its own damping factor.
+
+    Parameters:
+        func: model evaluated as func(t, p), where t has shape (n, n_points) and p has shape (n, n_params)
+        t: times, shape (n_curves, n_points), NaN where padded
+        data: data, shape (n_curves, n_points), NaN where padded or missing
+        p0, lower, upper: initial guesses and bounds, shape (n_curves, n_params). Bounds may be infinite.
+        vary: bool for each parameter, fixed parameters are kept at p0
+        jacobian: optional function jacobian(t, p) returning the partial derivatives of func with
+            shape (n, n_points, n_params), otherwise forward differences are used
+        max_iter: maximum number of iterations
+        ftol: relative reduction in the sum of squares for convergence
+        xtol: relative step size for convergence
+
+    Returns:
+        p, success, nfev, chisqr
+    """
+    mask = np.isfinite(t) & np.isfinite(data)
+    t = np.where(mask, t, 0)
+    data = np.where(mask, data, 0)
+    n_curves, n_params = p0.shape
+    free = np.flatnonzero(vary)
+    step = np.sqrt(np.finfo(float).eps)
+
+    def residuals(p, idx):
+        with np.errstate(all='ignore'):
+            return np.where(mask[idx], func(t[idx], p) - data[idx], 0)
+
+    def sum_of_squares(r):
+        cost = np.sum(r ** 2, axis=1)
+        cost[~np.isfinite(cost)] = np.inf
+        return cost
+
+    def jacobian_of(p, r, idx):
+        if jacobian is not None:
+            with np.errstate(all='ignore'):
+                return jacobian(t[idx], p)[:, :, free] * mask[idx][:, :, None]
+        J = np.empty((len(idx), t.shape[1], len(free)))
+        for k, j in enumerate(free):
+            h = step * np.maximum(np.abs(p[:, j]), 1)
+            p_h = p.copy()
+            p_h[:, j] += h
+            J[:, :, k] = (residuals(p_h, idx) - r) / h[:, None]
+        return J
+
+    all_curves = np.arange(n_curves)
+    p = np.clip(np.array(p0, dtype=float), lower, upper)
+    r = residuals(p, all_curves)
+    cost = sum_of_squares(r)
+    nfev = np.ones(n_curves, dtype=int)
+    damping = np.full(n_curves, 1e-3)
+    success = cost == 0
+    active = np.isfinite(cost) & ~success & (np.sum(mask, axis=1) >= len(free))
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        J = jacobian_of(p[idx], r[idx], idx)
+        nfev[idx] += len(free) if jacobian is None else 1
+        finite = np.all(np.isfinite(J), axis=(1, 2))
+        active[idx[~finite]] = False
+        idx, J = idx[finite], J[finite]
+
+        # Parameters at a bound which the gradient pushes further out are held for this step
+        gradient = np.einsum('nij,ni->nj', J, r[idx])
+        held = ((p[idx][:, free] <= lower[idx][:, free]) & (gradient > 0)) | \
+               ((p[idx][:, free] >= upper[idx][:, free]) & (gradient < 0))
+        J = J * ~held[:, None, :]
+        gradient[held] = 0
+        JtJ = np.einsum('nij,nik->njk', J, J)
+        diagonal = np.maximum(np.diagonal(JtJ, axis1=1, axis2=2), 1e-12)
+        A = JtJ + (damping[idx, None] * diagonal)[:, :, None] * np.eye(len(free))
+        try:
+            delta = np.linalg.solve(A, -gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            delta = np.einsum('njk,nk->nj', np.linalg.pinv(A), -gradient)
+
+        p_new = p[idx].copy()
+        p_new[:, free] += delta
+        p_new = np.clip(p_new, lower[idx], upper[idx])
+        r_new = residuals(p_new, idx)
+        cost_new = sum_of_squares(r_new)
+        nfev[idx] += 1
+
+        improved = cost_new < cost[idx]
+        step_norm = np.linalg.norm(p_new - p[idx], axis=1)
+        converged = improved & ((cost[idx] - cost_new <= ftol * cost[idx]) |
+                                (step_norm <= xtol * (np.linalg.norm(p[idx], axis=1) + xtol)))
+
+        accepted = idx[improved]
+        p[accepted] = p_new[improved]
+        r[accepted] = r_new[improved]
+        cost[accepted] = cost_new[improved]
+        damping[accepted] = np.maximum(damping[accepted] / 10, 1e-12)
+        damping[idx[~improved]] *= 10
+
+        success[idx[converged]] = True
+        # Curves which can't be improved by a vanishingly small step are left to the caller
+        active[idx[converged | (damping[idx] > 1e10)]] = False
+
+    return p, success, nfev, np.where(np.isfinite(cost), cost, np.nan)
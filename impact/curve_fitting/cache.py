@@ -0,0 +1,104 @@
+"""
+Cache of curve fit results, keyed by a hash of the fit inputs
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FitCache(object):
+    """
+    Content-addressed cache of fit results, with an in-memory LRU tier and an optional on-disk tier of .npz files
+
+    Parameters:
+        max_size: maximum number of results kept in memory
+        directory: directory for the on-disk tier, None to only cache in memory
+
+    Each result is a dict with the following form:
+        {'best_values': {PARAMETER NAME: float},
+        'chisqr': float,
+        'nfev': int,
+        'success': bool}
+    """
+
+    def __init__(self, max_size=10000, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def make_key(fit_type, method, t, data, hints):
+        """
+        Returns the hash of the fit inputs: the model name, the fit method, the arrays and the parameter hints
+        """
+        key = hashlib.sha1()
+        key.update(repr((fit_type, method)).encode())
+        key.update(np.ascontiguousarray(t, dtype=float).tobytes())
+        key.update(b'|')
+        key.update(np.ascontiguousarray(data, dtype=float).tobytes())
+        key.update(repr([(hint['name'], _float_or_none(hint['value']), _float_or_none(hint['min']),
+                          _float_or_none(hint['max']), bool(hint['vary'])) for hint in hints]).encode())
+        return key.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the result for key, or None if it is not cached
+        """
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return self._results[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as stored:
+                result = {'best_values': dict(zip(stored['param_names'].tolist(), stored['values'].tolist())),
+                          'chisqr'     : float(stored['chisqr']),
+                          'nfev'       : int(stored['nfev']),
+                          'success'    : bool(stored['success'])}
+            self._store(key, result)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self._store(key, result)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            np.savez(self._path(key),
+                     param_names=np.array(list(result['best_values'].keys())),
+                     values=np.array(list(result['best_values'].values()), dtype=float),
+                     chisqr=result['chisqr'], nfev=result['nfev'], success=result['success'])
+
+    def clear(self):
+        """
+        Clears the in-memory tier, files in the on-disk tier are kept
+        """
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+
+def _float_or_none(value):
+    return None if value is None else float(value)
+
+
+fit_cache = FitCache()
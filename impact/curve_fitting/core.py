@@ -3,7 +3,8 @@ Functions for curve fitting
 """
 
 import numpy as np
-from lmfit import Model
+
+from .batch import BatchFitResult, stack_curves, levenberg_marquardt
 
 class CurveFitObject(object):
     """
@@ -21,42 +22,145 @@ class CurveFitObject(object):
             def growthEquation(t, param1, param2, ..): return f(param1,param2,..)
 
         method: lmfit method (slsqp, leastsq)
+
+        jacobian: Partial derivatives of growthEquation with the following form:
+            def jacobian(t, param1, param2, ..): return {'param1': df/dparam1, 'param2': df/dparam2, ..}
+
+        initial_guess: Data-driven initial guesses, which override the guess in paramList:
+            def initial_guess(t, data): return {'param1': guess1, ..}
     """
 
-    def __init__(self, paramList, growthEquation, method='slsqp'):
+    def __init__(self, paramList, growthEquation, method='slsqp', jacobian=None, initial_guess=None):
         self.paramList = paramList
         self.growthEquation = growthEquation
-        self.gmod = Model(growthEquation)
+        self._gmod = None
         self.method = method
+        self.jacobian = jacobian
+        self.initial_guess = initial_guess
+
+    @property
+    def gmod(self):
+        # lmfit is slow to import, so the model is built on the first fit
+        if self._gmod is None:
+            from lmfit import Model
+            self._gmod = Model(self.growthEquation)
+        return self._gmod
+
+    def get_parameter_hints(self, t, data):
+        """
+        Returns the initial guess, bounds and vary flag of each parameter, evaluating the functions of data
+        """
+        guesses = self.initial_guess(t, data) if self.initial_guess is not None else {}
+
+        hints = []
+        for param in self.paramList:
+            hint = {'name': param['name'], 'vary': param['vary']}
+            for key, hint_name in [('guess', 'value'), ('min', 'min'), ('max', 'max')]:
+                hint[hint_name] = param[key](data) if callable(param[key]) else param[key]
+
+            if np.isfinite(guesses.get(param['name'], np.nan)):
+                hint['value'] = np.clip(guesses[param['name']],
+                                        -np.inf if hint['min'] is None else hint['min'],
+                                        np.inf if hint['max'] is None else hint['max'])
+            hints.append(hint)
+        return hints
+
+    def jacobian_matrix(self, t, values):
+        """
+        Returns the partial derivatives of growthEquation as an array of shape t.shape + (n_params,), with the
+        parameters in the order of paramList
+        """
+        partials = self.jacobian(t, **values)
+        return np.stack([np.broadcast_to(partials[param['name']], np.shape(t)) for param in self.paramList],
+                        axis=-1)
 
     def calcFit(self, t, data, **kwargs):
-        if 'method' not in kwargs:
-            method = self.method
-        else:
-            method = kwargs['method']
-
-        for param in self.paramList:
-            # Check if the parameter is a lambda function
-            temp = dict()
-            for hint in ['guess', 'min', 'max']:
-                # print('hint: ',hint,'param[hint]: ',param[hint])
-                if type(param[hint]) == type(lambda x: 0):
-                    temp[hint] = param[hint](data)
-                else:
-                    temp[hint] = param[hint]
-            self.gmod.set_param_hint(param['name'],
-                                     value=temp['guess'],
-                                     min=temp['min'],
-                                     max=temp['max'],
-                                     vary=param['vary'])
-        try:
-            params = self.gmod.make_params()
-        except Exception as e:
-            print(data)
-            print(e)
+        from lmfit import Parameters
+        method = kwargs.pop('method', self.method)
+
+        # Parameters are built for each fit rather than set as hints on the shared model, so that fits
+        # can run concurrently
+        hints = self.get_parameter_hints(t, data)
+        params = Parameters()
+        for hint in hints:
+            params.add(hint['name'], value=hint['value'], min=hint['min'], max=hint['max'], vary=hint['vary'])
+
+        # lmfit passes the jacobian to leastsq without the chain rule for its bounds transformation, so it is
+        # only used for fits without bounds
+        if self.jacobian is not None and method == 'leastsq' \
+                and all(hint['min'] is None and hint['max'] is None for hint in hints if hint['vary']):
+            fit_kws = dict(kwargs.pop('fit_kws', {}))
+            fit_kws['Dfun'] = self.lmfit_jacobian
+            kwargs['fit_kws'] = fit_kws
 
         result = self.gmod.fit(data, params, t=t, method=method, **kwargs)
-        result.fit_report()
+        return result
+
+    def lmfit_jacobian(self, params, data, weights, t, **kwargs):
+        """
+        Jacobian of the residuals for lmfit's leastsq, in the columns of the varying parameters
+        """
+        jacobian = self.jacobian_matrix(np.asarray(t, dtype=float), params.valuesdict())
+        jacobian = jacobian[:, [i for i, param in enumerate(self.paramList) if params[param['name']].vary]]
+        if weights is not None:
+            jacobian = jacobian * np.asarray(weights)[:, None]
+        return jacobian
+
+    def calcFitBatch(self, t, data, fallback=True, **kwargs):
+        """
+        Fit many curves at once with a vectorized Levenberg-Marquardt, see :func:`levenberg_marquardt`.
+        Curves which do not converge are refit with :meth:`calcFit`.
+
+        Parameters:
+            t: time vector shared by all curves, a 2-D array of shape (n_curves, n_points) or a list of vectors
+            data: 2-D array of shape (n_curves, n_points) or a list of vectors, padded or missing data is NaN
+            fallback: refit curves which do not converge with lmfit
+            kwargs: passed to :func:`levenberg_marquardt`
+
+        Returns:
+            :class:`BatchFitResult`
+        """
+        if isinstance(data, list):
+            if not isinstance(t, list):
+                t = [t] * len(data)
+            t, data = stack_curves(t, data)
+        data = np.atleast_2d(np.asarray(data, dtype=float))
+        t = np.broadcast_to(np.asarray(t, dtype=float), data.shape)
+
+        param_names = [param['name'] for param in self.paramList]
+        p0, lower, upper = (np.empty((len(data), len(param_names))) for _ in range(3))
+        for i, (t_i, data_i) in enumerate(zip(t, data)):
+            valid = np.isfinite(t_i) & np.isfinite(data_i)
+            hints = self.get_parameter_hints(t_i[valid], data_i[valid])
+            p0[i] = [hint['value'] for hint in hints]
+            lower[i] = [-np.inf if hint['min'] is None else hint['min'] for hint in hints]
+            upper[i] = [np.inf if hint['max'] is None else hint['max'] for hint in hints]
+        vary = np.array([param['vary'] for param in self.paramList], dtype=bool)
+
+        def func(t, p):
+            return self.growthEquation(t, **{name: p[:, [j]] for j, name in enumerate(param_names)})
+
+        if self.jacobian is not None:
+            kwargs.setdefault('jacobian', lambda t, p: self.jacobian_matrix(
+                t, {name: p[:, [j]] for j, name in enumerate(param_names)}))
+
+        values, success, nfev, chisqr = levenberg_marquardt(func, t, data, p0, lower, upper, vary, **kwargs)
+        result = BatchFitResult(param_names, values, success, nfev, chisqr)
+
+        if fallback:
+            for i in np.flatnonzero(~success):
+                valid = np.isfinite(t[i]) & np.isfinite(data[i])
+                try:
+                    fit = self.calcFit(t[i][valid], data[i][valid])
+                except Exception as e:
+                    print('Fit failed: ', e)
+                    continue
+                result.values[i] = [fit.best_values[name] for name in param_names]
+                result.success[i] = getattr(fit, 'success', True)
+                result.chisqr[i] = fit.chisqr
+                result.nfev[i] += fit.nfev
+                result.fallback[i] = True
+
         return result
 
 class GrowthRateSplineExtraction(object):
@@ -85,9 +189,16 @@ class GrowthRateSplineExtraction(object):
     def __init__(self, paramList, growthEquation, method='slsqp'):
         self.paramList = paramList
         self.growthEquation = growthEquation
-        self.gmod = Model(growthEquation)
+        self._gmod = None
         self.method = method
 
+    @property
+    def gmod(self):
+        if self._gmod is None:
+            from lmfit import Model
+            self._gmod = Model(self.growthEquation)
+        return self._gmod
+
     def get_growth_rate(self, t, data, **kwargs):
         from scipy.interpolate import InterpolatedUnivariateSpline
         import numpy as np
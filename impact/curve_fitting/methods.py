@@ -8,11 +8,65 @@ import numpy as np
 keys = ['name', 'guess', 'min', 'max', 'vary']
 curve_fit_dict = {}
 
+
+def estimate_growth_parameters(t, data):
+    """
+    Data-driven estimates of the features of a growth curve, used for initial guesses
+
+    Returns a dict with:
+        baseline: minimum of the data
+        plateau: maximum of the data
+        max_rate: maximum slope of the data
+        time_of_max_rate: time of the maximum slope
+        lag: time at which the tangent at the maximum slope crosses the baseline
+        specific_growth_rate: maximum slope of log(data), the exponential phase growth rate
+    """
+    t = np.asarray(t, dtype=float)
+    data = np.asarray(data, dtype=float)
+    estimates = {'baseline': np.min(data), 'plateau': np.max(data), 'max_rate': 0., 'time_of_max_rate': np.mean(t),
+                 'lag': 0., 'specific_growth_rate': 0.}
+    if len(t) < 3:
+        return estimates
+
+    # Smooth the slopes over neighbouring points, the data is noisy
+    window = np.ones(3) / 3
+    rate = np.convolve(np.gradient(data, t), window, mode='same')
+    i = np.argmax(rate[1:-1]) + 1
+    estimates['max_rate'] = max(rate[i], 0)
+    estimates['time_of_max_rate'] = t[i]
+    if rate[i] > 0:
+        estimates['lag'] = max(t[i] - (data[i] - estimates['baseline']) / rate[i], 0)
+
+    log_data = np.log(np.clip(data, np.max(np.abs(data)) * 1e-6 + 1e-12, None))
+    estimates['specific_growth_rate'] = max(np.max(np.convolve(np.gradient(log_data, t), window, mode='valid')), 0)
+    return estimates
+
 """
 Generalized logistic
 """
 def generalized_logistic(t, A, k, C, Q, K, nu):
     return A + ( (K - A) / (np.power((C + Q * np.exp(-k * t)), (1 / nu))))
+
+def generalized_logistic_jacobian(t, A, k, C, Q, K, nu):
+    x = np.exp(-k * t)
+    q = C + Q * x
+    H = np.power(q, -1 / nu)
+    dH_dq = -H / (nu * q)
+    return {'A' : 1 - H,
+            'k' : -(K - A) * dH_dq * Q * x * t,
+            'C' : (K - A) * dH_dq,
+            'Q' : (K - A) * dH_dq * x,
+            'K' : H,
+            'nu': (K - A) * H * np.log(q) / nu ** 2}
+
+def generalized_logistic_initial_guess(t, data):
+    # With C = nu = 1 the curve is logistic, with the maximum slope k * (K - A) / 4 at t = ln(Q) / k
+    estimates = estimate_growth_parameters(t, data)
+    A, K = estimates['baseline'], estimates['plateau']
+    if K <= A or estimates['max_rate'] <= 0:
+        return {}
+    k = 4 * estimates['max_rate'] / (K - A)
+    return {'A': A, 'K': K, 'k': k, 'C': 1, 'nu': 1, 'Q': np.exp(min(k * estimates['time_of_max_rate'], 50))}
 curve_fit_dict['productionEquation_generalized_logistic'] = CurveFitObject(
     [dict(zip(keys, ['A', np.min, lambda data: 0.975 * np.min(data), lambda data: 1.025 * np.min(data), True])),
      dict(zip(keys, ['k', lambda data: 50, lambda data: 0.001, 1000, True])),
@@ -21,6 +75,8 @@ curve_fit_dict['productionEquation_generalized_logistic'] = CurveFitObject(
      dict(zip(keys, ['K', max, lambda data: 0.975 * max(data), lambda data: 1.025 * max(data), True])),
      dict(zip(keys, ['nu', 1, None, None, True]))],
     generalized_logistic,
+    jacobian=generalized_logistic_jacobian,
+    initial_guess=generalized_logistic_initial_guess
 )
 curve_fit_dict['growthEquation_generalized_logistic'] = CurveFitObject(
     [dict(zip(keys, ['A', np.min, lambda data: 0.975 * np.min(data), lambda data: 1.025 * np.min(data), True])),
@@ -29,7 +85,9 @@ curve_fit_dict['growthEquation_generalized_logistic'] = CurveFitObject(
      dict(zip(keys, ['Q', 0.01, None, None, True])),
      dict(zip(keys, ['K', max, lambda data: 0.975 * max(data), lambda data: 1.025 * max(data), True])),
      dict(zip(keys, ['nu', 1, None, None, True]))],
-    generalized_logistic
+    generalized_logistic,
+    jacobian=generalized_logistic_jacobian,
+    initial_guess=generalized_logistic_initial_guess
 )
 
 curve_fit_dict['growthEquation_generalized_logistic_2'] = CurveFitObject(
@@ -41,7 +99,8 @@ curve_fit_dict['growthEquation_generalized_logistic_2'] = CurveFitObject(
      dict(zip(keys, ['K', max, lambda data: 0.975 * max(data), lambda data: 1.025 * max(data), True])),
      dict(zip(keys, ['nu', 0.5, None, None, True]))],
     generalized_logistic,
-    method='leastsq'
+    method='leastsq',
+    jacobian=generalized_logistic_jacobian
 )
 
 class Parameter(object):
@@ -126,13 +185,40 @@ class Parameter(object):
 janoschek
 """
 def janoschek(t, B, k, L, delta): return L - (L - B) * np.exp(-k * np.power(t, delta))
+
+def janoschek_jacobian(t, B, k, L, delta):
+    P = np.power(t, delta)
+    w = np.exp(-k * P)
+    P_log_t = np.where(t > 0, P * np.log(np.where(t > 0, t, 1)), 0)
+    return {'B'    : w,
+            'k'    : (L - B) * w * P,
+            'L'    : 1 - w,
+            'delta': (L - B) * w * k * P_log_t}
+
+def janoschek_initial_guess(t, data):
+    # log(-log((L - y) / (L - B))) = log(k) + delta * log(t) is linear in log(t)
+    t = np.asarray(t, dtype=float)
+    data = np.asarray(data, dtype=float)
+    B, L = np.min(data), np.max(data)
+    guess = {'B': B, 'L': L}
+    if L <= B:
+        return guess
+    fraction = (L - data) / (L - B)
+    linear = (t > 0) & (fraction > 0.05) & (fraction < 0.95)
+    if np.sum(linear) >= 2:
+        delta, log_k = np.polyfit(np.log(t[linear]), np.log(-np.log(fraction[linear])), 1)
+        guess['delta'] = delta
+        guess['k'] = np.exp(log_k)
+    return guess
 curve_fit_dict['janoschek'] = CurveFitObject(
     [dict(zip(keys, ['B', np.min, lambda data: 0.975 * np.min(data), lambda data: 1.025 * np.min(data), True])),
      dict(zip(keys, ['k', lambda data: 0.001, None, 5, True])),
      dict(zip(keys, ['delta', 1, None, None, True])),
      dict(zip(keys, ['L', max, lambda data: max(data), lambda data: 2 * max(data), True]))],
     janoschek,
-    method='slsqp'
+    method='slsqp',
+    jacobian=janoschek_jacobian,
+    initial_guess=janoschek_initial_guess
 )
 
 curve_fit_dict['janoschek_no_limits'] = CurveFitObject(
@@ -141,7 +227,9 @@ curve_fit_dict['janoschek_no_limits'] = CurveFitObject(
      dict(zip(keys, ['delta', 1, None, None, True])),
      dict(zip(keys, ['L', np.max, None, None, True]))],
     janoschek,
-    method='slsqp'
+    method='slsqp',
+    jacobian=janoschek_jacobian,
+    initial_guess=janoschek_initial_guess
 )
 
 """
@@ -149,6 +237,25 @@ curve_fit_dict['janoschek_no_limits'] = CurveFitObject(
 http://www.pisces-conservation.com/growthhelp/index.html?richards_curve.htm
 """
 def richard_5(t, B, k, L, t_m, T): return B + L / np.power(1 + T * np.exp(-k * (t - t_m)), (1 / T))
+
+def richard_5_jacobian(t, B, k, L, t_m, T):
+    x = np.exp(-k * (t - t_m))
+    q = 1 + T * x
+    G = np.power(q, -1 / T)
+    dG = np.power(q, -1 / T - 1) * x
+    return {'B'  : np.ones_like(G),
+            'k'  : L * dG * (t - t_m),
+            'L'  : G,
+            't_m': -L * dG * k,
+            'T'  : L * G * (np.log(q) / T ** 2 - x / (T * q))}
+
+def richard_5_initial_guess(t, data):
+    # With T = 1 the curve is logistic, with the maximum slope k * L / 4 at t_m
+    estimates = estimate_growth_parameters(t, data)
+    guess = {'B': estimates['baseline'], 'L': estimates['plateau'], 't_m': estimates['time_of_max_rate'], 'T': 1}
+    if estimates['plateau'] > estimates['baseline'] and estimates['max_rate'] > 0:
+        guess['k'] = 4 * estimates['max_rate'] / (estimates['plateau'] - estimates['baseline'])
+    return guess
 curve_fit_dict['richard_5'] = CurveFitObject(
     [dict(zip(keys, ['B', np.min, lambda data: 0.975 * np.min(data), lambda data: 1.025 * np.min(data), True])),
      dict(zip(keys, ['k', lambda data: 0.5, 0.001, None, True])),
@@ -157,6 +264,8 @@ curve_fit_dict['richard_5'] = CurveFitObject(
      dict(zip(keys, ['L', max, lambda data: 0.975 * max(data), lambda data: 1.025 * max(data), True]))],
     richard_5,
     # method='slsqp'
+    jacobian=richard_5_jacobian,
+    initial_guess=richard_5_initial_guess
 )
 
 """
@@ -165,12 +274,29 @@ http://www.ncbi.nlm.nih.gov/pmc/articles/PMC184525/pdf/aem00087-0379.pdf
 """
 def gompertz(t, A, growth_rate, lam):
     return A * np.exp(-np.exp(growth_rate * np.e / A * (lam - t)))
+
+def gompertz_jacobian(t, A, growth_rate, lam):
+    u = growth_rate * np.e / A * (lam - t)
+    E = np.exp(u)
+    w = np.exp(-E)
+    return {'A'          : w * (1 + E * u),
+            'growth_rate': -w * E * np.e * (lam - t),
+            'lam'        : -w * E * np.e * growth_rate}
+
+def gompertz_initial_guess(t, data):
+    # The growth rate is the maximum slope, which is reached at t = lam in this form of the equation
+    estimates = estimate_growth_parameters(t, data)
+    return {'A'          : estimates['plateau'],
+            'growth_rate': estimates['max_rate'],
+            'lam'        : estimates['time_of_max_rate']}
 curve_fit_dict['gompertz'] = CurveFitObject(
     [dict(zip(keys, ['A', np.max, lambda data: 0.975 * np.max(data), lambda data: 1.025 * np.max(data), True])),
      dict(zip(keys, ['growth_rate', 1, 0, 5, True])),
      dict(zip(keys, ['lam', 2, 0, None, True]))],
     gompertz,
-    method='slsqp'
+    method='slsqp',
+    jacobian=gompertz_jacobian,
+    initial_guess=gompertz_initial_guess
 )
 
 """
@@ -178,10 +304,29 @@ curve_fit_dict['gompertz'] = CurveFitObject(
 """
 def three_param_growth(t,A,B,mu):
     return A * B / (A + (B - A) * np.exp(-mu * t))
+
+def three_param_growth_jacobian(t, A, B, mu):
+    x = np.exp(-mu * t)
+    D2 = np.power(A + (B - A) * x, 2)
+    return {'A' : B ** 2 * x / D2,
+            'B' : A ** 2 * (1 - x) / D2,
+            'mu': A * B * (B - A) * t * x / D2}
+
+def three_param_growth_initial_guess(t, data):
+    # Logistic from A at t = 0 to B, the exponential phase grows at mu
+    estimates = estimate_growth_parameters(t, data)
+    guess = {'B': estimates['plateau']}
+    if estimates['baseline'] > 0:
+        guess['A'] = estimates['baseline']
+    if estimates['specific_growth_rate'] > 0:
+        guess['mu'] = estimates['specific_growth_rate']
+    return guess
 curve_fit_dict['three_param'] = CurveFitObject(
     [dict(zip(keys, ['A', 0.05, None, None, True])),
      dict(zip(keys, ['B', 1, None, None, True])),
      dict(zip(keys, ['mu', 0.5, None, None, True]))],
     three_param_growth,
-    method='leastsq'
+    method='leastsq',
+    jacobian=three_param_growth_jacobian,
+    initial_guess=three_param_growth_initial_guess
 )
@@ -1,22 +1,95 @@
 # coding=utf-8
 from sqlalchemy import event
-from sqlalchemy.orm import mapper
 from sqlalchemy.ext.declarative import declarative_base
-from .core import TrialIdentifier as ti
 from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session
 
 Base = declarative_base()
 
-def bind_engine(db_path='sqlite:///default_impt.db',echo=False):
-    engine = create_engine(db_path, echo=echo)
-    return engine
+default_db_path = 'sqlite:///default_impt.db'
+
+# Pragmas set on each SQLite connection, WAL lets readers work alongside a writer and NORMAL synchronous is safe
+# with WAL while avoiding an fsync on every commit
+sqlite_pragmas = {'journal_mode': 'WAL',
+                  'synchronous' : 'NORMAL',
+                  'temp_store'  : 'MEMORY',
+                  'cache_size'  : -64000,
+                  'busy_timeout': 30000}
+
+# Engines are shared by all sessions using the same database
+_engines = {}
+
+
+def get_engine(db_path=None, echo=False, pool_size=5, max_overflow=10):
+    """
+    Returns the shared engine for a database, creating it on first use. The pool options only apply when the engine
+    is created.
+
+    Parameters
+    ----------
+    db_path : str, optional
+        Database URL, defaults to default_db_path
+    echo : bool
+        Log the SQL statements
+    pool_size : int
+        Number of connections kept open
+    max_overflow : int
+        Number of connections opened beyond pool_size when they are all in use
+    """
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.pool import QueuePool, StaticPool
+
+    if db_path is None:
+        db_path = default_db_path
+
+    key = (str(db_path), echo)
+    if key not in _engines:
+        url = make_url(db_path)
+        if url.get_backend_name() == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                # Every connection to an in-memory database is a new database, so share a single connection
+                kwargs = {'poolclass': StaticPool}
+            else:
+                kwargs = {'poolclass': QueuePool, 'pool_size': pool_size, 'max_overflow': max_overflow}
+            kwargs['connect_args'] = {'check_same_thread': False}
+        else:
+            kwargs = {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_pre_ping': True}
+
+        engine = create_engine(db_path, echo=echo, **kwargs)
+        if url.get_backend_name() == 'sqlite':
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+        _engines[key] = engine
+    return _engines[key]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute('PRAGMA %s = %s' % (pragma, value))
+    cursor.close()
+
+
+def dispose_engines():
+    """
+    Closes the pooled connections of all engines, e.g. before deleting a database file or in a forked process
+    """
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
+
+
+def bind_engine(db_path=None, echo=False):
+    return get_engine(db_path, echo=echo)
 
 
 def create_session(engine='default'):
+    """
+    Creates a new session, bound to the shared engine for the default database unless an engine is given
+    """
     from sqlalchemy.orm import sessionmaker
 
     if engine == 'default':
-        engine = bind_engine()
+        engine = get_engine()
 
     # create_db()
     session_maker = sessionmaker(bind=engine,autoflush=True,expire_on_commit=False)
@@ -24,10 +97,256 @@ def create_session(engine='default'):
 
 
 def create_db():
-    Base.metadata.create_all(bind_engine())
+    Base.metadata.create_all(get_engine())
+
+
+# Session for each thread, created on first use so importing impact doesn't connect to a database
+session = scoped_session(create_session)
+
+
+def get_session():
+    """
+    Returns the session for the current thread
+    """
+    return session()
+
+
+def bulk_save_experiment(experiment, session=None, batch_size=10000, transaction_size=None):
+    """
+    Saves an experiment, writing the time points and fit parameters with executemany inserts rather than through
+    the unit of work. Strains, media and environments which are equal are saved once and shared by the identifiers.
+
+    The rest of the experiment (trials, time courses and identifiers) is flushed through the session as usual, and
+    the session is committed. Afterwards the time_points and fit_params of the time courses are expired, and are
+    loaded from the database when next accessed.
+
+    Parameters
+    ----------
+    experiment : :class:`~Experiment`
+    session : Session, optional
+        Defaults to the session for the current thread
+    batch_size : int
+        Number of rows in each executemany insert
+    transaction_size : int, optional
+        Number of rows inserted before each commit, defaults to a single transaction
+    """
+    import time
+    import numpy as np
+    from sqlalchemy import inspect
+    from sqlalchemy.orm.attributes import set_committed_value
+    from .core.AnalyteData import TimeCourse, TimePoint, FitParameter
+
+    if session is None:
+        session = get_session()
+
+    print('Saving experiment...', end='')
+    t0 = time.time()
+
+    # Take the data out of the new time courses, so their time points and fit parameters are not flushed as objects
+    time_courses = []
+    time_point_data = []
+    fit_param_data = []
+    for obj in _cascade_objects(experiment):
+        if isinstance(obj, TimeCourse) and inspect(obj).transient:
+            series = obj.pd_series
+            if series is not None:
+                time_point_data.append((np.asarray(series.index, dtype=float), np.asarray(series, dtype=float)))
+            else:
+                time_point_data.append((np.zeros(0), np.zeros(0)))
+            fit_param_data.append([(name, obj.fit_params[name].parameter_value) for name in obj.fit_params])
+
+            set_committed_value(obj, 'time_points', [])
+            set_committed_value(obj, 'fit_params', [])
+            obj._time_points_pending = False
+            time_courses.append(obj)
+
+    deduplicate_identifiers(_cascade_objects(experiment))
+
+    session.add(experiment)
+    session.flush()
+
+    # Each time point is identified by the identifier of its time course
+    time_point_rows = ({'time_point_type'    : 'raw',
+                        'trial_identifier_id': time_course.trial_identifier_id,
+                        'parent_id'          : time_course.id,
+                        'time'               : time,
+                        'data'               : data,
+                        'use_in_analysis'    : None}
+                       for time_course, (times, values) in zip(time_courses, time_point_data)
+                       for time, data in zip(times.tolist(), values.tolist()))
+    fit_param_rows = ({'parent_id'      : time_course.id,
+                       'parameter_name' : name,
+                       'parameter_value': value}
+                      for time_course, fit_params in zip(time_courses, fit_param_data)
+                      for name, value in fit_params)
+
+    n_rows = 0
+    for table, rows in [(TimePoint.__table__, time_point_rows), (FitParameter.__table__, fit_param_rows)]:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                n_rows = _insert_batch(session, table, batch, n_rows, transaction_size)
+                batch = []
+        if batch:
+            n_rows = _insert_batch(session, table, batch, n_rows, transaction_size)
+    session.commit()
+
+    for time_course in time_courses:
+        session.expire(time_course, ['time_points', 'fit_params'])
+
+    print("Saved %i rows in %0.1fs" % (n_rows, time.time() - t0))
+
+
+def load_experiment(experiment_id, analytes=None, strains=None, session=None, batch_size=500):
+    """
+    Loads an experiment from the database. The time courses are loaded with their identifiers and fit parameters
+    in a fixed number of queries, and the data of each time course is set from one query for all of the time
+    points rather than from :class:`~TimePoint` objects.
+
+    The returned experiment is rebuilt from the time courses, as when data is parsed, and is not attached to the
+    session.
+
+    Parameters
+    ----------
+    experiment_id : int
+        Id of the experiment
+    analytes : list of str, optional
+        Analyte names to load, defaults to all analytes
+    strains : list of str, optional
+        Strain names to load, defaults to all strains
+    session : Session, optional
+        Defaults to the session for the current thread
+    batch_size : int
+        Number of time courses in each time point query
+
+    Returns
+    -------
+    :class:`~Experiment`
+    """
+    import time
+    import numpy as np
+    from sqlalchemy.orm import selectinload
+    from .core.AnalyteData import TimeCourse, TimePoint
+    from .core.SingleTrial import SingleTrial
+    from .core.ReplicateTrial import ReplicateTrial
+    from .core.Experiment import Experiment
+    from .core.TrialIdentifier import TimeCourseIdentifier, Strain, Media, Environment
+    from .parsers import parse_analyte_data, group_time_points
+
+    if session is None:
+        session = get_session()
+
+    print('Loading experiment...', end='')
+    t0 = time.time()
+
+    stored_experiment = session.get(Experiment, experiment_id)
+    if stored_experiment is None:
+        raise Exception('Experiment not found: ' + str(experiment_id))
+
+    # Only the time courses of the replicates, the statistics are recalculated
+    query = session.query(TimeCourse) \
+        .join(SingleTrial, TimeCourse.parent_id == SingleTrial.id) \
+        .join(ReplicateTrial, SingleTrial.parent_id == ReplicateTrial.id) \
+        .join(TimeCourseIdentifier, TimeCourse.trial_identifier_id == TimeCourseIdentifier.id) \
+        .filter(ReplicateTrial.parent_id == experiment_id)
+    if analytes is not None:
+        query = query.filter(TimeCourseIdentifier.analyte_name.in_(analytes))
+    if strains is not None:
+        query = query.join(Strain, TimeCourseIdentifier.strain_id == Strain.id).filter(Strain.name.in_(strains))
+
+    time_courses = query.options(
+        selectinload(TimeCourse.fit_params),
+        selectinload(TimeCourse._trial_identifier).options(
+            selectinload(TimeCourseIdentifier.strain).options(selectinload(Strain.plasmids),
+                                                              selectinload(Strain.knockouts)),
+            selectinload(TimeCourseIdentifier.media).options(selectinload(Media.components),
+                                                             selectinload(Media.parent)),
+            selectinload(TimeCourseIdentifier.environment).selectinload(Environment.labware))
+    ).all()
+
+    # Set the data of all the time courses from the time point rows
+    ids = np.array([time_course.id for time_course in time_courses], dtype=int)
+    rows = []
+    for start in range(0, len(ids), batch_size):
+        rows.extend(session.query(TimePoint.parent_id, TimePoint.time, TimePoint.data)
+                    .filter(TimePoint.parent_id.in_(ids[start:start + batch_size].tolist()),
+                            TimePoint.time_point_type == 'raw').all())
+    parent_ids = np.array([row[0] for row in rows], dtype=int)
+    times = np.array([row[1] for row in rows], dtype=float)
+    values = np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=float)
+
+    time_course_dict = {time_course.id: time_course for time_course in time_courses}
+    for time_course in time_courses:
+        time_course.set_time_point_arrays([], [])
+    if len(rows) > 0:
+        order, starts, ends = group_time_points(parent_ids, times)
+        for start, end in zip(starts, ends):
+            time_course_dict[parent_ids[order[start]]].set_time_point_arrays(times[order[start:end]],
+                                                                             values[order[start:end]])
+
+    # Detach the loaded objects, so rebuilding the trials doesn't modify the stored experiment
+    for time_course in time_courses:
+        for obj in [time_course, time_course.trial_identifier]:
+            if obj in session:
+                session.expunge(obj)
+        for trial_identifier_attr in ['strain', 'media', 'environment']:
+            if getattr(time_course.trial_identifier, trial_identifier_attr) is None:
+                setattr(time_course.trial_identifier, trial_identifier_attr,
+                        {'strain': Strain, 'media': Media, 'environment': Environment}[trial_identifier_attr]())
+        if time_course.fit_params:
+            time_course._prefit = True
+
+    experiment = Experiment(**{attr: getattr(stored_experiment, attr)
+                               for attr in ['title', 'scientist_1', 'scientist_2', 'notes',
+                                            'import_date', 'start_date', 'end_date']
+                               if getattr(stored_experiment, attr) is not None})
+    for replicate in parse_analyte_data(time_courses):
+        experiment.add_replicate_trial(replicate)
+
+    print("Loaded %i time points in %0.1fs" % (len(rows), time.time() - t0))
+    return experiment
+
+
+def deduplicate_identifiers(objects):
+    """
+    Replaces the strain, media and environment of each identifier with the first equal one, so they are saved once
+
+    Parameters
+    ----------
+    objects : iterable
+        Objects which include the identifiers to deduplicate
+    """
+    from .core.TrialIdentifier import ReplicateTrialIdentifier, get_key_str
+
+    unique = {}
+    for obj in objects:
+        if isinstance(obj, ReplicateTrialIdentifier):
+            for attr, extra_attrs in [('strain', ['formal_name']),
+                                      ('media', ['name']),
+                                      ('environment', ['shaking_diameter'])]:
+                value = getattr(obj, attr)
+                if value is None:
+                    continue
+                key = (attr, get_key_str(value)) + tuple(getattr(value, extra) for extra in extra_attrs)
+                if unique.setdefault(key, value) is not value:
+                    setattr(obj, attr, unique[key])
+
+
+def _cascade_objects(obj):
+    # All the objects which would be saved with obj
+    from sqlalchemy import inspect
+    state = inspect(obj)
+    return [obj] + [child for child, child_mapper, child_state, child_dict
+                    in state.mapper.cascade_iterator('save-update', state)]
+
 
+def _insert_batch(session, table, batch, n_rows, transaction_size):
+    session.execute(table.insert(), batch)
+    if transaction_size is not None and (n_rows + len(batch)) // transaction_size > n_rows // transaction_size:
+        session.commit()
+    return n_rows + len(batch)
 
-session = create_session()
 
 
 # @event.listens_for(session, 'before_flush')
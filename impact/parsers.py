@@ -1,24 +1,338 @@
-import copy
+import csv
 import datetime
+import itertools
+import os
+import re
 import time
 import time as sys_time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
-from openpyxl import load_workbook
 
 from .core.TrialIdentifier import TimeCourseIdentifier
 from .core.AnalyteData import Biomass, Substrate, Product, Reporter, TimePoint
 from .core import SingleTrial, ReplicateTrial
 
 
+def open_workbook(file_name, read_only=True):
+    """
+    Opens an xlsx file, in read-only mode the sheets are streamed from the file as they are iterated
+    """
+    from openpyxl import load_workbook
+    return load_workbook(filename=file_name, read_only=read_only, data_only=True)
+
+
+def get_sheet_rows(workbook, sheet_names=None):
+    """
+    Returns the rows of each sheet as lazy iterators of tuples of cell values, missing sheets are left out
+    """
+    if sheet_names is None:
+        sheet_names = workbook.sheetnames
+    return {sheet_name: workbook[sheet_name].iter_rows(values_only=True)
+            for sheet_name in sheet_names if sheet_name in workbook.sheetnames}
+
+
+def read_workbook(file_name, sheet_names=None, read_only=True):
+    """
+    Opens an xlsx file and returns the rows of each sheet as lazy iterators, so only the rows being parsed are
+    held in memory
+
+    Parameters
+    ----------
+    file_name (str): path to xlsx file
+    sheet_names (list): names of the sheets to read, all sheets if None. Missing sheets are left out.
+    read_only (bool): stream the sheets from the file, rather than loading the full workbook
+
+    Returns
+    -------
+    workbook: the openpyxl workbook, to be closed once the rows have been consumed
+    data (dict): iterator of tuples of cell values for each sheet
+    """
+    workbook = open_workbook(file_name, read_only=read_only)
+    return workbook, get_sheet_rows(workbook, sheet_names)
+
+
+def to_float_array(cells):
+    """
+    Converts an array of cells to floats, empty or non-numeric cells are NaN
+    """
+    import pandas as pd
+
+    cells = np.asarray(cells, dtype=object)
+    try:
+        # Numbers and None, as read from a workbook
+        return cells.astype(float)
+    except (TypeError, ValueError):
+        return np.asarray(pd.to_numeric(cells.ravel(), errors='coerce'), dtype=float).reshape(cells.shape)
+
+
+def extract_plate_blocks(rows, data_x_coords, row_with_first_data=3, plate_spacing=9, end_cell_text='~End',
+                         plate_height=8):
+    """
+    Slices all plate blocks out of a plate reader sheet at once
+
+    Parameters
+    ----------
+    rows (iterable or array): 2-D array of the cells of a text export, or rows of cell values streamed from a
+        workbook, which are read up to the end of the data
+    data_x_coords (list): first and last (exclusive) columns of the plate data
+    row_with_first_data (int): index of the first row of the first plate
+    plate_spacing (int): number of rows from the start of one plate to the next
+    end_cell_text (str): text in the first column which marks the end of the data
+    plate_height (int): number of rows in a plate
+
+    Returns
+    -------
+    times (array): time of each plate in hours
+    plates (array): plate data with shape (time, rows, cols), NaN where empty
+    """
+    if isinstance(rows, np.ndarray):
+        table = rows
+    else:
+        # Read the rows up to the end of the data into a table, ragged rows are padded
+        table_rows = []
+        for i, row in enumerate(rows):
+            if i >= row_with_first_data and (i - row_with_first_data) % plate_spacing == 0 \
+                    and (not row or row[0] in [end_cell_text, None, '']):
+                break
+            table_rows.append(row[:data_x_coords[1]])
+        table = np.full((len(table_rows), data_x_coords[1]), None, dtype=object)
+        for i, row in enumerate(table_rows):
+            table[i, :len(row)] = row
+
+    labels = table[row_with_first_data::plate_spacing, 0]
+
+    # Stop at the end marker, or at the first empty row when the marker is missing
+    number_of_plates = 0
+    for label in labels:
+        if label in [end_cell_text, None, '']:
+            break
+        number_of_plates += 1
+
+    times = parse_plate_times(labels[:number_of_plates])
+    row_index = row_with_first_data + plate_spacing * np.arange(number_of_plates)[:, None] + np.arange(plate_height)
+    col_index = np.arange(data_x_coords[0], data_x_coords[1])
+
+    # Pad the table for plates which run past its last row or column
+    padded = np.full((max(table.shape[0], row_index.max(initial=-1) + 1), max(table.shape[1], col_index[-1] + 1)),
+                     '', dtype=object)
+    padded[:table.shape[0], :table.shape[1]] = table
+
+    return times, to_float_array(padded[row_index[:, :, None], col_index[None, None, :]])
+
+
+def plate_arrays_to_time_points(identifier_indices, times, plates):
+    """
+    Flattens plate blocks to the measurements of wells with an identifier and data
+
+    Parameters
+    ----------
+    identifier_indices (list): rows of indices into the list of identifiers, or None for empty wells
+    times (array): time of each plate
+    plates (array): plate data with shape (time, rows, cols)
+
+    Returns
+    -------
+    identifier_index, times, values (array): index of the identifier, time and value of each measurement
+    """
+    index_plate = np.full(plates.shape[1:], -1, dtype=int)
+    for i, row in enumerate(identifier_indices[:plates.shape[1]]):
+        for j, index in enumerate(row[:plates.shape[2]]):
+            if index is not None:
+                index_plate[i, j] = index
+
+    time_index, i, j = np.nonzero((index_plate >= 0)[None, :, :] & ~np.isnan(plates))
+    return index_plate[i, j], times[time_index], plates[time_index, i, j]
+
+
+def is_time_label(cell):
+    """
+    Checks if a cell holds a Spectromax time label, or a time which Excel converted from one
+    """
+    if isinstance(cell, (datetime.datetime, datetime.time)):
+        return True
+    return isinstance(cell, str) and re.match(r'^\d+:\d{2}(:\d{2})?$', cell.strip()) is not None
+
+
+def is_number(cell):
+    """
+    Checks if a cell holds a number, or a string of a number
+    """
+    if isinstance(cell, (int, float)):
+        return True
+    try:
+        float(cell)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def get_cell(rows, i, j):
+    """
+    Returns the value of cell (i, j), or None if it is outside the rows
+    """
+    if i < len(rows) and j < len(rows[i]):
+        return rows[i][j]
+    return None
+
+
+def has_values(cells):
+    """
+    Checks if any of the cells are not empty
+    """
+    return any(cell not in [None, ''] for cell in cells)
+
+
+def parse_plate_times(time_labels):
+    """
+    Converts an array of Spectromax time labels (h:mm:ss or mm:ss) to hours
+    """
+    import pandas as pd
+
+    time_labels = np.asarray(time_labels, dtype=object)
+    if any(isinstance(time_label, (datetime.datetime, datetime.time)) for time_label in time_labels):
+        raise Exception("Imported a datetime object, make sure to set all cells to 'TEXT' if importing"
+                        " from excel")
+    if len(time_labels) == 0:
+        return np.empty(0)
+
+    time_labels = pd.Series(time_labels.astype(str)).str.strip()
+    valid = time_labels.str.match(r'^\d+:\d+(:\d+)?$').values
+    if not np.all(valid):
+        raise Exception('Could not parse the plate time label: %s' % time_labels[np.argmin(valid)])
+
+    # Labels without hours are minutes and seconds
+    time_labels = time_labels.where(time_labels.str.count(':') == 2, '0:' + time_labels)
+    hours, minutes, seconds = time_labels.str.split(':', expand=True).values.astype(int).T
+    return (hours * 3600 + minutes * 60 + seconds) / 3600
+
+
+# Rows and columns of wells of standard plates
+plate_geometries = {6   : (2, 3),
+                    12  : (3, 4),
+                    24  : (4, 6),
+                    48  : (6, 8),
+                    96  : (8, 12),
+                    384 : (16, 24),
+                    1536: (32, 48)}
+
+
+class PlateLayout(object):
+    """
+    Geometry of the plate blocks in a plate reader sheet. Each time point is a block of rows which starts with the
+    time label in the first column, and holds one or more replicate plates side by side.
+
+    Parameters
+    ----------
+    rows (int): number of rows of wells
+    cols (int): number of columns of wells
+    first_row (int): index of the first row of the first block
+    first_col (int): index of the column of the first well
+    block_spacing (int): number of rows from the start of one block to the next, one blank row between blocks if
+        None
+    replicates (int): number of replicate plates side by side
+    replicate_spacing (int): number of columns from the start of one replicate plate to the next, one blank column
+        between plates if None
+    end_cell_text (str): text in the first column which marks the end of the data
+    """
+
+    def __init__(self, rows=8, cols=12, first_row=3, first_col=2, block_spacing=None, replicates=1,
+                 replicate_spacing=None, end_cell_text='~End'):
+        self.rows = rows
+        self.cols = cols
+        self.first_row = first_row
+        self.first_col = first_col
+        self.block_spacing = block_spacing if block_spacing is not None else rows + 1
+        self.replicates = replicates
+        self.replicate_spacing = replicate_spacing if replicate_spacing is not None else cols + 1
+        self.end_cell_text = end_cell_text
+
+    @classmethod
+    def from_wells(cls, number_of_wells, **kwargs):
+        """
+        Layout of a standard plate with number_of_wells wells, see plate_geometries
+        """
+        if number_of_wells not in plate_geometries:
+            raise Exception('No plate geometry for %s wells' % number_of_wells)
+        rows, cols = plate_geometries[number_of_wells]
+        return cls(rows, cols, **kwargs)
+
+    @property
+    def number_of_wells(self):
+        return self.rows * self.cols
+
+    @property
+    def data_x_coords(self):
+        """
+        First and last (exclusive) columns of the replicate plates
+        """
+        return [self.first_col, self.first_col + (self.replicates - 1) * self.replicate_spacing + self.cols]
+
+    def extract(self, rows):
+        """
+        Slices the plates out of the rows of a sheet, see :func:`extract_plate_blocks`
+
+        Returns
+        -------
+        times (array): time of each block in hours
+        plates (array): plate data with shape (time, replicates, rows, cols), NaN where empty
+        """
+        times, blocks = extract_plate_blocks(rows, self.data_x_coords, self.first_row, self.block_spacing,
+                                             self.end_cell_text, self.rows)
+        offsets = [replicate * self.replicate_spacing for replicate in range(self.replicates)]
+        return times, np.stack([blocks[:, :, offset:offset + self.cols] for offset in offsets], axis=1)
+
+    def extract_average(self, rows):
+        """
+        Slices the plates out of the rows of a sheet, and averages the replicate plates leaving out empty wells
+
+        Returns
+        -------
+        times (array): time of each block in hours
+        plates (array): average plate data with shape (time, rows, cols), NaN where no replicate has data
+        """
+        times, plates = self.extract(rows)
+        if self.replicates == 1:
+            return times, plates[:, 0]
+
+        count = np.sum(~np.isnan(plates), axis=1)
+        return times, np.where(count > 0, np.nansum(plates, axis=1) / np.maximum(count, 1), np.nan)
+
+    def matches(self, rows):
+        """
+        Checks if the first rows of a sheet fit the layout: a time label at the first block, data up to the last
+        column of the first plate, blank columns between replicate plates and nothing to the right of the plates.
+        Replicate plates after the second may be empty.
+
+        Parameters
+        ----------
+        rows (list): the first rows of the sheet
+        """
+        if not is_time_label(get_cell(rows, self.first_row, 0)) \
+                or get_cell(rows, self.first_row, self.first_col + self.cols - 1) in [None, '']:
+            return False
+
+        row = rows[self.first_row]
+        plate_cols = [self.first_col + replicate * self.replicate_spacing for replicate in range(self.replicates)]
+        for start, next_start in zip(plate_cols[:-1], plate_cols[1:]):
+            if has_values(row[start + self.cols:next_start]):
+                return False
+        if self.replicates > 1 and not has_values(row[plate_cols[1]:plate_cols[1] + self.cols]):
+            return False
+        return not has_values(row[self.data_x_coords[1]:])
+
+
 class Parser(object):
     """
     Base class for parsers. Contains helper to import data from file,  parse identifiers from a plate format,
     Requires a `parse_data` method in classes inheriting this class
     """
+    layout = None
+
     @classmethod
-    def parse_raw_data(cls, id_type='traverse', file_name=None, data=None, experiment=None):
+    def parse_raw_data(cls, id_type='traverse', file_name=None, data=None, experiment=None, read_only=True):
         """
         Parses raw data into an experiment object
 
@@ -29,6 +343,8 @@ class Parser(object):
         file_name (str): path to structured file
         data (str): dictionary containing data with sheets appropriate to parser
         experiment (str): `Experiment` instance to parse data into, will create new instance if None
+        read_only (bool): stream the rows of the sheets the parser needs from the file, rather than loading the
+            full workbook
 
         Returns
         -------
@@ -40,38 +356,55 @@ class Parser(object):
 
         t0 = time.time()
 
+        workbook = None
         if data is None:
             if file_name is None:
                 raise Exception('No data or file name given to load data from')
 
             # Get data from xlsx file
             print('\nImporting data from %s...' % (file_name), end='')
-            # data = get_data(file_name)
-            xls_data = load_workbook(filename=file_name, data_only=True)
+            workbook, data = read_workbook(file_name, cls.get_sheet_names(), read_only=read_only)
             print('%0.1fs' % (time.time() - t0))
 
-            # Extract data from sheets
-            data = {sheet.title: [[elem.value if elem is not None else None for elem in row]
-                                  for row in xls_data[sheet.title]] for sheet in xls_data}
+        try:
+            cls.parse_data(experiment, data=data, id_type=id_type)
+        finally:
+            if workbook is not None:
+                workbook.close()
 
-        cls.parse_data(experiment, data=data, id_type=id_type)
+        return experiment
 
+    @classmethod
+    def get_sheet_names(cls):
+        """
+        Names of the sheets the parser reads, None to read all sheets
+        """
+        return None
 
-        return experiment
+    @classmethod
+    def matches(cls, sheets):
+        """
+        Checks if the first rows of each sheet match the format of the parser, used to detect the format of a file
+
+        Parameters
+        ----------
+        sheets (dict): list of the first rows of each sheet
+        """
+        return False
 
     @staticmethod
     def parse_identifiers(unparsed_identifiers, id_type):
         identifiers = []
-        for i, row in enumerate(unparsed_identifiers):
+        for row in unparsed_identifiers:
             parsed_row = []
-            for j, data in enumerate(row):
-                if unparsed_identifiers[i][j] not in ['', 0, '0', None]:
+            for data in row:
+                if data not in ['', 0, '0', None]:
                     temp_trial_identifier = TimeCourseIdentifier()
 
                     if id_type == 'CSV':
-                        temp_trial_identifier.parse_trial_identifier_from_csv(unparsed_identifiers[i][j])
+                        temp_trial_identifier.parse_trial_identifier_from_csv(data)
                     elif id_type == 'traverse':
-                        temp_trial_identifier.parse_identifier(unparsed_identifiers[i][j])
+                        temp_trial_identifier.parse_identifier(data)
 
                     parsed_row.append(temp_trial_identifier)
                 else:
@@ -84,58 +417,36 @@ class Parser(object):
 
 
 class PlateBasedParser(Parser):
+    """
+    Base class for plate reader parsers, the geometry of the data sheet is given by the `plate_layout`
+    :class:`PlateLayout`. Replicate plates in the layout are averaged.
+    """
+    layout = 'plate'
+    plate_layout = PlateLayout()
+
+    @classmethod
+    def get_sheet_names(cls):
+        return [cls.identifiers_sheet_name, cls.data_sheet_name]
+
+    @classmethod
+    def matches(cls, sheets):
+        return cls.plate_layout.matches(sheets[cls.data_sheet_name])
+
     @classmethod
     def parse_data(cls, experiment, data, id_type='CSV',
                    analyte_name = 'OD600', analyte_type = 'biomass'):
         from .core.settings import settings
         live_calculations = settings.live_calculations
-        raw_data = data[cls.data_sheet_name]
-        unparsed_identifiers = data[cls.identifiers_sheet_name]
-        # The data starts at (3,2) and is in a 8x12 format
-        timepoint_list = []
 
         # Parse identifiers (to prevent parsing at every time point)
-        identifiers = cls.parse_identifiers(unparsed_identifiers, id_type)
-
-        for start_row_index in range(cls.row_with_first_data, len(raw_data), cls.plate_spacing):
-            if raw_data[start_row_index][0] != cls.end_cell_text:
-                if isinstance(raw_data[start_row_index][0], datetime.datetime):
-                    raise Exception("Imported a datetime object, make sure to set all cells to 'TEXT' if importing"
-                                    " from excel")
-                parsed_time = raw_data[start_row_index][0].split(':')
-
-                # Convert the Spectromax format to raw hours
-                if len(parsed_time) > 2:
-                    time = int(parsed_time[0]) * 3600 + int(parsed_time[1]) * 60 + int(parsed_time[2])
-                else:
-                    time = int(parsed_time[0]) * 60 + int(parsed_time[1])
-
-                time /= 3600  # convert to hours
-
-                # Define the data for a single plate, single timepoint
-                plate_data = [row[cls.data_x_coords[0]:cls.data_x_coords[1]]
-                              for row in raw_data[start_row_index:start_row_index + 8]]
-
-                # Load the data point by point
-                for i, row in enumerate(plate_data):
-                    for j, data in enumerate(row):
-                        # Skip wells where no identifier is listed or no data present
-                        if identifiers[i][j] is not None \
-                                and data not in [None, '']:
-
-                            temp_trial_identifier = identifiers[i][j]
-                            temp_trial_identifier.analyte_type = analyte_type
-                            temp_trial_identifier.analyte_name = analyte_name
-                            try:
-                                temp_timepoint = TimePoint(temp_trial_identifier, time, float(data))
-                            except Exception as e:
-                                print(plate_data)
-                                raise Exception(e)
-                            timepoint_list.append(temp_timepoint)
-            else:
-                break
+        identifiers = cls.parse_identifiers(data[cls.identifiers_sheet_name], id_type)
+        trial_identifiers, identifier_indices = index_plate_identifiers(identifiers, analyte_name, analyte_type)
 
-        replicate_trial_list = parse_time_point_list(timepoint_list)
+        # Slice all plates into a (time, rows, cols) array, then keep the wells with an identifier and data
+        times, plates = cls.plate_layout.extract_average(data[cls.data_sheet_name])
+        identifier_index, times, values = plate_arrays_to_time_points(identifier_indices, times, plates)
+
+        replicate_trial_list = parse_time_point_arrays(trial_identifiers, identifier_index, times, values)
         for rep in replicate_trial_list:
             experiment.add_replicate_trial(rep)
 
@@ -143,226 +454,81 @@ class PlateBasedParser(Parser):
 
 
 class SpectromaxOD(PlateBasedParser):
+    # The data starts at (3,2) and is in a 8x12 format
     data_sheet_name = 'data'
     identifiers_sheet_name = 'identifiers'
-    data_x_coords = [2, 14]
-    end_cell_text = '~End'
-    row_with_first_data = 3
-    plate_spacing = 9
+    plate_layout = PlateLayout.from_wells(96, first_row=3, first_col=2)
 
 
-class TimePointByAnalyte(Parser):
-    pass
+class SpectromaxODTriplicate(SpectromaxOD):
+    # Three replicate plates side by side
+    layout = 'triplicate_plate'
+    plate_layout = PlateLayout.from_wells(96, first_row=3, first_col=2, replicates=3)
 
 
-def spectromax_OD(experiment, data, id_type='CSV'):
-    from .core.settings import settings
-    live_calculations = settings.live_calculations
-
-    unparsed_identifiers = data['identifiers']
-    raw_data = data['data']
+class SpectromaxOD384(SpectromaxOD):
+    plate_layout = PlateLayout.from_wells(384, first_row=3, first_col=2)
 
-    # The data starts at (3,2) and is in a 8x12 format
-    timepoint_list = []
 
-    # Parse identifiers (to prevent parsing at every time point)
-    identifiers = []
-    for i, row in enumerate(unparsed_identifiers):
-        parsed_row = []
-        for j, data in enumerate(row):
-            if unparsed_identifiers[i][j] not in ['', 0, '0', None]:
-                temp_trial_identifier = TimeCourseIdentifier()
+class SpectromaxOD1536(SpectromaxOD):
+    plate_layout = PlateLayout.from_wells(1536, first_row=3, first_col=2)
 
-                if id_type == 'CSV':
-                    temp_trial_identifier.parse_trial_identifier_from_csv(unparsed_identifiers[i][j])
-                elif id_type == 'traverse':
-                    temp_trial_identifier.parse_identifier(unparsed_identifiers[i][j])
 
-                parsed_row.append(temp_trial_identifier)
-            else:
-                parsed_row.append(None)
-        identifiers.append(parsed_row)
-
-    for start_row_index in range(3, len(raw_data), 9):
-        # print(start_row_index)
-        # Parse the time point out first
-        # print(raw_data[start_row_index][0])
-
-        if raw_data[start_row_index][0] != '~End':
-            if isinstance(raw_data[start_row_index][0],datetime.datetime):
-                raise Exception("Imported a datetime object, make sure to set all cells to 'TEXT' if importing"
-                                " from excel")
-            parsed_time = raw_data[start_row_index][0].split(':')
-
-            # Convert the Spectromax format to raw hours
-            if len(parsed_time) > 2:
-                time = int(parsed_time[0]) * 3600 + int(parsed_time[1]) * 60 + int(parsed_time[2])
-            else:
-                time = int(parsed_time[0]) * 60 + int(parsed_time[1])
-
-            time /= 3600  # convert to hours
-
-            # Define the data for a single plate, single timepoint
-            plate_data = [row[2:14] for row in raw_data[start_row_index:start_row_index+8]]
-            # print(plate_data)
-
-            # Load the data point by point
-            for i, row in enumerate(plate_data):
-                for j, data in enumerate(row):
-                    # Skip wells where no identifier is listed or no data present
-                    if identifiers[i][j] is not None \
-                            and data not in [None,'']:
-                        # temp_trial_identifier = TimeCourseIdentifier()
-                        #
-                        # if id_type == 'CSV':
-                        #     temp_trial_identifier.parse_trial_identifier_from_csv(identifiers[i][j])
-                        # elif id_type == 'traverse':
-                        #     temp_trial_identifier.parse_identifier(identifiers[i][j])
-                        temp_trial_identifier = identifiers[i][j]
-                        temp_trial_identifier.analyte_type = 'biomass'
-                        temp_trial_identifier.analyte_name = 'OD600'
-                        try:
-                            # print('gooddata:', data)
-                            temp_timepoint = TimePoint(temp_trial_identifier, time, float(data))
-                        except Exception as e:
-                            # print('baddata:',data)
-                            print(plate_data)
-                            raise Exception(e)
-                        timepoint_list.append(temp_timepoint)
-                    # else:
-                    #     print('Skipped time point')
-        else:
-            break
+class TimePointByAnalyte(Parser):
+    pass
 
-    replicate_trial_list = parse_time_point_list(timepoint_list)
-    for rep in replicate_trial_list:
-        experiment.add_replicate_trial(rep)
 
-    if live_calculations:   experiment.calculate()
+def spectromax_OD(experiment, data, id_type='CSV'):
+    SpectromaxOD.parse_data(experiment, data, id_type=id_type)
 
 
 def spectromax_OD_triplicate(experiment, data, id_type='CSV'):
-    from .core.settings import settings
-    live_calculations = settings.live_calculations
-
-    # This should be an ordered dict if imported from py_xlsx
-    # assert isinstance(data, OrderedDict)
-
-    identifiers = [[elem.value for elem in row] for row in data['identifiers']]
-    raw_data = [[elem.value for elem in row] for row in data['data']]
-
-    # The data starts at (3,2) and is in a 8x12 format
-    timepoint_list = []
-
-    for start_row_index in range(3, len(raw_data), 9):
-        # print(start_row_index)
-        # Parse the time point out first
-        # print(raw_data[start_row_index][0])
-
-        if raw_data[start_row_index][0] != '~End':
-            if isinstance(raw_data[start_row_index][0], datetime.datetime):
-                raise Exception("Imported a datetime object, make sure to set all cells to 'TEXT' if importing"
-                                " from excel")
-            parsed_time = raw_data[start_row_index][0].split(':')
-
-            # Convert the Spectromax format to raw hours
-            if len(parsed_time) > 2:
-                time = int(parsed_time[0]) * 3600 + int(parsed_time[1]) * 60 + int(parsed_time[2])
-            else:
-                time = int(parsed_time[0]) * 60 + int(parsed_time[1])
-
-            time /= 3600  # convert to hours
-            # Define the data for each of the replicates
-            replicate_plate_data = [[row[2:14] for row in raw_data[start_row_index:start_row_index + 8]],
-                                    [row[15:27] for row in raw_data[start_row_index:start_row_index + 8]],
-                                    [row[28:40] for row in raw_data[start_row_index:start_row_index + 8]]]
-            # convert to strings to floats
-            converted_data = []
-            for plate_data in replicate_plate_data:
-                converted_data.append([[float(data) if data is not None else 0. for data in row] for row in plate_data])
-
-            # Calculate the average
-            try:
-                plate_data = np.mean(converted_data,axis=0)
-            except Exception as e:
-                print(converted_data)
-                raise Exception(e)
-
-            # Load the data point by point
-            for i, row in enumerate(plate_data):
-                for j, data in enumerate(row):
-                    # Skip wells where no identifier is listed or no data present
-                    if i<len(identifiers) and j<len(identifiers[0]) \
-                            and identifiers[i][j] not in ['',0,'0',None] \
-                            and data not in ['',None]:
-                        temp_trial_identifier = TimeCourseIdentifier()
-
-                        if id_type == 'CSV':
-                            temp_trial_identifier.parse_trial_identifier_from_csv(identifiers[i][j])
-                        elif id_type == 'traverse':
-                            temp_trial_identifier.parse_identifier(identifiers[i][j])
-                        temp_trial_identifier.analyte_type = 'biomass'
-                        temp_trial_identifier.analyte_name = 'OD600'
-                        temp_timepoint = TimePoint(temp_trial_identifier, time, float(data))
-
-                        timepoint_list.append(temp_timepoint)
-                        # else:
-                        #     print('Skipped time point')
-        else:
-            break
-
-    replicate_trial_list = parse_time_point_list(timepoint_list)
-    for rep in replicate_trial_list:
-        experiment.add_replicate_trial(rep)
-
-    if live_calculations:   experiment.calculate()
+    SpectromaxODTriplicate.parse_data(experiment, data, id_type=id_type)
 
 
 def HPLC_titer_parser(experiment, data, id_type='CSV'):
     t0 = sys_time.time()
 
     # Parameters
-    row_with_titer_names = 0
-    row_with_titer_types = 1
-    row_with_first_data = 2
     data_sheet_name = "titers"
 
+    # The first two rows hold the titer names and types, the data follows
+    rows = iter(data[data_sheet_name])
+    titer_names = next(rows)
+    titer_types = next(rows)
+
     # Initialize variables
     analyte_nameColumn = dict()
     titer_type = dict()
+    for i in range(1, len(titer_names)):
+        analyte_nameColumn[titer_names[i]] = i
+        titer_type[titer_names[i]] = titer_types[i]
 
-    data = data[data_sheet_name]
-
-    for i in range(1, len(data[row_with_titer_names])):
-        analyte_nameColumn[data[row_with_titer_names][i]] = i
-        titer_type[data[row_with_titer_names][i]] = \
-            data[row_with_titer_types][i]
-
-    # Initialize a timepoint_collection for each titer type (column)
-    tempTimePointCollection = dict()
-    for names in analyte_nameColumn:
-        tempTimePointCollection[names] = []
     skipped_lines = 0
     timepoint_list = []
-    for i in range(row_with_first_data, len(data)):
-        if type(data[i][0]) is str:
-            for key in tempTimePointCollection:
+    for row in rows:
+        # Streamed rows end at their last cell with a value, pad them to the header
+        if len(row) < len(titer_names):
+            row = tuple(row) + (None,) * (len(titer_names) - len(row))
+        if type(row[0]) is str:
+            for key in analyte_nameColumn:
                 trial_identifier = TimeCourseIdentifier()
 
                 if id_type == 'CSV':
-                    trial_identifier.parse_trial_identifier_from_csv(data[i][0])
+                    trial_identifier.parse_trial_identifier_from_csv(row[0])
                 elif id_type == 'traverse':
-                    trial_identifier.parse_identifier(data[i][0])
+                    trial_identifier.parse_identifier(row[0])
 
                 trial_identifier.analyte_name = key
                 trial_identifier.analyte_type = titer_type[key]
 
-                if data[i][analyte_nameColumn[key]] == 'nan':
-                    data[i][analyte_nameColumn[key]] = np.nan
+                value = row[analyte_nameColumn[key]]
+                if value == 'nan':
+                    value = np.nan
                 timepoint_list.append(
                     TimePoint(trial_identifier=trial_identifier,
                               time=trial_identifier.time,
-                              data=data[i][analyte_nameColumn[key]]))
+                              data=value))
 
         else:
             skipped_lines += 1
@@ -375,53 +541,450 @@ def HPLC_titer_parser(experiment, data, id_type='CSV'):
     # experiment.calculate()
 
 
-def tecan_OD(experiment, data, fileName):
-    from .core.AnalyteData import TimeCourse
-
+def tecan_OD(experiment, data, id_type='CSV'):
     t0 = sys_time.time()
-    if fileName:
-        # Check for correct data for import
-        if 'OD' not in data.keys():
-            raise Exception("No sheet named 'OD' found")
-        else:
-            ODDataSheetName = 'OD'
 
-        data = data[ODDataSheetName]
+    # Check for correct data for import
+    if 'OD' not in data.keys():
+        raise Exception("No sheet named 'OD' found")
+
+    # The first row holds the times in seconds, the data follows with one well per row
+    rows = iter(data['OD'])
+    time_row = np.array([np.nan if elem in [None, ''] else elem for elem in next(rows)[1:]], dtype=float)
+    # Data in seconds, data required to be in hours
+    time_vector = time_row / 3600
+    has_time = ~np.isnan(time_vector)
 
     # Parse data into timeCourseObjects
-    skipped_lines = 0
-    timeCourseObjectList = dict()
-    for row in data[1:]:
-        temp_run_identifier_object = TimeCourseIdentifier()
+    analyte_list = []
+    for row in rows:
         if type(row[0]) is str:
-            temp_run_identifier_object.parse_trial_identifier_from_csv(row[0])
+            temp_run_identifier_object = TimeCourseIdentifier()
+            if id_type == 'CSV':
+                temp_run_identifier_object.parse_trial_identifier_from_csv(row[0])
+            elif id_type == 'traverse':
+                temp_run_identifier_object.parse_identifier(row[0])
             temp_run_identifier_object.analyte_name = 'OD600'
             temp_run_identifier_object.analyte_type = 'biomass'
-            temp_time_course = TimeCourse()
-            temp_time_course.trial_identifier = temp_run_identifier_object
 
-            # Data in seconds, data required to be in hours
-            temp_time_course.time_vector = np.array(np.divide(data[0][1:], 3600))
+            data_vector = np.array([np.nan if elem in [None, ''] else elem
+                                    for elem in row[1:len(time_vector) + 1]], dtype=float)
+            mask = has_time[:len(data_vector)] & ~np.isnan(data_vector)
+            analyte_list.append(create_time_course(temp_run_identifier_object,
+                                                   time_vector[:len(data_vector)][mask], data_vector[mask]))
+    tf = sys_time.time()
+    print("Parsed %i timeCourseObjects in %0.3fs\n" % (len(analyte_list), tf - t0))
+    for rep in parse_analyte_data(analyte_list):
+        experiment.add_replicate_trial(rep)
+
+
+def parse_trial_identifier(identifier, id_type='CSV'):
+    """
+    Parses a single identifier string into a :class:`~TimeCourseIdentifier`
+    """
+    trial_identifier = TimeCourseIdentifier()
+    if id_type == 'CSV':
+        trial_identifier.parse_trial_identifier_from_csv(identifier)
+    elif id_type == 'traverse':
+        trial_identifier.parse_identifier(identifier)
+    return trial_identifier
+
+
+# Delimiter for each text file extension
+text_delimiters = {'.csv': ',',
+                   '.tsv': '\t',
+                   '.txt': '\t'}
+
+
+def get_delimiter(file_name):
+    """
+    Returns the delimiter for the extension of a text file: tab for .tsv and .txt, comma otherwise
+    """
+    return text_delimiters.get(os.path.splitext(file_name)[1].lower(), ',')
+
+
+def read_delimited(file_name, delimiter=None):
+    """
+    Reads a delimited text file into a 2-D array of strings with the pandas C parser
+
+    Parameters
+    ----------
+    file_name (str): path to text file
+    delimiter (str): field delimiter, from the file extension if None (tab for .tsv and .txt, comma otherwise)
+
+    Returns
+    -------
+    table (array): cell strings, empty and missing cells are ''
+    """
+    import pandas as pd
+
+    if delimiter is None:
+        delimiter = get_delimiter(file_name)
+
+    options = dict(sep=delimiter, header=None, dtype=str, na_filter=False, skip_blank_lines=False, engine='c')
+    try:
+        table = pd.read_csv(file_name, **options)
+    except pd.errors.ParserError:
+        # A row is wider than the first row, size the table to the widest row
+        with open(file_name) as f:
+            width = max(line.count(delimiter) for line in f) + 1
+        table = pd.read_csv(file_name, names=range(width), **options)
+    return table.values
+
+
+def read_delimited_files(file_name, sheet_names):
+    """
+    Reads the sheets of a text export, each sheet is a delimited text file
+
+    Parameters
+    ----------
+    file_name (str or dict): the text file for a single sheet, a directory containing a `<sheet name>.csv`, .tsv
+        or .txt file for each sheet, or a dict of file names by sheet name
+    sheet_names (list): names of the sheets to read
+
+    Returns
+    -------
+    data (dict): 2-D array of cell strings for each sheet
+    """
+    if isinstance(file_name, dict):
+        file_names = file_name
+    elif os.path.isdir(file_name):
+        file_names = {}
+        for sheet_name in sheet_names:
+            for extension in text_delimiters:
+                if os.path.exists(os.path.join(file_name, sheet_name + extension)):
+                    file_names[sheet_name] = os.path.join(file_name, sheet_name + extension)
+                    break
+            else:
+                raise Exception('No text file found for sheet %s in %s' % (sheet_name, file_name))
+    elif len(sheet_names) == 1:
+        file_names = {sheet_names[0]: file_name}
+    else:
+        raise Exception('The %s sheets must be read from a directory or a dict of file names'
+                        % ', '.join(sheet_names))
+
+    return {sheet_name: read_delimited(file_names[sheet_name]) for sheet_name in sheet_names}
+
+
+def titer_rows_to_arrays(titer_names, titer_types, rows, id_type='CSV'):
+    """
+    Converts rows of the default titers layout to time point arrays
+
+    Parameters
+    ----------
+    titer_names (array): name of each titer
+    titer_types (array): analyte type of each titer
+    rows (array): 2-D array of cell strings, the identifier followed by the value of each titer
+    id_type (str): traverse or CSV
+
+    Returns
+    -------
+    trial_identifiers, identifier_index, times, values, see :func:`parse_time_point_arrays`
+    """
+    rows = np.asarray(rows, dtype=object).reshape(-1, len(titer_names) + 1)
+    values = to_float_array(rows[:, 1:])
+
+    # Identifiers are parsed once for each row to get the time, and once for each titer of each single trial
+    trial_identifiers = []
+    identifier_index = np.empty(values.shape, dtype=int)
+    times = np.empty(len(rows))
+    single_trial_index = {}
+    group_ids = {}
+    for i, identifier in enumerate(rows[:, 0]):
+        trial_identifier = parse_trial_identifier(identifier, id_type)
+        times[i] = trial_identifier.time
+
+        key = trial_identifier.get_group_id('single_trial', group_ids)
+        if key not in single_trial_index:
+            single_trial_index[key] = len(trial_identifiers)
+            for j, (titer_name, titer_type) in enumerate(zip(titer_names, titer_types)):
+                if j > 0:
+                    trial_identifier = parse_trial_identifier(identifier, id_type)
+                trial_identifier.analyte_name = titer_name
+                trial_identifier.analyte_type = titer_type
+                trial_identifiers.append(trial_identifier)
+        identifier_index[i] = single_trial_index[key] + np.arange(len(titer_names))
+
+    return trial_identifiers, identifier_index.ravel(), np.repeat(times, len(titer_names)), values.ravel()
+
+
+def HPLC_titer_text_parser(experiment, data, id_type='CSV'):
+    t0 = sys_time.time()
+
+    # The first two rows hold the titer names and types, the data follows
+    table = data['titers']
+    titer_columns = np.flatnonzero(table[0, 1:] != '') + 1
+    titer_names = table[0, titer_columns]
+    titer_types = table[1, titer_columns]
+
+    rows = table[2:]
+    rows = rows[rows[:, 0] != '']
+    time_point_arrays = titer_rows_to_arrays(titer_names, titer_types, rows[:, np.r_[0, titer_columns]], id_type)
 
-            temp_time_course.data_vector = np.array(row[1:])
-            experiment.titer_dict[temp_time_course.trial_identifier.unique_single_trial()] = temp_time_course
     tf = sys_time.time()
-    print("Parsed %i timeCourseObjects in %0.3fs\n" % (len(experiment.titer_dict), tf - t0))
-    experiment.parse_analyte_dict(experiment.titer_dict)
-    return data, t0
+    print("Parsed %i rows in %0.3fs" % (len(rows), tf - t0))
+    replicate_trial_list = parse_time_point_arrays(*time_point_arrays)
+    for rep in replicate_trial_list:
+        experiment.add_replicate_trial(rep)
+
+
+class TiterFileTail(object):
+    """
+    Follows a default titers text file while it is being written, e.g. by an instrument, and reads the rows added
+    since the last read. Used as a stand-in for an instrument feed, with :meth:`~Experiment.append_time_point_arrays`
+    """
+
+    def __init__(self, file_name, id_type='CSV', delimiter=None):
+        self.file_name = file_name
+        self.id_type = id_type
+        self.delimiter = get_delimiter(file_name) if delimiter is None else delimiter
+
+        # Offset in bytes of the first line which wasn't read
+        self.position = 0
+        self.titer_names = None
+        self.titer_types = None
+
+    def read(self):
+        """
+        Reads the complete lines added since the last read, a partially written last line is read next time
+
+        Returns
+        -------
+        trial_identifiers, identifier_index, times, values, see :func:`parse_time_point_arrays`, or None if no rows
+        were added
+        """
+        with open(self.file_name, 'rb') as f:
+            f.seek(self.position)
+            text = f.read()
+        text = text[:text.rfind(b'\n') + 1]
+        self.position += len(text)
+
+        rows = [row for row in csv.reader(text.decode().splitlines(), delimiter=self.delimiter) if row]
+        # The first two rows hold the titer names and types
+        if self.titer_names is None:
+            if len(rows) < 2:
+                self.position -= len(text)
+                return None
+            self.titer_names = [name for name in rows[0][1:] if name]
+            self.titer_types = rows[1][1:len(self.titer_names) + 1]
+            rows = rows[2:]
+
+        rows = [(row + [''] * len(self.titer_names))[:len(self.titer_names) + 1] for row in rows if row[0]]
+        if not rows:
+            return None
+        return titer_rows_to_arrays(self.titer_names, self.titer_types, rows, self.id_type)
+
+
+def tecan_OD_text(experiment, data, id_type='CSV'):
+    # The first row holds the times in seconds, the data follows with one well per row
+    table = data['OD']
+    # Data in seconds, data required to be in hours
+    time_vector = to_float_array(table[0, 1:]) / 3600
+
+    rows = table[1:]
+    rows = rows[rows[:, 0] != '']
+    values = to_float_array(rows[:, 1:])
+
+    trial_identifiers = []
+    for identifier in rows[:, 0]:
+        trial_identifier = parse_trial_identifier(identifier, id_type)
+        trial_identifier.analyte_name = 'OD600'
+        trial_identifier.analyte_type = 'biomass'
+        trial_identifiers.append(trial_identifier)
+
+    identifier_index, time_index = np.nonzero(~np.isnan(values) & ~np.isnan(time_vector)[None, :])
+    replicate_trial_list = parse_time_point_arrays(trial_identifiers, identifier_index, time_vector[time_index],
+                                                   values[identifier_index, time_index])
+    for rep in replicate_trial_list:
+        experiment.add_replicate_trial(rep)
+
+
+class RegisteredParser(object):
+    """
+    A parser in the registry, see :func:`register_parser`
+    """
+
+    def __init__(self, name, parse, sheet_names, layout=None, signature=None, text=False):
+        self.name = name
+        self.parse = parse
+        self.sheet_names = sheet_names
+        self.layout = layout
+        self.signature = signature
+        self.text = text
+
+    def matches(self, sheets):
+        """
+        Checks if the first rows of each sheet match the format, formats without a signature never match
+        """
+        if self.signature is None or not all(sheet_name in sheets for sheet_name in self.sheet_names):
+            return False
+        try:
+            return bool(self.signature(sheets))
+        except Exception:
+            return False
+
+
+parser_registry = OrderedDict()
+
+# Parse function of each format
+parser_case_dict = {}
+
+
+def register_parser(name, parse=None, sheet_names=None, layout=None, signature=None, text=False):
+    """
+    Registers a parser for a format, can also be used as a decorator of the parse function
+
+    Parameters
+    ----------
+    name (str): format name passed to :func:`parse_raw_data`
+    parse (callable or class): function parse(experiment, data, id_type) which parses a dict of sheets into the
+        experiment, or a :class:`Parser` class, which provides the sheet names, layout and signature
+    sheet_names (list): names of the sheets the parser reads, only these are loaded from the file
+    layout (str): arrangement of the data, e.g. 'plate', 'triplicate_plate', 'titers' or 'time_series'
+    signature (callable): function signature(sheets) which checks if the first rows of each sheet, a dict of lists
+        of rows, match the format. Formats without a signature are not auto-detected.
+    text (bool): the sheets are read from delimited text files rather than an xlsx file
+    """
+    def register(parse):
+        if isinstance(parse, type) and issubclass(parse, Parser):
+            registered = RegisteredParser(name, parse.parse_data,
+                                          sheet_names if sheet_names is not None else parse.get_sheet_names(),
+                                          layout if layout is not None else parse.layout,
+                                          signature if signature is not None else parse.matches, text)
+        else:
+            if sheet_names is None:
+                raise Exception('Sheet names are required to register parser %s' % name)
+            registered = RegisteredParser(name, parse, sheet_names, layout, signature, text)
+        parser_registry[name] = registered
+        parser_case_dict[name] = registered.parse
+        return parse
+
+    if parse is None:
+        return register
+    return register(parse)
 
 
-def parse_raw_data(format=None, id_type='CSV', file_name=None, data=None, experiment=None):
+def is_titer_table(sheets):
+    # Titer names in the first row, and their analyte types in the second
+    rows = sheets['titers']
+    titer_types = [cell for cell in rows[1][1:] if cell not in [None, '']]
+    return len(titer_types) > 0 and all(titer_type in analyte_case_dict for titer_type in titer_types)
+
+
+def is_time_series(sheets):
+    # Times in the first row, and a well in each following row
+    rows = sheets['OD']
+    times = [cell for cell in rows[0][1:] if cell not in [None, '']]
+    return len(times) > 0 and all(is_number(cell) for cell in times) and get_cell(rows, 1, 0) not in [None, '']
+
+
+register_parser('spectromax_OD', SpectromaxOD)
+register_parser('spectromax_OD_triplicate', SpectromaxODTriplicate)
+register_parser('spectromax_OD_384', SpectromaxOD384)
+register_parser('spectromax_OD_1536', SpectromaxOD1536)
+register_parser('default_titers', HPLC_titer_parser, ['titers'], 'titers', is_titer_table)
+register_parser('tecan_OD', tecan_OD, ['OD'], 'time_series', is_time_series)
+
+# Parsers for delimited text exports, each sheet is read from a text file
+register_parser('spectromax_OD_text', SpectromaxOD, text=True)
+register_parser('spectromax_OD_triplicate_text', SpectromaxODTriplicate, text=True)
+register_parser('spectromax_OD_384_text', SpectromaxOD384, text=True)
+register_parser('spectromax_OD_1536_text', SpectromaxOD1536, text=True)
+register_parser('default_titers_text', HPLC_titer_text_parser, ['titers'], 'titers', is_titer_table, text=True)
+register_parser('tecan_OD_text', tecan_OD_text, ['OD'], 'time_series', is_time_series, text=True)
+
+
+def is_text_export(file_name):
+    """
+    Checks if a file name is a text export: a delimited text file, a directory of them or a dict of file names
+    """
+    return isinstance(file_name, dict) or os.path.isdir(file_name) \
+        or os.path.splitext(file_name)[1].lower() in text_delimiters
+
+
+def sniff_workbook(workbook, number_of_rows=10):
+    """
+    Reads the first rows of each sheet of an open workbook
+    """
+    return {sheet_name: list(itertools.islice(rows, number_of_rows))
+            for sheet_name, rows in get_sheet_rows(workbook).items()}
+
+
+def sniff_delimited(file_name, number_of_rows=10):
+    """
+    Reads the first rows of a delimited text file, without loading the rest of the file
+    """
+    with open(file_name, newline='') as f:
+        return list(csv.reader(itertools.islice(f, number_of_rows), delimiter=get_delimiter(file_name)))
+
+
+def detect_format(file_name, workbook=None, number_of_rows=10):
+    """
+    Detects the format of a file from the first rows of its sheets, with the signatures of the registered parsers
+
+    Parameters
+    ----------
+    file_name (str): path to an xlsx file or a text export, see :func:`read_delimited_files`
+    workbook: the open workbook of an xlsx file, opened in read-only mode if None
+    number_of_rows (int): number of rows read from each sheet
+
+    Returns
+    -------
+    name (str): the first registered format which matches
+    """
+    if is_text_export(file_name):
+        if isinstance(file_name, dict):
+            sheets = {sheet_name: sniff_delimited(sheet_file_name, number_of_rows)
+                      for sheet_name, sheet_file_name in file_name.items()}
+        elif os.path.isdir(file_name):
+            sheets = {}
+            for sheet_file_name in sorted(os.listdir(file_name)):
+                sheet_name, extension = os.path.splitext(sheet_file_name)
+                if extension.lower() in text_delimiters and sheet_name not in sheets:
+                    sheets[sheet_name] = sniff_delimited(os.path.join(file_name, sheet_file_name), number_of_rows)
+        else:
+            # A single text file holds the only sheet of the format
+            rows = sniff_delimited(file_name, number_of_rows)
+            sheets = None
+    else:
+        if workbook is None:
+            workbook = open_workbook(file_name)
+            try:
+                sheets = sniff_workbook(workbook, number_of_rows)
+            finally:
+                workbook.close()
+        else:
+            sheets = sniff_workbook(workbook, number_of_rows)
+
+    text = is_text_export(file_name)
+    for name, registered in parser_registry.items():
+        if registered.text != text:
+            continue
+        if sheets is None:
+            if len(registered.sheet_names) == 1 and registered.matches({registered.sheet_names[0]: rows}):
+                return name
+        elif registered.matches(sheets):
+            return name
+
+    raise Exception('Could not detect the format of %s' % file_name)
+
+
+def parse_raw_data(format=None, id_type='CSV', file_name=None, data=None, experiment=None, read_only=True):
     """
     Parses raw data into an experiment object
 
     Parameters
     ----------
-    format (str): spectromax_OD, spectromax_OD_triplicate, default_titers, tecan_OD
+    format (str): spectromax_OD, spectromax_OD_triplicate, spectromax_OD_384, spectromax_OD_1536, default_titers,
+        tecan_OD, the same formats exported as delimited text with a _text suffix (e.g. spectromax_OD_text), or
+        any format added with :func:`register_parser`. Detected from the first rows of the file if None.
     id_type (str): traverse (id1:value|id2:value) or CSV (deprecated)
-    file_name (str): path to structured file
+    file_name (str): path to structured file. For text formats, a text file for single sheet formats, or a
+        directory with a `<sheet name>.csv`, .tsv or .txt file for each sheet, see :func:`read_delimited_files`
     data (str): dictionary containing data with sheets appropriate to parser
     experiment (str): `Experiment` instance to parse data into, will create new instance if None
+    read_only (bool): stream the rows of the sheets the parser needs from the file, rather than loading the full
+        workbook
 
     Returns
     -------
@@ -432,33 +995,191 @@ def parse_raw_data(format=None, id_type='CSV', file_name=None, data=None, experi
         experiment = Experiment()
 
     t0 = time.time()
-    if format is None:
-        raise Exception('No format defined')
-
-    if data is None:
-        if file_name is None:
-            raise Exception('No data or file name given to load data from')
-
-        # Get data from xlsx file
-        print('\nImporting data from %s...' % (file_name),end='')
-        # data = get_data(file_name)
-        xls_data = load_workbook(filename=file_name, data_only=True)
-        print('%0.1fs' % (time.time()-t0))
-
-        # Extract data from sheets
-        data = {sheet.title: [[elem.value if elem is not None else None for elem in row]
-                              for row in xls_data[sheet.title]] for sheet in xls_data}
-
-    # Import parsers
-    parser_case_dict = {'spectromax_OD' : spectromax_OD,
-                        'tecan_OD'      : tecan_OD,
-                        'default_titers': HPLC_titer_parser,
-                        'spectromax_OD_triplicate': spectromax_OD_triplicate
-                        }
-    if format in parser_case_dict.keys():
-        parser_case_dict[format](experiment, data=data, id_type=id_type)
+    if format is not None and format not in parser_registry:
+        raise Exception('Parser %s not found' % format)
+
+    workbook = None
+    try:
+        if data is None:
+            if file_name is None:
+                raise Exception('No data or file name given to load data from')
+
+            print('\nImporting data from %s...' % (file_name),end='')
+            text = parser_registry[format].text if format is not None else is_text_export(file_name)
+            if text:
+                # Get data from delimited text files
+                if format is None:
+                    format = detect_format(file_name)
+                data = read_delimited_files(file_name, parser_registry[format].sheet_names)
+            else:
+                # Get data from xlsx file
+                workbook = open_workbook(file_name, read_only=read_only)
+                if format is None:
+                    format = detect_format(file_name, workbook=workbook)
+                data = get_sheet_rows(workbook, parser_registry[format].sheet_names)
+            print('%0.1fs' % (time.time()-t0))
+        elif format is None:
+            raise Exception('No format defined')
+
+        parser_registry[format].parse(experiment, data=data, id_type=id_type)
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+    return experiment
+
+
+def parse_file_to_arrays(settings_dict, file_name, format=None, id_type='CSV'):
+    """
+    Parses a file into columnar arrays, used as the process pool worker for :func:`parse_many`
+
+    Parameters
+    ----------
+    settings_dict (dict): settings of the parent process
+    file_name (str): path to the file
+    format (str): format of the file, detected if None
+    id_type (str): traverse or CSV
+
+    Returns
+    -------
+    dict with the identifier records, and the index into them, time and value of each measurement
+    """
+    from .core.settings import settings
+    from .storage import identifier_record
+    vars(settings).update(settings_dict)
+    # Calculations are run once the files are merged
+    settings.live_calculations = False
+
+    experiment = parse_raw_data(format, id_type=id_type, file_name=file_name)
+
+    trial_identifiers, identifier_index, times, values = get_time_point_arrays(experiment)
+    return {'identifiers'     : [identifier_record(trial_identifier) for trial_identifier in trial_identifiers],
+            'identifier_index': identifier_index,
+            'times'           : times,
+            'values'          : values}
+
+
+def get_time_point_arrays(experiment):
+    """
+    Flattens the time courses of an experiment to time point arrays
+
+    Parameters
+    ----------
+    experiment (`Experiment`): experiment to flatten
+
+    Returns
+    -------
+    trial_identifiers, identifier_index, times, values, see :func:`parse_time_point_arrays`
+    """
+    trial_identifiers = []
+    identifier_index = []
+    times = []
+    values = []
+    for replicate in experiment.replicate_trial_dict.values():
+        for single_trial in replicate.single_trial_dict.values():
+            for time_course in single_trial.analyte_dict.values():
+                identifier_index.append(np.full(len(time_course.time_vector), len(trial_identifiers), dtype=int))
+                trial_identifiers.append(time_course.trial_identifier)
+                times.append(np.asarray(time_course.time_vector, dtype=float))
+                values.append(np.asarray(time_course.data_vector, dtype=float))
+
+    return (trial_identifiers,
+            np.concatenate(identifier_index) if trial_identifiers else np.empty(0, dtype=int),
+            np.concatenate(times) if trial_identifiers else np.empty(0),
+            np.concatenate(values) if trial_identifiers else np.empty(0))
+
+
+def append_raw_data(experiment, format=None, id_type='CSV', file_name=None, data=None):
+    """
+    Parses a file, e.g. a plate read of a running experiment, and adds its measurements to an experiment with
+    :meth:`~Experiment.append_time_point_arrays`, updating the calculations from the added measurements
+
+    Parameters
+    ----------
+    experiment (`Experiment`): experiment to add the measurements to
+    format (str): format of the file, see :func:`parse_raw_data`
+    id_type (str): traverse or CSV
+    file_name (str): path to the file
+    data (dict): the data of each sheet, used instead of reading the file
+    """
+    from .core.settings import settings
+
+    # The calculations are updated once the measurements are added
+    live_calculations = settings.live_calculations
+    settings.live_calculations = False
+    try:
+        parsed_experiment = parse_raw_data(format, id_type=id_type, file_name=file_name, data=data)
+    finally:
+        settings.live_calculations = live_calculations
+
+    experiment.append_time_point_arrays(*get_time_point_arrays(parsed_experiment))
+
+
+def parse_many(file_names, format=None, id_type='CSV', workers=None, experiment=None):
+    """
+    Parses many files into a single experiment. The files are parsed into columnar arrays in a process pool, and
+    the experiment is assembled from all of them in a single grouping pass, so trials which span several files
+    are merged.
+
+    Parameters
+    ----------
+    file_names (list): paths to the files, see :func:`parse_raw_data`
+    format (str): format of all the files, detected for each file if None
+    id_type (str): traverse (id1:value|id2:value) or CSV (deprecated)
+    workers (int): number of processes, defaults to the number of CPUs. Files are parsed in this process if 1.
+    experiment (str): `Experiment` instance to parse data into, will create new instance if None
+
+    Returns
+    -------
+    `Experiment`
+    """
+    from .core.settings import settings
+    from .storage import IdentifierBuilder
+
+    if experiment is None:
+        from .core.Experiment import Experiment
+        experiment = Experiment()
+
+    t0 = time.time()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(file_names)))
+
+    settings_dict = dict(vars(settings))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_file_to_arrays, itertools.repeat(settings_dict), file_names,
+                                        itertools.repeat(format), itertools.repeat(id_type)))
     else:
-        raise Exception('Parser %s not found', format)
+        try:
+            results = [parse_file_to_arrays(settings_dict, file_name, format, id_type) for file_name in file_names]
+        finally:
+            vars(settings).update(settings_dict)
+    print('Parsed %i files in %0.1fs' % (len(file_names), time.time() - t0))
+
+    # Identifiers which are the same in several files are built once, and share strains, media and environments
+    builder = IdentifierBuilder()
+    record_index = {}
+    trial_identifiers = []
+    identifier_index = []
+    for result in results:
+        file_index = np.empty(len(result['identifiers']), dtype=int)
+        for i, record in enumerate(result['identifiers']):
+            key = tuple(record.items())
+            if key not in record_index:
+                record_index[key] = len(trial_identifiers)
+                trial_identifiers.append(builder.build(record))
+            file_index[i] = record_index[key]
+        identifier_index.append(file_index[result['identifier_index']])
+
+    replicate_trial_list = parse_time_point_arrays(trial_identifiers,
+                                                   np.concatenate(identifier_index + [np.empty(0, dtype=int)]),
+                                                   np.concatenate([result['times'] for result in results] + [[]]),
+                                                   np.concatenate([result['values'] for result in results] + [[]]))
+    for rep in replicate_trial_list:
+        experiment.add_replicate_trial(rep)
+
+    if settings.live_calculations:   experiment.calculate()
 
     return experiment
 
@@ -467,60 +1188,197 @@ def parse_analyte_data(analyte_data_list):
     print('Parsing analyte list...',end='')
     t0 = time.time()
 
-    uniques = list(set([titer.trial_identifier.unique_single_trial() for titer in analyte_data_list]))
-
-    single_trial_list = []
-    for unique in uniques:
-        single_trial = SingleTrial()
-        for titer in analyte_data_list:
-            if titer.trial_identifier.unique_single_trial() == unique:
-                single_trial.add_analyte_data(titer)
-        single_trial_list.append(single_trial)
+    # Group the analytes by single trial in a single pass
+    single_trial_dict = {}
+    group_ids = {}
+    for titer in analyte_data_list:
+        key = titer.trial_identifier.get_group_id('single_trial', group_ids)
+        if key not in single_trial_dict:
+            single_trial_dict[key] = SingleTrial()
+        single_trial_dict[key].add_analyte_data(titer)
+    single_trial_list = list(single_trial_dict.values())
 
     tf = time.time()
     print("Parsed %i analytes in %0.1fms" % (len(single_trial_list), (tf - t0) * 1000))
 
     return parse_single_trial_list(single_trial_list)
 
+analyte_case_dict = {'biomass'  : Biomass,
+                     'substrate': Substrate,
+                     'product'  : Product,
+                     'reporter' : Reporter}
+
+
+def index_plate_identifiers(identifiers, analyte_name, analyte_type):
+    """
+    Flattens a plate of parsed identifiers into a list of identifiers and a plate of indices into that list
+
+    Parameters
+    ----------
+    identifiers (list): rows of :class:`~TimeCourseIdentifier` or None for empty wells
+    analyte_name (str): analyte name to set for each identifier
+    analyte_type (str): analyte type to set for each identifier
+
+    Returns
+    -------
+    trial_identifiers (list): the non-empty identifiers
+    identifier_indices (list): rows of indices into trial_identifiers, or None for empty wells
+    """
+    trial_identifiers = []
+    identifier_indices = []
+    for row in identifiers:
+        index_row = []
+        for trial_identifier in row:
+            if trial_identifier is None:
+                index_row.append(None)
+            else:
+                trial_identifier.analyte_name = analyte_name
+                trial_identifier.analyte_type = analyte_type
+                index_row.append(len(trial_identifiers))
+                trial_identifiers.append(trial_identifier)
+        identifier_indices.append(index_row)
+    return trial_identifiers, identifier_indices
+
+
+def group_time_points(keys, times):
+    """
+    Groups time points by key with a single sort, and checks for duplicate times within each group
+
+    Parameters
+    ----------
+    keys (array): integer key for each time point
+    times (array): time for each time point
+
+    Returns
+    -------
+    order (array): indices which sort the time points by key then time
+    starts (array): start of each group in the sorted order
+    ends (array): end of each group in the sorted order
+    """
+    order = np.lexsort((times, keys))
+    sorted_keys = keys[order]
+    sorted_times = times[order]
+
+    boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(sorted_keys)]))
+
+    duplicates = np.flatnonzero((np.diff(sorted_keys) == 0) & (np.diff(sorted_times) == 0))
+    if len(duplicates) > 0:
+        raise Exception('Duplicate time points found, this is not supported - likely an identifier input error. '
+                        'Time: %s' % sorted_times[duplicates[0]])
+
+    return order, starts, ends
+
+
+def get_time_course_keys(trial_identifiers):
+    """
+    Gets the integer group id for each identifier, identifiers describing the same time course share an id
+
+    Parameters
+    ----------
+    trial_identifiers (list): :class:`~TimeCourseIdentifier` objects
+
+    Returns
+    -------
+    keys (array): integer key for each identifier
+    """
+    group_ids = {}
+    return np.array([trial_identifier.get_group_id('time_point', group_ids)
+                     for trial_identifier in trial_identifiers], dtype=int)
+
+
+def create_time_course(trial_identifier, time_vector, data_vector):
+    if trial_identifier.analyte_type in analyte_case_dict.keys():
+        return analyte_case_dict[trial_identifier.analyte_type].from_arrays(trial_identifier,
+                                                                            time_vector, data_vector)
+    else:
+        raise Exception('Unexpected analyte type %s' % trial_identifier.analyte_type)
+
+
+def parse_time_point_arrays(trial_identifiers, identifier_index, times, values):
+    """
+    Parses flat arrays of measurements into replicate trials, without creating a :class:`~TimePoint` for each
+    measurement. Measurements are grouped into time courses with a single sort and split.
+
+    Parameters
+    ----------
+    trial_identifiers (list): :class:`~TimeCourseIdentifier` objects with analyte_name and analyte_type set
+    identifier_index (array): index into trial_identifiers for each measurement
+    times (array): time of each measurement
+    values (array): value of each measurement
+
+    Returns
+    -------
+    list of :class:`~ReplicateTrial`
+    """
+    print('Parsing time point arrays...',end='')
+    t0 = sys_time.time()
+
+    identifier_index = np.asarray(identifier_index, dtype=int)
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    analyte_list = []
+    if len(identifier_index) > 0:
+        identifier_keys = get_time_course_keys(trial_identifiers)
+        keys = identifier_keys[identifier_index]
+        order, starts, ends = group_time_points(keys, times)
+        sorted_times = times[order]
+        sorted_values = values[order]
+
+        for start, end in zip(starts, ends):
+            analyte_list.append(create_time_course(trial_identifiers[identifier_index[order[start]]],
+                                                   sorted_times[start:end],
+                                                   sorted_values[start:end]))
+
+    tf = sys_time.time()
+    print("Parsed %i time points in %0.1fs" % (len(times), (tf - t0)))
+    return parse_analyte_data(analyte_list)
+
+
 def parse_time_point_list(time_point_list):
     print('Parsing time point list...',end='')
     t0 = time.time()
-    analyte_dict = {}
-    for timePoint in time_point_list:
-        if timePoint.get_unique_timepoint_id() in analyte_dict:
-            analyte_dict[timePoint.get_unique_timepoint_id()].add_timepoint(timePoint)
-        else:
-            case_dict = {'biomass': Biomass,
-                         'substrate': Substrate,
-                         'product': Product,
-                         'reporter': Reporter}
-            if timePoint.trial_identifier.analyte_type in case_dict.keys():
-                analyte_dict[timePoint.get_unique_timepoint_id()] = \
-                    case_dict[timePoint.trial_identifier.analyte_type]()
-            else:
-                raise Exception('Unexpected analyte type %s' % timePoint.trial_identifier.analyte_type)
 
-            analyte_dict[timePoint.get_unique_timepoint_id()].add_timepoint(timePoint)
+    times = np.array([time_point.time for time_point in time_point_list], dtype=float)
+    values = np.array([time_point.data for time_point in time_point_list], dtype=float)
+    keys = get_time_course_keys([time_point.trial_identifier for time_point in time_point_list])
+
+    analyte_list = []
+    if len(time_point_list) > 0:
+        order, starts, ends = group_time_points(keys, times)
+
+        for start, end in zip(starts, ends):
+            group = order[start:end]
+            # The first time point added defines the identifier, as in TimeCourse.add_timepoint
+            analyte = create_time_course(time_point_list[group.min()].trial_identifier,
+                                         times[group], values[group])
+
+            analyte.time_points = [time_point_list[i] for i in group]
+            for time_point in analyte.time_points:
+                time_point.parent = analyte
+            analyte._time_points_pending = False
+            analyte_list.append(analyte)
 
     tf = time.time()
     print("Parsed %i time points in %0.1fs" % (len(time_point_list), (tf - t0)))
-    return parse_analyte_data(list(analyte_dict.values()))
+    return parse_analyte_data(analyte_list)
 
 def parse_single_trial_list(single_trial_list):
     print('Parsing single trial list...',end='')
     t0 = time.time()
-    uniques = list(set([single_trial.trial_identifier.unique_replicate_trial()
-                        for single_trial in single_trial_list]
-                       )
-                   )
-
-    replicate_trial_list = []
-    for unique in uniques:
-        replicate_trial = ReplicateTrial()
-        for single_trial in single_trial_list:
-            if single_trial.trial_identifier.unique_replicate_trial() == unique:
-                replicate_trial.add_replicate(single_trial)
-                replicate_trial_list.append(replicate_trial)
+
+    # Group the single trials by replicate trial in a single pass
+    replicate_trial_dict = {}
+    group_ids = {}
+    for single_trial in single_trial_list:
+        key = single_trial.trial_identifier.get_group_id('replicate_trial', group_ids)
+        if key not in replicate_trial_dict:
+            replicate_trial_dict[key] = ReplicateTrial()
+        replicate_trial_dict[key].add_replicate(single_trial)
+    replicate_trial_list = list(replicate_trial_dict.values())
+
     tf = time.time()
     print("Parsed %i replicates in %0.1fs" % (len(replicate_trial_list), (tf - t0)))
     return replicate_trial_list
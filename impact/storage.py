@@ -0,0 +1,308 @@
+"""
+Columnar storage of experiments as a directory of Parquet files.
+
+An experiment is stored as:
+
+    time_points.parquet: one row per measurement (identifier_id, analyte, time, value), sorted by identifier_id
+                         and time so row group statistics can skip unselected time courses
+    identifiers.parquet: one row per time course with the flattened :class:`~TimeCourseIdentifier`
+    fit_params.parquet: one row per fit parameter (identifier_id, parameter_name, parameter_value)
+    experiment.json: the experiment attributes
+
+Requires pyarrow, install with `pip install impact[storage]`.
+"""
+
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+storage_version = 1
+
+identifier_columns = ['strain', 'strain_formal_name', 'strain_id_1', 'strain_id_2', 'plasmids', 'knockouts',
+                      'media', 'media_base', 'media_components',
+                      'labware', 'shaking_speed', 'shaking_diameter', 'temperature',
+                      'id_1', 'id_2', 'id_3', 'replicate_id', 'analyte_name', 'analyte_type', 'blank']
+
+experiment_attrs = ['title', 'scientist_1', 'scientist_2', 'notes', 'import_date', 'start_date', 'end_date']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise Exception('pyarrow is required for experiment storage, install with pip install impact[storage]')
+
+
+def identifier_record(trial_identifier):
+    """
+    Flattens a :class:`~TimeCourseIdentifier` into a dict of the identifier_columns
+    """
+    strain = trial_identifier.strain
+    media = trial_identifier.media
+    environment = trial_identifier.environment
+
+    return {
+        'strain'            : strain.name,
+        'strain_formal_name': strain.formal_name,
+        'strain_id_1'       : strain.id_1,
+        'strain_id_2'       : strain.id_2,
+        'plasmids'          : ','.join(str(plasmid) for plasmid in strain.plasmids),
+        'knockouts'         : ','.join(str(knockout) for knockout in strain.knockouts),
+        'media'             : media.name,
+        'media_base'        : media.parent.name if media.parent is not None else None,
+        'media_components'  : json.dumps([[cc.component_name, cc.concentration, cc.unit]
+                                          for cc in media.components.values()]),
+        'labware'           : environment.labware.name if environment.labware is not None else None,
+        'shaking_speed'     : environment.shaking_speed,
+        'shaking_diameter'  : environment.shaking_diameter,
+        'temperature'       : environment.temperature,
+        'id_1'              : trial_identifier.id_1,
+        'id_2'              : trial_identifier.id_2,
+        'id_3'              : trial_identifier.id_3,
+        'replicate_id'      : trial_identifier.replicate_id,
+        'analyte_name'      : trial_identifier.analyte_name,
+        'analyte_type'      : trial_identifier.analyte_type,
+        'blank'             : bool(getattr(trial_identifier, 'blank', False))
+    }
+
+
+class IdentifierBuilder(object):
+    """
+    Rebuilds :class:`~TimeCourseIdentifier` objects from identifier records. Identifiers with the same strain, media
+    or environment share those objects, as they do when parsed.
+    """
+
+    def __init__(self):
+        self._strains = {}
+        self._media = {}
+        self._environments = {}
+
+    def build(self, record):
+        from .core.TrialIdentifier import TimeCourseIdentifier
+
+        trial_identifier = TimeCourseIdentifier(strain=self.get_strain(record),
+                                                media=self.get_media(record),
+                                                environment=self.get_environment(record))
+        for attr in ['id_1', 'id_2', 'id_3', 'analyte_name', 'analyte_type']:
+            setattr(trial_identifier, attr, _none_if_nan(record[attr]))
+        replicate_id = _none_if_nan(record['replicate_id'])
+        trial_identifier.replicate_id = None if replicate_id is None else int(replicate_id)
+        if record['blank']:
+            trial_identifier.blank = True
+        return trial_identifier
+
+    def get_strain(self, record):
+        from .core.TrialIdentifier import Strain, Plasmid, Knockout
+
+        key = tuple(record[column] for column in ['strain', 'strain_formal_name', 'strain_id_1', 'strain_id_2',
+                                                  'plasmids', 'knockouts'])
+        if key not in self._strains:
+            strain = Strain(name=_none_if_nan(record['strain']))
+            strain.formal_name = _none_if_nan(record['strain_formal_name'])
+            strain.id_1 = _none_if_nan(record['strain_id_1'])
+            strain.id_2 = _none_if_nan(record['strain_id_2'])
+            for name in _split(record['plasmids']):
+                strain.plasmids.append(Plasmid(name=name))
+            for gene in _split(record['knockouts']):
+                strain.knockouts.append(Knockout(gene=gene))
+            self._strains[key] = strain
+        return self._strains[key]
+
+    def get_media(self, record):
+        from .core.TrialIdentifier import Media, MediaComponent, ComponentConcentration
+
+        key = tuple(record[column] for column in ['media', 'media_base', 'media_components'])
+        if key not in self._media:
+            media = Media(name=_none_if_nan(record['media']))
+            if _none_if_nan(record['media_base']) is not None:
+                media.parent = Media(name=record['media_base'])
+            for name, concentration, unit in json.loads(record['media_components']):
+                media.add_component(ComponentConcentration(MediaComponent(name), concentration, unit))
+            self._media[key] = media
+        return self._media[key]
+
+    def get_environment(self, record):
+        from .core.TrialIdentifier import Environment, Labware
+
+        key = tuple(record[column] for column in ['labware', 'shaking_speed', 'shaking_diameter', 'temperature'])
+        if key not in self._environments:
+            environment = Environment(labware=Labware(name=_none_if_nan(record['labware'])))
+            for attr in ['shaking_speed', 'shaking_diameter', 'temperature']:
+                setattr(environment, attr, _none_if_nan(record[attr]))
+            self._environments[key] = environment
+        return self._environments[key]
+
+
+def save_experiment(experiment, path, row_group_size=1000000):
+    """
+    Saves the raw data and fit parameters of an experiment to a directory of Parquet files
+
+    Parameters
+    ----------
+    experiment : :class:`~Experiment`
+    path : str
+        Directory to save to, created if it doesn't exist. Existing files are overwritten.
+    row_group_size : int
+        Number of measurements in each row group of time_points.parquet
+    """
+    _require_pyarrow()
+
+    print('Saving experiment...', end='')
+    t0 = time.time()
+
+    time_courses = [time_course for replicate in experiment.replicate_trial_dict.values()
+                    for time_course in replicate.get_time_courses()]
+
+    # Order the time courses by strain and analyte, so selections read few row groups
+    records = [identifier_record(time_course.trial_identifier) for time_course in time_courses]
+    order = sorted(range(len(records)), key=lambda i: (str(records[i]['strain']), str(records[i]['analyte_name']),
+                                                       str(records[i]['replicate_id']), i))
+    time_courses = [time_courses[i] for i in order]
+    identifiers = pd.DataFrame([records[i] for i in order], columns=identifier_columns)
+    identifiers.insert(0, 'identifier_id', np.arange(len(identifiers), dtype=np.int32))
+
+    lengths = np.array([len(time_course.time_vector) for time_course in time_courses], dtype=int)
+    identifier_id = np.repeat(np.arange(len(time_courses), dtype=np.int32), lengths)
+    if time_courses:
+        times = np.concatenate([time_course.time_vector for time_course in time_courses]).astype(float)
+        values = np.concatenate([time_course.data_vector for time_course in time_courses]).astype(float)
+    else:
+        times = values = np.zeros(0)
+    analyte_names, analyte_index = np.unique(identifiers['analyte_name'].astype(str).values, return_inverse=True)
+    time_points = pa.table({'identifier_id': pa.array(identifier_id, type=pa.int32()),
+                            'analyte'      : pa.DictionaryArray.from_arrays(
+                                analyte_index[identifier_id].astype(np.int32), analyte_names),
+                            'time'         : pa.array(times, type=pa.float64()),
+                            'value'        : pa.array(values, type=pa.float64())})
+
+    fit_params = pd.DataFrame([(i, name, time_course.fit_params[name].parameter_value)
+                               for i, time_course in enumerate(time_courses)
+                               for name in time_course.fit_params],
+                              columns=['identifier_id', 'parameter_name', 'parameter_value'])
+    fit_params['identifier_id'] = fit_params['identifier_id'].astype(np.int32)
+    fit_params['parameter_value'] = fit_params['parameter_value'].astype(float)
+
+    os.makedirs(path, exist_ok=True)
+    pq.write_table(time_points, os.path.join(path, 'time_points.parquet'), row_group_size=row_group_size)
+    pq.write_table(pa.Table.from_pandas(identifiers, preserve_index=False), os.path.join(path, 'identifiers.parquet'))
+    pq.write_table(pa.Table.from_pandas(fit_params, preserve_index=False), os.path.join(path, 'fit_params.parquet'))
+    with open(os.path.join(path, 'experiment.json'), 'w') as f:
+        json.dump({'version'   : storage_version,
+                   'attributes': {attr: _to_json(getattr(experiment, attr, None)) for attr in experiment_attrs}},
+                  f, indent=2)
+
+    print("Saved %i time points in %0.1fs" % (len(times), time.time() - t0))
+
+
+def load_experiment(path, strains=None, analytes=None, memory_map=True, load_fit_params=True):
+    """
+    Loads an experiment saved with :func:`save_experiment`. Only the selected strains and analytes are read from
+    disk.
+
+    Parameters
+    ----------
+    path : str
+        Directory the experiment was saved to
+    strains : list of str, optional
+        Strain names to load, defaults to all strains
+    analytes : list of str, optional
+        Analyte names to load, defaults to all analytes
+    memory_map : bool
+        Memory map the files rather than reading them into memory
+    load_fit_params : bool
+        Restore the saved fit parameters. The curve fit is then skipped the next time the time course is
+        calculated.
+
+    Returns
+    -------
+    :class:`~Experiment`
+    """
+    from .core.Experiment import Experiment
+    from .parsers import parse_time_point_arrays
+    from .core.AnalyteData import FitParameter
+
+    _require_pyarrow()
+
+    print('Loading experiment...', end='')
+    t0 = time.time()
+
+    with open(os.path.join(path, 'experiment.json')) as f:
+        info = json.load(f)
+    if info['version'] > storage_version:
+        raise Exception('Experiment was saved with a newer storage version: ' + str(info['version']))
+
+    identifiers = pq.read_table(os.path.join(path, 'identifiers.parquet'), memory_map=memory_map).to_pandas()
+    selected = np.ones(len(identifiers), dtype=bool)
+    if strains is not None:
+        selected &= identifiers['strain'].isin(strains).values
+    if analytes is not None:
+        selected &= identifiers['analyte_name'].isin(analytes).values
+    identifiers = identifiers[selected]
+    identifier_ids = identifiers['identifier_id'].values
+
+    # Push the selection down to the reader, so only the row groups of the selected time courses are read
+    filters = None if selected.all() else [('identifier_id', 'in', identifier_ids.tolist())]
+    if len(identifier_ids) > 0:
+        time_points = pq.read_table(os.path.join(path, 'time_points.parquet'),
+                                    columns=['identifier_id', 'time', 'value'],
+                                    filters=filters, memory_map=memory_map)
+        identifier_index = np.searchsorted(identifier_ids, time_points.column('identifier_id').to_numpy())
+        times = time_points.column('time').to_numpy()
+        values = time_points.column('value').to_numpy()
+    else:
+        identifier_index, times, values = [], [], []
+
+    builder = IdentifierBuilder()
+    trial_identifiers = [builder.build(record) for record in identifiers.to_dict('records')]
+    replicates = parse_time_point_arrays(trial_identifiers, identifier_index, times, values)
+
+    if load_fit_params and len(identifier_ids) > 0:
+        fit_params = pq.read_table(os.path.join(path, 'fit_params.parquet'), filters=filters,
+                                   memory_map=memory_map).to_pandas()
+        time_course_dict = {id(time_course.trial_identifier): time_course
+                            for replicate in replicates for time_course in replicate.get_time_courses()}
+        for identifier_id, group in fit_params.groupby('identifier_id'):
+            time_course = time_course_dict[id(trial_identifiers[np.searchsorted(identifier_ids, identifier_id)])]
+            time_course.fit_params = {name: FitParameter(name, value) for name, value
+                                      in zip(group['parameter_name'], group['parameter_value'])}
+            time_course._prefit = True
+
+    experiment = Experiment(**{attr: _from_json(attr, value) for attr, value in info['attributes'].items()
+                               if value is not None})
+    for replicate in replicates:
+        experiment.add_replicate_trial(replicate)
+
+    print("Loaded %i time points in %0.1fs" % (len(times), time.time() - t0))
+    return experiment
+
+
+def _split(value):
+    value = _none_if_nan(value)
+    return value.split(',') if value else []
+
+
+def _none_if_nan(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _from_json(attr, value):
+    if attr.endswith('_date'):
+        return datetime.date.fromisoformat(value[:10])
+    return value
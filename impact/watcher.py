@@ -0,0 +1,356 @@
+"""
+Service which watches a drop folder for instrument export files and merges them into experiments.
+
+The folder is polled, and a file is parsed once its size and modification time haven't changed for `settle_time`
+seconds, so files which are still being written are skipped. Files are parsed with the parsers of
+:mod:`impact.parsers` in a process pool, off the event loop, and the parsed measurements are added to the
+experiment of the file with :meth:`~Experiment.append_time_point_arrays`. Files are grouped into experiments by
+the folder they are dropped in, e.g. `<drop folder>/<experiment>/read_1.xlsx`.
+
+The queues between scanning, parsing and merging are bounded. When merging falls behind, parsing waits, and when
+parsing falls behind, new files wait in the folder.
+
+Each file should only hold measurements which aren't in the experiment yet, e.g. one plate read. A file is parsed
+again if it is overwritten. Run from the command line with:
+
+    python -m impact.watcher <drop folder> [--format FORMAT] [--id-type CSV]
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Extensions of the files which are parsed, others are ignored
+file_extensions = ['.xlsx', '.csv', '.tsv', '.txt']
+
+
+def is_export_file(file_name):
+    """
+    Whether a file is an instrument export, and not e.g. an Excel lock file or a hidden temporary file
+    """
+    base_name = os.path.basename(file_name)
+    return os.path.splitext(base_name)[1].lower() in file_extensions \
+        and not base_name.startswith('.') and not base_name.startswith('~$')
+
+
+def folder_experiment_key(directory, file_name):
+    """
+    The default experiment key, the folder the file was dropped in relative to the drop folder, or the name of the
+    drop folder for files dropped directly in it
+    """
+    key = os.path.dirname(os.path.relpath(file_name, directory))
+    return key if key else os.path.basename(os.path.abspath(directory))
+
+
+class DropFolderWatcher(object):
+    """
+    Watches a drop folder and merges the parsed files into an experiment for each folder, see :mod:`impact.watcher`
+
+    Parameters
+    ----------
+    directory : str
+        Drop folder to watch, including its sub folders
+    format : str, optional
+        Format of the files, see :func:`~impact.parsers.parse_raw_data`, detected for each file if None
+    id_type : str
+        traverse or CSV
+    experiment_key : function, optional
+        Returns the key of the experiment for a file name, defaults to the folder of the file
+    poll_interval : float
+        Seconds between scans of the drop folder
+    settle_time : float
+        Seconds that a file must be unchanged before it is parsed
+    max_queue_size : int
+        Size of the queues of files to parse and of parsed files to merge
+    workers : int
+        Number of processes used to parse files
+    experiments : dict, optional
+        Experiments to merge into, by experiment key. New experiments are added when files for new keys arrive.
+    """
+
+    def __init__(self, directory, format=None, id_type='CSV', experiment_key=None, poll_interval=1.0,
+                 settle_time=2.0, max_queue_size=8, workers=1, experiments=None):
+        self.directory = directory
+        self.format = format
+        self.id_type = id_type
+        self.experiment_key = experiment_key if experiment_key is not None \
+            else lambda file_name: folder_experiment_key(directory, file_name)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+
+        # Experiment and identifier builder for each experiment key
+        self.experiments = experiments if experiments is not None else {}
+        self._identifier_builders = {}
+
+        # Size and modification time of the files waiting to settle, and when they were first seen unchanged
+        self._pending = {}
+        # Size and modification time of the files when they were queued, they aren't parsed again unless changed
+        self._queued = {}
+        self.queued_files = 0
+
+        self._parse_queue = None
+        self._merge_queue = None
+        self._stopped = None
+        self._parsing = 0
+
+        self.parsed_files = 0
+        self.merged_files = 0
+        self.failed_files = 0
+        self.parse_latencies = deque(maxlen=100)
+        self.errors = deque(maxlen=20)
+
+    @property
+    def status(self):
+        """
+        Returns the state of the service: the number of files waiting to settle, to be parsed, being parsed and
+        waiting to be merged, the parse latency in seconds, and the number of replicate trials in each experiment
+        """
+        return {'pending_files'     : len(self._pending),
+                'parse_queue_depth' : self._parse_queue.qsize() if self._parse_queue is not None else 0,
+                'parsing'           : self._parsing,
+                'merge_queue_depth' : self._merge_queue.qsize() if self._merge_queue is not None else 0,
+                'parsed_files'      : self.parsed_files,
+                'merged_files'      : self.merged_files,
+                'failed_files'      : self.failed_files,
+                'last_parse_latency': self.parse_latencies[-1] if self.parse_latencies else None,
+                'mean_parse_latency': float(np.mean(self.parse_latencies)) if self.parse_latencies else None,
+                'errors'            : list(self.errors),
+                'experiments'       : {key: len(experiment.replicate_trial_dict)
+                                       for key, experiment in self.experiments.items()}}
+
+    def scan(self, now=None):
+        """
+        Scans the drop folder once
+
+        Returns
+        -------
+        list
+            The files which have settled since the last scan, in the order of their modification time
+        """
+        if now is None:
+            now = time.time()
+
+        found = {}
+        for root, directories, file_names in os.walk(self.directory):
+            directories[:] = [directory for directory in directories if not directory.startswith('.')]
+            for file_name in file_names:
+                file_name = os.path.join(root, file_name)
+                if not is_export_file(file_name):
+                    continue
+                try:
+                    stat = os.stat(file_name)
+                except OSError:
+                    # Removed or renamed since it was listed
+                    continue
+                if self._queued.get(file_name) != (stat.st_size, stat.st_mtime):
+                    found[file_name] = (stat.st_size, stat.st_mtime)
+
+        settled = []
+        for file_name, signature in found.items():
+            previous_signature, since = self._pending.get(file_name, (None, now))
+            if signature != previous_signature:
+                self._pending[file_name] = (signature, now)
+            elif signature[0] > 0 and now - since >= self.settle_time:
+                settled.append(file_name)
+
+        # Forget files which disappeared before they settled
+        for file_name in set(self._pending) - set(found):
+            del self._pending[file_name]
+        for file_name in settled:
+            del self._pending[file_name]
+            self._queued[file_name] = found[file_name]
+        self.queued_files += len(settled)
+        return sorted(settled, key=lambda file_name: found[file_name][1])
+
+    async def run(self):
+        """
+        Runs the service until :meth:`stop` is called
+        """
+        from .core.settings import settings
+
+        self._parse_queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._merge_queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._stopped = asyncio.Event()
+
+        settings_dict = dict(vars(settings))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            tasks = [asyncio.ensure_future(self._scan_loop()), asyncio.ensure_future(self._merge_loop())] \
+                    + [asyncio.ensure_future(self._parse_loop(executor, settings_dict))
+                       for _ in range(self.workers)]
+            try:
+                await self._stopped.wait()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        """
+        Stops the service, files which are being parsed or merged are dropped
+        """
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def wait_until_idle(self, timeout=None):
+        """
+        Waits until all files in the drop folder are merged, e.g. in tests
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait before raising an exception
+        """
+        t0 = time.time()
+        while True:
+            status = self.status
+            if not status['pending_files'] and self.merged_files + self.failed_files == self.queued_files \
+                    and not any(self._unqueued_files()):
+                return
+            if timeout is not None and time.time() - t0 > timeout:
+                raise Exception('Drop folder watcher not idle after %0.1fs: %s' % (timeout, status))
+            await asyncio.sleep(self.poll_interval)
+
+    def _unqueued_files(self):
+        for root, directories, file_names in os.walk(self.directory):
+            directories[:] = [directory for directory in directories if not directory.startswith('.')]
+            for file_name in file_names:
+                file_name = os.path.join(root, file_name)
+                if not is_export_file(file_name):
+                    continue
+                try:
+                    stat = os.stat(file_name)
+                except OSError:
+                    continue
+                if self._queued.get(file_name) != (stat.st_size, stat.st_mtime):
+                    yield file_name
+
+    async def _scan_loop(self):
+        while True:
+            for file_name in self.scan():
+                # Waits while the parse queue is full
+                await self._parse_queue.put(file_name)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _parse_loop(self, executor, settings_dict):
+        from .parsers import parse_file_to_arrays
+
+        loop = asyncio.get_event_loop()
+        while True:
+            file_name = await self._parse_queue.get()
+            self._parsing += 1
+            t0 = time.time()
+            try:
+                result = await loop.run_in_executor(executor, parse_file_to_arrays, settings_dict, file_name,
+                                                    self.format, self.id_type)
+            except Exception as e:
+                self._fail(file_name, e)
+                continue
+            finally:
+                self._parsing -= 1
+
+            self.parse_latencies.append(time.time() - t0)
+            self.parsed_files += 1
+            # Waits while the merge queue is full
+            await self._merge_queue.put((file_name, result))
+
+    async def _merge_loop(self):
+        from .core.settings import settings
+
+        loop = asyncio.get_event_loop()
+        while True:
+            file_name, result = await self._merge_queue.get()
+            try:
+                experiment = self.merge(file_name, result)
+                # Calculated in a thread so the event loop keeps scanning, the next merge waits for it
+                if settings.live_calculations:
+                    await loop.run_in_executor(None, experiment.calculate)
+            except Exception as e:
+                self._fail(file_name, e)
+            else:
+                self.merged_files += 1
+            # Let the other tasks run between merges
+            await asyncio.sleep(0)
+
+    def merge(self, file_name, result):
+        """
+        Adds the measurements of a parsed file to the experiment of the file. The experiment isn't calculated.
+
+        Parameters
+        ----------
+        file_name : str
+            Path to the file
+        result : dict
+            The parsed file, see :func:`~impact.parsers.parse_file_to_arrays`
+
+        Returns
+        -------
+        :class:`~Experiment`
+            The experiment the measurements were added to
+        """
+        from .core.Experiment import Experiment
+        from .storage import IdentifierBuilder
+
+        key = self.experiment_key(file_name)
+        if key not in self.experiments:
+            self.experiments[key] = Experiment(title=key)
+        if key not in self._identifier_builders:
+            self._identifier_builders[key] = IdentifierBuilder()
+
+        trial_identifiers = [self._identifier_builders[key].build(record) for record in result['identifiers']]
+        experiment = self.experiments[key]
+        experiment.append_time_point_arrays(trial_identifiers, result['identifier_index'], result['times'],
+                                            result['values'])
+        print('Merged %s into %s' % (file_name, key))
+        return experiment
+
+    def _fail(self, file_name, error):
+        self.failed_files += 1
+        self.errors.append('%s: %s' % (file_name, error))
+        print('Failed to import %s: %s' % (file_name, error))
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Watch a drop folder and merge the files into experiments')
+    parser.add_argument('directory', help='drop folder to watch')
+    parser.add_argument('--format', default=None, help='format of the files, detected if not given')
+    parser.add_argument('--id-type', default='CSV', help='traverse or CSV')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between scans')
+    parser.add_argument('--settle-time', type=float, default=2.0,
+                        help='seconds that a file must be unchanged before it is parsed')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used to parse files')
+    parser.add_argument('--status-interval', type=float, default=60.0, help='seconds between status reports')
+    args = parser.parse_args(args)
+
+    watcher = DropFolderWatcher(args.directory, format=args.format, id_type=args.id_type,
+                                poll_interval=args.poll_interval, settle_time=args.settle_time,
+                                workers=args.workers)
+
+    async def report_status():
+        while True:
+            await asyncio.sleep(args.status_interval)
+            print(watcher.status)
+
+    async def run():
+        status_task = asyncio.ensure_future(report_status())
+        try:
+            await watcher.run()
+        finally:
+            status_task.cancel()
+
+    print('Watching %s' % args.directory)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
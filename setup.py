@@ -4,7 +4,7 @@ with open('requirements.txt') as f:
     requirements = f.read().splitlines()
 
 extras = {}
-for extra in ['docs','plotting','modeling']:
+for extra in ['docs','plotting','modeling','storage']:
     with open('requirements'+'_'+extra+'.txt') as f:
         extras[extra] = f.read().splitlines()
 
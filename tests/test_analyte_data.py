@@ -0,0 +1,92 @@
+import unittest
+import numpy as np
+import impact
+
+
+class TestTimeCourse(unittest.TestCase):
+    def setUp(self):
+        self.ti = impact.TimeCourseIdentifier()
+        self.ti.parse_identifier('strain:MG|rep:1')
+        self.ti.analyte_name = 'OD600'
+        self.ti.analyte_type = 'biomass'
+
+    def add_time_points(self, time_course, times):
+        for time in times:
+            time_course.add_timepoint(impact.TimePoint(trial_identifier=self.ti, time=time, data=time * 2))
+
+    def test_add_timepoint(self):
+        time_course = impact.TimeCourse()
+        self.add_time_points(time_course, [0, 1, 3, 2, 5, 4])
+
+        self.assertEqual(list(time_course.time_vector), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(list(time_course.data_vector), [0, 2, 4, 6, 8, 10])
+        self.assertEqual([time_point.time for time_point in time_course.time_points], [0, 1, 2, 3, 4, 5])
+
+        # Reading the series and adding more points
+        self.assertEqual(list(time_course.pd_series.index), [0, 1, 2, 3, 4, 5])
+        self.add_time_points(time_course, [100, 2.5])
+        self.assertEqual(list(time_course.pd_series.index), [0, 1, 2, 2.5, 3, 4, 5, 100])
+        self.assertEqual(time_course.pd_series[100], 200)
+
+    def test_duplicate_time_point(self):
+        time_course = impact.TimeCourse()
+        self.add_time_points(time_course, [0, 1, 2])
+        with self.assertRaises(Exception):
+            self.add_time_points(time_course, [1])
+        self.assertEqual(len(time_course.time_points), 3)
+        self.assertEqual(list(time_course.time_vector), [0, 1, 2])
+
+    def test_read_and_append(self):
+        time_course = impact.TimeCourse.from_arrays(self.ti, np.arange(5.), np.arange(5.) * 2)
+        time_course.append_arrays([5, 6], [10, 12])
+        series = time_course.pd_series
+
+        # Reading the series keeps the buffers, the series isn't changed by later appends
+        buffer = time_course._times
+        time_course.append_arrays([7], [14])
+        self.assertIs(time_course._times, buffer)
+        self.assertEqual(len(series), 7)
+        self.assertEqual(list(time_course.pd_series.index), list(range(8)))
+
+    def test_append_duplicate_time(self):
+        time_course = impact.TimeCourse.from_arrays(self.ti, np.arange(5.), np.arange(5.) * 2)
+        time_course.append_arrays([5], [10])
+        for times in [[2.5, 3], [6, 4.5, 6]]:
+            with self.assertRaises(Exception):
+                time_course.append_arrays(times, np.zeros(len(times)))
+            self.assertEqual(list(time_course.time_vector), [0, 1, 2, 3, 4, 5])
+            self.assertEqual(list(time_course.data_vector), [0, 2, 4, 6, 8, 10])
+
+        self.assertEqual(time_course.append_arrays([2.5, 7, 0.5], [5, 14, 1]), 1)
+        self.assertEqual(list(time_course.time_vector), [0, 0.5, 1, 2, 2.5, 3, 4, 5, 7])
+        self.assertEqual(list(time_course.data_vector), [0, 1, 2, 4, 5, 6, 8, 10, 14])
+
+    def test_many_time_points(self):
+        time_course = impact.TimeCourse()
+        times = np.random.RandomState(0).permutation(2000).astype(float)
+        self.add_time_points(time_course, times)
+        np.testing.assert_array_equal(time_course.time_vector, np.arange(2000))
+        np.testing.assert_array_equal(time_course.pd_series.values, np.arange(2000) * 2)
+
+    def test_append_after_prefit(self):
+        from impact.core.settings import settings
+        from impact.core.AnalyteData import FitParameter
+        times = np.linspace(0, 10, 11)
+        time_course = impact.Biomass.from_arrays(self.ti, times[:8], 0.1 + 2 / (1 + np.exp(5 - times[:8])))
+
+        # e.g. loaded from the database, the stored fit isn't redone by calculate
+        time_course.fit_params = {name: FitParameter(name, 1) for name in ['A', 'growth_rate', 'lag']}
+        time_course._prefit = True
+        time_course.append_arrays(times[8:], 0.1 + 2 / (1 + np.exp(5 - times[8:])))
+
+        settings.perform_curve_fit = True
+        try:
+            time_course.calculate()
+        finally:
+            settings.perform_curve_fit = False
+        self.assertFalse(time_course._prefit)
+        self.assertGreater(time_course.fit_params['A'].parameter_value, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import tempfile
+import numpy as np
+import impact
+from impact.curve_fitting import curve_fit_dict, stack_curves, FitCache, fit_cache
+
+
+class TestBatchCurveFit(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.t = np.linspace(0, 20, 40)
+        self.A = rs.uniform(0.8, 2, 24)
+        self.growth_rate = rs.uniform(0.1, 0.5, 24)
+        self.lam = rs.uniform(1, 5, 24)
+        self.data = curve_fit_dict['gompertz'].growthEquation(self.t[None, :], self.A[:, None],
+                                                              self.growth_rate[:, None], self.lam[:, None])
+        self.data += rs.normal(0, 0.005, self.data.shape)
+
+    def test_gompertz(self):
+        result = curve_fit_dict['gompertz'].calcFitBatch(self.t, self.data)
+        self.assertEqual(len(result), len(self.data))
+        self.assertTrue(np.all(result.success))
+        np.testing.assert_allclose(result.values[:, result.param_names.index('growth_rate')],
+                                   self.growth_rate, rtol=0.1)
+
+        # Matches the lmfit fit of a single curve
+        fit = curve_fit_dict['gompertz'].calcFit(self.t, self.data[0])
+        for name in fit.best_values:
+            self.assertAlmostEqual(result.best_values[0][name], fit.best_values[name], places=3)
+
+    def test_padded_curves(self):
+        t_list = [self.t, self.t[:30], self.t[:35]]
+        data_list = [self.data[0], self.data[1][:30], self.data[2][:35]]
+        t, data = stack_curves(t_list, data_list)
+        self.assertEqual(data.shape, (3, 40))
+        self.assertTrue(np.isnan(data[1, 30:]).all())
+
+        result = curve_fit_dict['gompertz'].calcFitBatch(t_list, data_list)
+        for i, (t_i, data_i) in enumerate(zip(t_list, data_list)):
+            fit = curve_fit_dict['gompertz'].calcFit(t_i, data_i)
+            self.assertAlmostEqual(result.best_values[i]['A'], fit.best_values['A'], places=3)
+
+    def test_fallback(self):
+        result = curve_fit_dict['gompertz'].calcFitBatch(self.t, self.data[:2], max_iter=1)
+        self.assertTrue(np.all(result.fallback))
+        self.assertTrue(np.all(result.success))
+
+
+class TestCurveFitMethods(unittest.TestCase):
+    def test_jacobians(self):
+        t = np.linspace(0.5, 20, 15)
+        values = {'gompertz'                           : dict(A=1.5, growth_rate=0.3, lam=3),
+                  'janoschek'                          : dict(B=0.05, k=0.01, L=1.5, delta=2),
+                  'richard_5'                          : dict(B=0.05, k=0.5, L=1.5, t_m=8, T=0.8),
+                  'growthEquation_generalized_logistic': dict(A=0.05, k=0.5, C=1.1, Q=20, K=1.5, nu=0.9),
+                  'three_param'                        : dict(A=0.05, B=1.5, mu=0.6)}
+        for fit_type, params in values.items():
+            curve_fit = curve_fit_dict[fit_type]
+            jacobian = curve_fit.jacobian_matrix(t, params)
+            for j, param in enumerate(curve_fit.paramList):
+                h = 1e-6 * max(abs(params[param['name']]), 1)
+                params_h = dict(params)
+                params_h[param['name']] += h
+                numerical = (curve_fit.growthEquation(t, **params_h) - curve_fit.growthEquation(t, **params)) / h
+                np.testing.assert_allclose(jacobian[:, j], numerical, rtol=1e-3, atol=1e-6,
+                                           err_msg='%s %s' % (fit_type, param['name']))
+
+    def test_initial_guess(self):
+        t = np.linspace(0, 20, 40)
+        data = curve_fit_dict['gompertz'].growthEquation(t, 1.5, 0.3, 3)
+        hints = {hint['name']: hint['value'] for hint in curve_fit_dict['gompertz'].get_parameter_hints(t, data)}
+        self.assertAlmostEqual(hints['A'], 1.5, places=2)
+        self.assertAlmostEqual(hints['growth_rate'], 0.3, delta=0.03)
+        self.assertAlmostEqual(hints['lam'], 3, delta=0.5)
+
+        # Guesses are kept within the bounds
+        hints = curve_fit_dict['gompertz'].get_parameter_hints(t, data * 100)
+        self.assertLessEqual(hints[1]['value'], 5)
+
+
+class TestFitCache(unittest.TestCase):
+    def setUp(self):
+        self.t = np.linspace(0, 20, 40)
+        self.data = curve_fit_dict['gompertz'].growthEquation(self.t, 1.5, 0.3, 3)
+        self.hints = curve_fit_dict['gompertz'].get_parameter_hints(self.t, self.data)
+        self.result = {'best_values': {'A': 1.5, 'growth_rate': 0.3, 'lam': 3.}, 'chisqr': 0., 'nfev': 10,
+                       'success': True}
+
+    def test_key(self):
+        key = FitCache.make_key('gompertz', 'slsqp', self.t, self.data, self.hints)
+        self.assertEqual(key, FitCache.make_key('gompertz', 'slsqp', list(self.t), list(self.data), self.hints))
+        self.assertNotEqual(key, FitCache.make_key('janoschek', 'slsqp', self.t, self.data, self.hints))
+        self.assertNotEqual(key, FitCache.make_key('gompertz', 'slsqp', self.t, self.data * 1.01, self.hints))
+
+    def test_lru(self):
+        cache = FitCache(max_size=2)
+        for key in ['a', 'b']:
+            cache.put(key, self.result)
+        cache.get('a')
+        cache.put('c', self.result)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(len(cache), 2)
+
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            FitCache(directory=directory).put('a', self.result)
+            result = FitCache(directory=directory).get('a')
+            self.assertEqual(result['best_values'], self.result['best_values'])
+            self.assertEqual(result['nfev'], 10)
+
+    def test_time_course_fit(self):
+        from impact.core.settings import settings
+
+        ti = impact.TimeCourseIdentifier()
+        ti.analyte_name = 'OD600'
+        ti.analyte_type = 'biomass'
+        fit_params = []
+        fit_cache.clear()
+        for _ in range(2):
+            biomass = impact.Biomass.from_arrays(ti, self.t, self.data)
+            biomass.curve_fit_data()
+            fit_params.append({key: param.parameter_value for key, param in biomass.fit_params.items()})
+
+        self.assertEqual(fit_cache.hits, 1)
+        self.assertEqual(fit_params[0], fit_params[1])
+
+        settings.use_fit_cache = False
+        try:
+            impact.Biomass.from_arrays(ti, self.t, self.data).curve_fit_data()
+        finally:
+            settings.use_fit_cache = True
+        self.assertEqual(fit_cache.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
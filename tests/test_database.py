@@ -1,5 +1,6 @@
 import unittest
 import impact as impt
+import numpy as np
 import os
 
 class TestDatabase(unittest.TestCase):
@@ -10,10 +11,36 @@ class TestDatabase(unittest.TestCase):
 
     def tearDown(self):
         self.session.close()
-        try:
-            os.remove('default_impt.db')
-        except FileNotFoundError:
-            pass
+        impt.database.session.remove()
+        impt.database.dispose_engines()
+        for file_name in ['default_impt.db', 'default_impt.db-wal', 'default_impt.db-shm']:
+            try:
+                os.remove(file_name)
+            except FileNotFoundError:
+                pass
+
+    def test_engine(self):
+        import threading
+        self.assertIs(impt.database.bind_engine(), impt.database.get_engine())
+        with impt.database.get_engine().connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+
+        # Each thread has its own session
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(impt.database.get_session()))
+        thread.start()
+        thread.join()
+        self.assertIs(impt.database.get_session(), impt.database.get_session())
+        self.assertIsNot(sessions[0], impt.database.get_session())
+
+    def test_import_without_database(self):
+        import subprocess
+        import sys
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.check_call([sys.executable, '-c', 'import impact'], cwd=directory,
+                                  env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(impt.__file__))))
+            self.assertEqual(os.listdir(directory), [])
 
     def test_trial_identifier(self):
         LIMS = impt.Media('LIMS')
@@ -75,6 +102,20 @@ class TestDatabase(unittest.TestCase):
         self.assertCountEqual(tc.data_vector,[0,5,10])
         self.assertCountEqual(tc.time_vector,[0,1,2])
 
+    def test_append_persisted_time_course(self):
+        ti = impt.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|rep:1')
+        ti.analyte_type = 'biomass'
+        ti.analyte_name = 'OD600'
+        tc = impt.Biomass.from_arrays(ti, np.arange(3.), np.arange(3.) * 5)
+        self.session.add(tc)
+        self.session.commit()
+        self.assertEqual(self.session.query(impt.TimePoint).count(), 3)
+
+        tc.append_arrays([3, 4], [15, 20])
+        self.session.commit()
+        self.assertEqual(sorted(row.time for row in self.session.query(impt.TimePoint.time)), [0, 1, 2, 3, 4])
+
     def test_single_trial(self):
         LIMS = impt.Media('LIMS')
         components = [impt.ComponentConcentration(impt.MediaComponent(name), concentration, unit)
@@ -124,6 +165,82 @@ class TestDatabase(unittest.TestCase):
                 ][0]
         self.assertCountEqual(tc.data_vector,[0,5,10])
         self.assertCountEqual(tc.time_vector,[0,1,2])
+    def test_single_trial_analyte_dict(self):
+        from test_experiment import generate_experiment
+        expt = generate_experiment(strains=('A',), replicates=1)
+        self.session.add(expt)
+        self.session.commit()
+        expt_id = expt.id
+        del expt
+
+        # The analyte_dict of the stored single trials is keyed by the analyte names
+        session = impt.database.create_session()
+        single_trial = session.query(impt.Experiment).get(expt_id).replicate_trials[0].single_trials[0]
+        self.assertEqual(sorted(single_trial.analyte_dict), ['OD600', 'glucose'])
+        self.assertIsInstance(single_trial.analyte_dict['OD600'], impt.Biomass)
+        self.assertEqual(single_trial.analyte_dict['OD600'].analyte_type, 'biomass')
+        session.close()
+
+    def test_bulk_save_experiment(self):
+        from test_experiment import generate_experiment
+        expt = generate_experiment(strains=('A', 'B'), replicates=2)
+        time_course = expt.replicate_trials[0].single_trials[0].analyte_dict['OD600']
+        time_course.fit_params = {'growth_rate': impt.core.AnalyteData.FitParameter('growth_rate', 0.5)}
+        time_courses = [time_course for replicate in expt.replicate_trials
+                        for time_course in replicate.get_time_courses()]
+
+        impt.database.bulk_save_experiment(expt, self.session, batch_size=7, transaction_size=20)
+
+        self.assertEqual(self.session.query(impt.TimePoint).count(),
+                         sum(len(time_course.time_vector) for time_course in time_courses))
+        self.assertEqual(self.session.query(impt.Strain).count(), 2)
+        fit_param = self.session.query(impt.core.AnalyteData.FitParameter).one()
+        self.assertEqual((fit_param.parent_id, fit_param.parameter_value), (time_course.id, 0.5))
+
+        rows = self.session.query(impt.TimePoint.time, impt.TimePoint.data) \
+            .filter(impt.TimePoint.parent_id == time_course.id).order_by(impt.TimePoint.time).all()
+        self.assertEqual([row.time for row in rows], list(time_course.time_vector))
+        self.assertEqual([row.data for row in rows], list(time_course.data_vector))
+
+    def test_load_experiment(self):
+        from test_experiment import generate_experiment
+        for save in ['bulk', 'session']:
+            expt = generate_experiment(strains=('A', 'B'), replicates=2)
+            expt.replicate_trials[0].trial_identifier.media.add_component('glc', 10., 'g/L')
+            fit_time_course = expt.replicate_trials[0].single_trials[0].analyte_dict['OD600']
+            fit_time_course.fit_params = {'growth_rate': impt.core.AnalyteData.FitParameter('growth_rate', 0.5)}
+            if save == 'bulk':
+                impt.database.bulk_save_experiment(expt, self.session)
+            else:
+                self.session.add(expt)
+                self.session.commit()
+
+            session = impt.database.create_session()
+            loaded = impt.database.load_experiment(expt.id, session=session)
+            self.assertEqual(sorted(loaded.replicate_trial_dict),
+                             sorted(replicate.unique_id for replicate in expt.replicate_trials))
+            for replicate in expt.replicate_trials:
+                for replicate_id, single_trial in replicate.single_trial_dict.items():
+                    loaded_single_trial = loaded.replicate_trial_dict[replicate.unique_id] \
+                        .single_trial_dict[replicate_id]
+                    self.assertEqual(sorted(loaded_single_trial.analyte_dict), ['OD600', 'glucose'])
+                    for analyte, time_course in single_trial.analyte_dict.items():
+                        loaded_time_course = loaded_single_trial.analyte_dict[analyte]
+                        self.assertIs(type(loaded_time_course), type(time_course))
+                        np.testing.assert_array_equal(loaded_time_course.time_vector, time_course.time_vector)
+                        np.testing.assert_array_equal(loaded_time_course.data_vector, time_course.data_vector)
+
+            trial_identifier = fit_time_course.trial_identifier
+            loaded_time_course = loaded.replicate_trial_dict[trial_identifier.unique_replicate_trial()] \
+                .single_trial_dict[str(trial_identifier.replicate_id)].analyte_dict['OD600']
+            self.assertEqual(loaded_time_course.fit_params['growth_rate'].parameter_value, 0.5)
+
+            # Only the selected strains and analytes are loaded
+            loaded = impt.database.load_experiment(expt.id, analytes=['glucose'], strains=['B'], session=session)
+            self.assertEqual([replicate.trial_identifier.strain.name for replicate in loaded.replicate_trials], ['B'])
+            self.assertEqual(loaded.analyte_names, ['glucose'])
+            session.close()
+
 
 if __name__ == 'main':
     unittest.main()
\ No newline at end of file
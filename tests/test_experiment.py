@@ -1,7 +1,294 @@
 import unittest
 import impact as impt
+import impact.parsers
+import numpy as np
 import os
 
 class TestDatabase(unittest.TestCase):
     def test_add_experiment(self):
-        pass
\ No newline at end of file
+        pass
+
+
+def generate_time_point_arrays(strains=('A', 'B', 'C'), replicates=3,
+                               analytes=(('OD600', 'biomass'), ('glucose', 'substrate'))):
+    trial_identifiers = []
+    for strain in strains:
+        for rep in range(1, replicates + 1):
+            for analyte_name, analyte_type in analytes:
+                ti = impt.TimeCourseIdentifier()
+                ti.parse_identifier('strain:%s|rep:%i' % (strain, rep))
+                ti.analyte_name = analyte_name
+                ti.analyte_type = analyte_type
+                trial_identifiers.append(ti)
+
+    times = np.linspace(0, 10, 11)
+    identifier_index = np.repeat(np.arange(len(trial_identifiers)), len(times))
+    values = np.random.RandomState(0).rand(len(identifier_index)) * 0.1 \
+             + np.tile(0.1 + 2 / (1 + np.exp(5 - times)), len(trial_identifiers))
+    return trial_identifiers, identifier_index, np.tile(times, len(trial_identifiers)), values
+
+
+def generate_experiment(*args, **kwargs):
+    expt = impt.Experiment()
+    for replicate in impact.parsers.parse_time_point_arrays(*generate_time_point_arrays(*args, **kwargs)):
+        expt.add_replicate_trial(replicate)
+    return expt
+
+
+class TestExperiment(unittest.TestCase):
+    def test_calculate_parallel(self):
+        experiments = []
+        for workers in [1, 2]:
+            expt = generate_experiment(strains=('A', 'B', 'blank'))
+            blank_key = [key for key in expt.replicate_trial_dict if 'blank' in key][0]
+            expt.blank_key_list = [blank_key]
+            for replicate_key, replicate in expt.replicate_trial_dict.items():
+                if replicate_key != blank_key:
+                    replicate.set_blank(expt.replicate_trial_dict[blank_key])
+            expt.calculate(workers=workers)
+            experiments.append(expt)
+        serial, parallel = experiments
+
+        # Recalculating in parallel doesn't subtract the blank again
+        parallel.calculate(workers=2, recalculate_all=True)
+
+        for replicate_key, replicate in serial.replicate_trial_dict.items():
+            parallel_replicate = parallel.replicate_trial_dict[replicate_key]
+            for analyte in ['OD600', 'glucose']:
+                for replicate_id, single_trial in replicate.single_trial_dict.items():
+                    np.testing.assert_allclose(single_trial.analyte_dict[analyte].data_vector,
+                                               parallel_replicate.single_trial_dict[replicate_id]
+                                               .analyte_dict[analyte].data_vector)
+                np.testing.assert_allclose(replicate.avg.analyte_dict[analyte].gradient,
+                                           parallel_replicate.avg.analyte_dict[analyte].gradient)
+                np.testing.assert_allclose(replicate.std.analyte_dict[analyte].data_vector,
+                                           parallel_replicate.std.analyte_dict[analyte].data_vector)
+
+                time_course = parallel_replicate.single_trial_dict['1'].analyte_dict[analyte]
+                self.assertEqual(len(time_course._gradient), 11)
+                np.testing.assert_allclose(time_course._gradient,
+                                           np.gradient(time_course.data_vector) / np.gradient(time_course.time_vector))
+
+    def test_calculate_blank_subtraction(self):
+        times = np.linspace(0, 10, 11)
+        # Grows, then dies from t = 7
+        curve = 0.1 + 2 / (1 + np.exp(5 - times)) - np.where(times > 7, (times - 7) * 0.5, 0)
+        for workers in [1, 2]:
+            expt = generate_experiment(strains=('A', 'blank'), analytes=[('OD600', 'biomass')])
+            blank_key, key = sorted(expt.replicate_trial_dict, key=lambda key: 'A' in key)
+            for single_trial in expt.replicate_trial_dict[blank_key].single_trials:
+                single_trial.analyte_dict['OD600'].data_vector = np.full(11, 0.05)
+            for single_trial in expt.replicate_trial_dict[key].single_trials:
+                single_trial.analyte_dict['OD600'].data_vector = curve
+                single_trial.analyte_dict['OD600'].remove_death_phase_flag = True
+            expt.blank_key_list = [blank_key]
+            expt.replicate_trial_dict[key].set_blank(expt.replicate_trial_dict[blank_key])
+            expt.calculate(workers=workers)
+
+            # The analytes are calculated from the blank subtracted data
+            for single_trial in expt.replicate_trial_dict[key].single_trials:
+                time_course = single_trial.analyte_dict['OD600']
+                np.testing.assert_allclose(time_course.data_vector, curve - 0.05)
+                self.assertTrue(time_course.calculations_uptodate)
+                self.assertEqual(time_course.death_phase_start, 7)
+                self.assertEqual(len(time_course._gradient), 11)
+                np.testing.assert_allclose(time_course._gradient, np.gradient(curve) / np.gradient(times))
+
+            # Recalculating doesn't subtract the blank again
+            expt.replicate_trial_dict[key].single_trials[0].analyte_dict['OD600'].invalidate_calculations()
+            expt.replicate_trial_dict[blank_key].single_trials[0].analyte_dict['OD600'].invalidate_calculations()
+            expt.calculate(workers=workers)
+            expt.calculate(workers=workers, recalculate_all=True)
+            for single_trial in expt.replicate_trial_dict[key].single_trials:
+                np.testing.assert_allclose(single_trial.analyte_dict['OD600'].data_vector, curve - 0.05)
+            np.testing.assert_allclose(expt.replicate_trial_dict[key].avg.analyte_dict['OD600'].data_vector,
+                                       curve - 0.05)
+
+    def test_append_blank_subtraction(self):
+        analytes = [('OD600', 'biomass')]
+        trial_identifiers, identifier_index, times, values = generate_time_point_arrays(strains=('A', 'blank'),
+                                                                                        analytes=analytes)
+        full = generate_experiment(strains=('A', 'blank'), analytes=analytes)
+        full.calculate()
+        blank_key, key = sorted(full.replicate_trial_dict, key=lambda key: 'A' in key)
+        blank = full.replicate_trial_dict[blank_key].avg.analyte_dict['OD600'].data_vector
+        is_blank = np.array(['blank' in trial_identifier.unique_replicate_trial()
+                             for trial_identifier in trial_identifiers])[identifier_index]
+
+        expt = impt.Experiment()
+        for replicate in impact.parsers.parse_time_point_arrays(trial_identifiers, identifier_index[times < 4],
+                                                                times[times < 4], values[times < 4]):
+            expt.add_replicate_trial(replicate)
+        expt.blank_key_list = [blank_key]
+        expt.replicate_trial_dict[key].set_blank(expt.replicate_trial_dict[blank_key])
+        expt.calculate()
+
+        # The sample gets the reads at 6 and 7 before the blank, they are subtracted once the blank has them
+        for batch in [(times >= 4) & (times < 6), (times >= 6) & (times < 8) & ~is_blank,
+                      ((times >= 6) & (times < 8) & is_blank) | (times >= 8)]:
+            expt.append_time_point_arrays(trial_identifiers, identifier_index[batch], times[batch], values[batch])
+            expt.calculate()
+            expt.calculate(recalculate_all=True)
+
+            for replicate_id, single_trial in expt.replicate_trial_dict[key].single_trial_dict.items():
+                time_course = single_trial.analyte_dict['OD600']
+                raw = full.replicate_trial_dict[key].single_trial_dict[replicate_id].analyte_dict['OD600'] \
+                    .data_vector[:len(time_course.time_vector)]
+                subtracted = np.arange(len(raw)) < len(expt.replicate_trial_dict[blank_key].avg.analyte_dict['OD600']
+                                                       .time_vector)
+                np.testing.assert_allclose(time_course.data_vector[subtracted], (raw - blank[:len(raw)])[subtracted])
+                np.testing.assert_allclose(time_course.data_vector[~subtracted], raw[~subtracted])
+        self.assertEqual(len(time_course.time_vector), 11)
+
+    def test_batch_curve_fit(self):
+        from impact.core.settings import settings
+        settings.perform_curve_fit = True
+        try:
+            serial = generate_experiment(replicates=1, analytes=[('OD600', 'biomass')])
+            serial.calculate()
+            settings.batch_curve_fit = True
+            batch = generate_experiment(replicates=1, analytes=[('OD600', 'biomass')])
+            batch.calculate()
+        finally:
+            settings.perform_curve_fit = False
+            settings.batch_curve_fit = False
+
+        for replicate_key, replicate in serial.replicate_trial_dict.items():
+            fit_params = replicate.single_trial_dict['1'].analyte_dict['OD600'].fit_params
+            batch_fit_params = batch.replicate_trial_dict[replicate_key].single_trial_dict['1'] \
+                .analyte_dict['OD600'].fit_params
+            self.assertEqual(set(fit_params), set(batch_fit_params))
+            for name in fit_params:
+                self.assertAlmostEqual(fit_params[name].parameter_value,
+                                       batch_fit_params[name].parameter_value, places=2)
+
+    def test_incremental_calculate(self):
+        expt = generate_experiment()
+        expt.calculate()
+        self.assertTrue(expt.calculations_uptodate)
+        self.assertTrue(all(replicate.calculations_uptodate for replicate in expt.replicate_trials))
+
+        # Only the changed time course and its ancestors are marked
+        replicate = expt.replicate_trial_dict[[key for key in expt.replicate_trial_dict if 'A' in key][0]]
+        single_trial = replicate.single_trial_dict['1']
+        time_course = single_trial.analyte_dict['OD600']
+        for analyte_name in ['OD600', 'glucose']:
+            time_point = impt.TimePoint()
+            time_point.trial_identifier = single_trial.analyte_dict[analyte_name].trial_identifier
+            time_point.time, time_point.data = 11, 2.5
+            single_trial.analyte_dict[analyte_name].add_timepoint(time_point)
+
+        self.assertFalse(time_course.calculations_uptodate)
+        self.assertTrue(replicate.single_trial_dict['2'].analyte_dict['OD600'].calculations_uptodate)
+        self.assertFalse(single_trial.calculations_uptodate)
+        self.assertTrue(replicate.single_trial_dict['2'].calculations_uptodate)
+        self.assertFalse(replicate.calculations_uptodate)
+        self.assertFalse(expt.calculations_uptodate)
+        self.assertEqual(sum(not rep.calculations_uptodate for rep in expt.replicate_trials), 1)
+
+        # Only the changed replicate trial is recalculated
+        other_replicate = [rep for rep in expt.replicate_trials if rep is not replicate][0]
+        other_avg = other_replicate.avg.analyte_dict['OD600']
+        expt.calculate()
+        self.assertIs(other_replicate.avg.analyte_dict['OD600'], other_avg)
+        self.assertTrue(replicate.calculations_uptodate)
+        self.assertEqual(len(time_course.gradient), 12)
+        self.assertEqual(len(replicate.avg.analyte_dict['OD600'].data_vector), 12)
+
+        fresh = generate_experiment()
+        fresh.calculate()
+        fresh_replicate = fresh.replicate_trial_dict[[key for key in fresh.replicate_trial_dict if 'A' in key][0]]
+        np.testing.assert_allclose(replicate.avg.analyte_dict['OD600'].data_vector[:11],
+                                   fresh_replicate.avg.analyte_dict['OD600'].data_vector)
+
+    def test_recalculate_all(self):
+        expt = generate_experiment(strains=('A',))
+        expt.calculate()
+        single_trial = expt.replicate_trials[0].single_trial_dict['1']
+        gradient = single_trial.analyte_dict['OD600'].gradient
+
+        single_trial.analyte_dict['OD600'].data_vector = single_trial.analyte_dict['OD600'].data_vector * 2
+        self.assertFalse(expt.replicate_trials[0].calculations_uptodate)
+        expt.calculate()
+        np.testing.assert_allclose(single_trial.analyte_dict['OD600'].gradient, gradient * 2)
+
+        expt.calculate(recalculate_all=True)
+        self.assertTrue(all(time_course.calculations_uptodate
+                            for time_course in expt.replicate_trials[0].get_time_courses()))
+
+    def test_append_time_point_arrays(self):
+        analytes = (('OD600', 'biomass'), ('glucose', 'substrate'), ('ethanol', 'product'))
+        trial_identifiers, identifier_index, times, values = generate_time_point_arrays(analytes=analytes)
+        full = generate_experiment(analytes=analytes)
+        full.calculate()
+
+        # Start with the first reads, and add the others in two batches, the second out of order
+        streamed = impt.Experiment()
+        for replicate in impact.parsers.parse_time_point_arrays(trial_identifiers, identifier_index[times < 5],
+                                                                times[times < 5], values[times < 5]):
+            streamed.add_replicate_trial(replicate)
+        streamed.calculate()
+        for batch in [(times >= 5) & (times < 8), times == 10, (times >= 8) & (times < 10)]:
+            streamed.append_time_point_arrays(trial_identifiers, identifier_index[batch], times[batch],
+                                              values[batch])
+        self.assertFalse(streamed.calculations_uptodate)
+
+        for replicate_key, replicate in full.replicate_trial_dict.items():
+            streamed_replicate = streamed.replicate_trial_dict[replicate_key]
+            for analyte in ['OD600', 'glucose', 'ethanol']:
+                for replicate_id, single_trial in replicate.single_trial_dict.items():
+                    time_course = single_trial.analyte_dict[analyte]
+                    streamed_time_course = streamed_replicate.single_trial_dict[replicate_id].analyte_dict[analyte]
+                    np.testing.assert_allclose(streamed_time_course.data_vector, time_course.data_vector)
+                    np.testing.assert_allclose(streamed_time_course.gradient, time_course.gradient)
+                    np.testing.assert_allclose(streamed_time_course.specific_productivity.data,
+                                               time_course.specific_productivity.data)
+                    if analyte != 'glucose':
+                        np.testing.assert_allclose(streamed_time_course.product_yield.data,
+                                                   time_course.product_yield.data)
+
+                for stat in ['avg', 'std']:
+                    time_course = getattr(replicate, stat).analyte_dict[analyte]
+                    streamed_time_course = getattr(streamed_replicate, stat).analyte_dict[analyte]
+                    np.testing.assert_allclose(streamed_time_course.data_vector, time_course.data_vector)
+                    np.testing.assert_allclose(streamed_time_course.specific_productivity,
+                                               time_course.specific_productivity)
+
+    def test_append_without_replicate_id(self):
+        trial_identifiers, identifier_index, times, values = generate_time_point_arrays(replicates=1)
+        for trial_identifier in trial_identifiers:
+            trial_identifier.replicate_id = None
+        expt = impt.Experiment()
+        for replicate in impact.parsers.parse_time_point_arrays(trial_identifiers, identifier_index[times < 5],
+                                                                times[times < 5], values[times < 5]):
+            expt.add_replicate_trial(replicate)
+
+        # The measurements are added to the single trials keyed by '1'
+        expt.append_time_point_arrays(trial_identifiers, identifier_index[times >= 5], times[times >= 5],
+                                      values[times >= 5])
+        for replicate in expt.replicate_trials:
+            self.assertEqual(list(replicate.single_trial_dict), ['1'])
+            self.assertEqual(len(replicate.single_trial_dict['1'].analyte_dict['OD600'].time_vector), 11)
+
+    def test_append_new_time_courses(self):
+        trial_identifiers, identifier_index, times, values = generate_time_point_arrays()
+        expt = impt.Experiment()
+        # Strain C and the second analyte of the other strains are added later
+        first = (identifier_index < 12) & (identifier_index % 2 == 0)
+        for replicate in impact.parsers.parse_time_point_arrays(trial_identifiers, identifier_index[first],
+                                                                times[first], values[first]):
+            expt.add_replicate_trial(replicate)
+        expt.calculate()
+        expt.append_time_point_arrays(trial_identifiers, identifier_index[~first], times[~first], values[~first])
+
+        full = generate_experiment()
+        full.calculate()
+        self.assertEqual(set(expt.replicate_trial_dict), set(full.replicate_trial_dict))
+        for replicate_key, replicate in full.replicate_trial_dict.items():
+            for analyte in ['OD600', 'glucose']:
+                np.testing.assert_allclose(expt.replicate_trial_dict[replicate_key].avg.analyte_dict[analyte]
+                                           .data_vector, replicate.avg.analyte_dict[analyte].data_vector)
+
+
+if __name__ == '__main__':
+    unittest.main()
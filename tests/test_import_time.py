@@ -0,0 +1,37 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+
+# Seconds allowed for import impact, in a fresh interpreter
+import_time_budget = 2.
+
+script = """
+import json, sys, time
+t0 = time.time()
+import impact
+print(json.dumps({'time': time.time() - t0, 'modules': list(sys.modules)}))
+"""
+
+
+class TestImportTime(unittest.TestCase):
+    def import_impact(self):
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=dict(os.environ, PYTHONPATH=root), universal_newlines=True)
+        return json.loads(output.splitlines()[-1])
+
+    def test_heavy_modules_not_imported(self):
+        modules = self.import_impact()['modules']
+        for module in ['matplotlib', 'lmfit', 'openpyxl', 'plotly', 'scipy.signal', 'scipy.stats']:
+            self.assertNotIn(module, modules)
+
+    def test_import_time(self):
+        # Best of three, to ignore a cold disk cache
+        import_time = min(self.import_impact()['time'] for _ in range(3))
+        self.assertLess(import_time, import_time_budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import numpy as np
+import impact
+from impact.core.outliers import leave_one_out_statistics, find_outlier_replicates, outlier_methods
+from impact.core.settings import settings
+
+
+class TestOutliers(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        t = np.linspace(0, 10, 50)
+        curve = 0.05 + 1 / (1 + np.exp(-(t - 5)))
+        self.matrix = np.column_stack([curve * (1 + 0.01 * np.random.randn(len(t))) for _ in range(5)])
+        # The fourth replicate is twice as high as the others
+        self.matrix[:, 3] *= 2
+
+    def test_leave_one_out_statistics(self):
+        matrix = self.matrix.copy()
+        matrix[[2, 7], [0, 4]] = np.nan
+        mean, std = leave_one_out_statistics(matrix)
+        for j in range(matrix.shape[1]):
+            others = np.delete(matrix, j, axis=1)
+            np.testing.assert_allclose(mean[:, j], np.nanmean(others, axis=1))
+            np.testing.assert_allclose(std[:, j], np.nanstd(others, axis=1, ddof=1))
+
+    def test_methods_find_outlier(self):
+        for method in outlier_methods:
+            self.assertEqual(find_outlier_replicates(self.matrix, method=method), [3], method)
+
+    def test_no_outliers(self):
+        self.matrix[:, 3] /= 2
+        for method in ['z_score', 'mad', 'grubbs']:
+            self.assertEqual(find_outlier_replicates(self.matrix, method=method), [], method)
+
+    def test_max_fraction_replicates_to_remove(self):
+        self.assertEqual(find_outlier_replicates(self.matrix, max_fraction_replicates_to_remove=0), [])
+        # At least one replicate can be removed
+        self.assertEqual(find_outlier_replicates(self.matrix, max_fraction_replicates_to_remove=0.1), [3])
+        # At least two replicates are always kept
+        self.assertEqual(len(find_outlier_replicates(self.matrix[:, :3], max_fraction_replicates_to_remove=1)), 1)
+
+    def test_triplicate(self):
+        # One outlier is removed from triplicates with the default fraction
+        matrix = self.matrix[:, [0, 3, 4]]
+        for method in ['iterative_removal', 'z_score']:
+            self.assertEqual(find_outlier_replicates(matrix, method=method), [1], method)
+        self.assertEqual(find_outlier_replicates(self.matrix[:, :4], method='iterative_removal'), [3])
+        self.assertEqual(find_outlier_replicates(self.matrix[:, [0, 4]]), [])
+
+    def test_unknown_method(self):
+        with self.assertRaises(Exception):
+            find_outlier_replicates(self.matrix, method='not_a_method')
+
+    def test_prune_bad_replicates(self):
+        replicate = impact.ReplicateTrial()
+        t = np.linspace(0, 10, 50)
+        for replicate_id in range(5):
+            ti = impact.TimeCourseIdentifier()
+            ti.parse_identifier('strain:MG|rep:%i' % (replicate_id + 1))
+            ti.analyte_name = 'OD600'
+            ti.analyte_type = 'biomass'
+            single_trial = impact.SingleTrial()
+            single_trial.add_analyte_data(impact.Biomass.from_arrays(ti, t, self.matrix[:, replicate_id]))
+            replicate.add_replicate(single_trial)
+
+        outlier_cleaning_flag = settings.outlier_cleaning_flag
+        settings.outlier_cleaning_flag = True
+        try:
+            replicate.calculate_statistics()
+        finally:
+            settings.outlier_cleaning_flag = outlier_cleaning_flag
+
+        self.assertEqual(replicate.bad_replicates, ['4'])
+        np.testing.assert_allclose(replicate.avg.analyte_dict['OD600'].data_vector,
+                                   np.mean(np.delete(self.matrix, 3, axis=1), axis=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
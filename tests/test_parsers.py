@@ -1,8 +1,28 @@
 import unittest
 import impact
+import impact.parsers
 import os
+import numpy as np
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
+
+def generate_spectromax_data(times=('0:00:00', '0:30:00', '1:00:00'), identifiers=None):
+    """
+    Generate a Spectromax OD workbook as parsed from xlsx, with two replicates of two strains in the first row
+    """
+    if identifiers is None:
+        identifiers = [['strain:A|rep:1', 'strain:A|rep:2', 'strain:B|rep:1', 'strain:B|rep:2'] + [None] * 8] \
+                      + [[None] * 12 for _ in range(7)]
+
+    raw_data = [[None] * 14 for _ in range(3)]
+    for i, time in enumerate(times):
+        for row in range(8):
+            raw_data.append([time if row == 0 else None, None]
+                            + [0.1 * (i + 1) + 0.01 * col for col in range(12)])
+        raw_data.append([None] * 14)
+    raw_data.append(['~End'] + [None] * 13)
+    return {'data': raw_data, 'identifiers': identifiers}
+
 class TestParsers(unittest.TestCase):
     def test_generic_identifier_parser(self):
         ti = impact.ReplicateTrialIdentifier()
@@ -65,5 +85,398 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(num_analyte_data,252)
         self.assertEqual(num_time_points,2884)
 
+    def test_HPLC_parser_ragged_rows(self):
+        # Rows streamed from a workbook end at their last cell with a value
+        rows = [(None, 'glucose', 'ethanol'), (None, 'substrate', 'product'),
+                ('strain:A|rep:1|time:0', 10, 0), ('strain:A|rep:1|time:1', 8), ('strain:A|rep:1|time:2', 6, 2)]
+        expt = impact.Experiment()
+        impact.parsers.HPLC_titer_parser(expt, {'titers': iter(rows)}, id_type='traverse')
+
+        analyte_dict = expt.replicate_trials[0].single_trial_dict['1'].analyte_dict
+        np.testing.assert_array_equal(analyte_dict['glucose'].data_vector, [10, 8, 6])
+        np.testing.assert_array_equal(analyte_dict['ethanol'].data_vector, [0, np.nan, 2])
+
+    def test_spectromax_OD_parser(self):
+        expt = impact.Experiment()
+        impact.parsers.SpectromaxOD.parse_data(expt, generate_spectromax_data(), id_type='traverse')
+
+        self.assertEqual(len(expt.replicate_trial_dict), 2)
+        time_courses = [single_trial.analyte_dict['OD600']
+                        for replicate in expt.replicate_trial_dict.values()
+                        for single_trial in replicate.single_trial_dict.values()]
+        self.assertEqual(len(time_courses), 4)
+        for time_course in time_courses:
+            self.assertIsInstance(time_course, impact.Biomass)
+            self.assertCountEqual(time_course.time_vector, [0, 0.5, 1])
+            # TimePoint objects are only created when persisted
+            self.assertEqual(len(time_course.time_points), 0)
+
+    def test_spectromax_OD_triplicate_parser(self):
+        data = generate_spectromax_data()
+        # Three replicate plates side by side, the third is missing data
+        data['data'] = [row[:14] + [None] + row[2:14] + [None] + [None] * 12 for row in data['data']]
+
+        expt = impact.Experiment()
+        impact.parsers.spectromax_OD_triplicate(expt, data, id_type='traverse')
+        time_courses = [single_trial.analyte_dict['OD600']
+                        for replicate in expt.replicate_trial_dict.values()
+                        for single_trial in replicate.single_trial_dict.values()]
+        self.assertEqual(len(time_courses), 4)
+        for time_course in time_courses:
+            self.assertCountEqual(time_course.time_vector, [0, 0.5, 1])
+            # The missing plate is left out of the average
+            self.assertGreaterEqual(min(time_course.data_vector), 0.1)
+
+    def test_streaming_xlsx_import(self):
+        import tempfile
+        from openpyxl import Workbook
+
+        data = generate_spectromax_data()
+        workbook = Workbook()
+        workbook.active.title = 'unused'
+        workbook.active.append(['not read'])
+        for sheet_name in ['identifiers', 'data']:
+            sheet = workbook.create_sheet(sheet_name)
+            for row in data[sheet_name]:
+                sheet.append(row)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'spectromax.xlsx')
+            workbook.save(file_name)
+
+            xlsx, sheets = impact.parsers.read_workbook(file_name, ['identifiers', 'data', 'OD'])
+            self.assertCountEqual(sheets.keys(), ['identifiers', 'data'])
+            xlsx.close()
+            self.assertEqual(impact.parsers.detect_format(file_name), 'spectromax_OD')
+
+            for read_only in [True, False]:
+                expt = impact.parsers.parse_raw_data('spectromax_OD', id_type='traverse', file_name=file_name,
+                                                     read_only=read_only)
+                self.assertEqual(len(expt.replicate_trial_dict), 2)
+
+                expt = impact.parsers.SpectromaxOD.parse_raw_data(id_type='traverse', file_name=file_name,
+                                                                  read_only=read_only)
+                for replicate in expt.replicate_trial_dict.values():
+                    for single_trial in replicate.single_trial_dict.values():
+                        self.assertCountEqual(single_trial.analyte_dict['OD600'].time_vector, [0, 0.5, 1])
+
+    def test_tecan_OD_parser(self):
+        data = {'OD': [[None, 0, 1800, 3600, None],
+                       ['strain:A|rep:1', 0.1, 0.2, 0.3, None],
+                       ['strain:A|rep:2', 0.1, None, 0.4, None],
+                       [None, None, None, None, None]]}
+        expt = impact.Experiment()
+        impact.parsers.tecan_OD(expt, data, id_type='traverse')
+        time_courses = {single_trial.trial_identifier.replicate_id: single_trial.analyte_dict['OD600']
+                        for replicate in expt.replicate_trial_dict.values()
+                        for single_trial in replicate.single_trial_dict.values()}
+        self.assertEqual(len(time_courses), 2)
+        self.assertEqual(list(time_courses[1].time_vector), [0, 0.5, 1])
+        self.assertEqual(list(time_courses[2].time_vector), [0, 1])
+
+    def test_text_parsers(self):
+        import csv
+        import tempfile
+
+        def write_text(file_name, rows, delimiter):
+            with open(file_name, 'w', newline='') as f:
+                csv.writer(f, delimiter=delimiter).writerows([['' if elem is None else elem for elem in row]
+                                                              for row in rows])
+
+        def get_time_courses(expt):
+            return {(replicate.trial_identifier.strain.name, single_trial.trial_identifier.replicate_id):
+                        single_trial.analyte_dict['OD600']
+                    for replicate in expt.replicate_trial_dict.values()
+                    for single_trial in replicate.single_trial_dict.values()}
+
+        data = generate_spectromax_data()
+        expected = impact.Experiment()
+        impact.parsers.spectromax_OD(expected, generate_spectromax_data(), id_type='traverse')
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_text(os.path.join(directory, 'identifiers.tsv'), data['identifiers'], '\t')
+            write_text(os.path.join(directory, 'data.csv'), data['data'], ',')
+            self.assertEqual(impact.parsers.detect_format(directory), 'spectromax_OD_text')
+            expt = impact.parsers.parse_raw_data(id_type='traverse', file_name=directory)
+
+            self.assertEqual(get_time_courses(expt).keys(), get_time_courses(expected).keys())
+            for key, time_course in get_time_courses(expected).items():
+                self.assertEqual(list(get_time_courses(expt)[key].time_vector), list(time_course.time_vector))
+                self.assertTrue(np.allclose(get_time_courses(expt)[key].data_vector, time_course.data_vector))
+
+            # Three replicate plates side by side, the third is missing data
+            data['data'] = [row[:14] + [None] + row[2:14] for row in data['data']]
+            write_text(os.path.join(directory, 'data.csv'), data['data'], ',')
+            self.assertEqual(impact.parsers.detect_format(directory), 'spectromax_OD_triplicate_text')
+            expt = impact.parsers.parse_raw_data('spectromax_OD_triplicate_text', id_type='traverse',
+                                                 file_name=directory)
+            for key, time_course in get_time_courses(expected).items():
+                self.assertTrue(np.allclose(get_time_courses(expt)[key].data_vector, time_course.data_vector))
+
+            tecan_file_name = os.path.join(directory, 'OD.csv')
+            write_text(tecan_file_name, [[None, 0, 1800, 3600],
+                                         ['strain:A|rep:1', 0.1, 0.2, 0.3],
+                                         ['strain:A|rep:2', 0.1, None, 0.4, 0.5]], ',')
+            self.assertEqual(impact.parsers.detect_format(tecan_file_name), 'tecan_OD_text')
+            time_courses = get_time_courses(impact.parsers.parse_raw_data('tecan_OD_text', id_type='traverse',
+                                                                          file_name=tecan_file_name))
+            self.assertEqual(list(time_courses[('A', 1)].time_vector), [0, 0.5, 1])
+            self.assertEqual(list(time_courses[('A', 2)].data_vector), [0.1, 0.4])
+
+    def test_default_titers_text_parser(self):
+        import csv
+        import tempfile
+        from openpyxl import load_workbook
+
+        def get_time_courses(expt):
+            return {(replicate_key, single_trial_key, analyte_name): time_course
+                    for replicate_key, replicate in expt.replicate_trial_dict.items()
+                    for single_trial_key, single_trial in replicate.single_trial_dict.items()
+                    for analyte_name, time_course in single_trial.analyte_dict.items()}
+
+        file_name = os.path.join(BASE_DIR, 'tests/test_data/sample_input_data.xlsx')
+        expected = get_time_courses(impact.parsers.parse_raw_data('default_titers', file_name=file_name))
+
+        with tempfile.TemporaryDirectory() as directory:
+            text_file_name = os.path.join(directory, 'titers.csv')
+            workbook = load_workbook(file_name, read_only=True, data_only=True)
+            with open(text_file_name, 'w', newline='') as f:
+                csv.writer(f).writerows([['' if elem is None else elem for elem in row]
+                                         for row in workbook['titers'].iter_rows(values_only=True)])
+            workbook.close()
+            self.assertEqual(impact.parsers.detect_format(file_name), 'default_titers')
+            self.assertEqual(impact.parsers.detect_format(text_file_name), 'default_titers_text')
+            time_courses = get_time_courses(impact.parsers.parse_raw_data('default_titers_text',
+                                                                          file_name=text_file_name))
+
+        self.assertEqual(time_courses.keys(), expected.keys())
+        for key, time_course in expected.items():
+            self.assertTrue(np.allclose(time_courses[key].time_vector, time_course.time_vector))
+            self.assertTrue(np.allclose(time_courses[key].data_vector, time_course.data_vector, equal_nan=True))
+
+    def test_titer_file_tail(self):
+        import csv
+        import io
+        import tempfile
+        from openpyxl import load_workbook
+
+        file_name = os.path.join(BASE_DIR, 'tests/test_data/sample_input_data.xlsx')
+        expected = impact.parsers.parse_raw_data('default_titers', file_name=file_name)
+        workbook = load_workbook(file_name, read_only=True, data_only=True)
+        rows = [['' if elem is None else elem for elem in row]
+                for row in workbook['titers'].iter_rows(values_only=True)]
+        workbook.close()
+
+        middle = len(rows) // 2
+        line = io.StringIO()
+        csv.writer(line).writerow(rows[middle])
+        line = line.getvalue()
+
+        expt = impact.Experiment()
+        with tempfile.TemporaryDirectory() as directory:
+            text_file_name = os.path.join(directory, 'titers.csv')
+            tail = impact.parsers.TiterFileTail(text_file_name)
+
+            # The instrument writes the header and some rows, with the last line partially written
+            with open(text_file_name, 'w', newline='') as f:
+                csv.writer(f).writerows(rows[:middle])
+                f.write(line[:5])
+            expt.append_time_point_arrays(*tail.read())
+            self.assertIsNone(tail.read())
+
+            with open(text_file_name, 'a', newline='') as f:
+                f.write(line[5:])
+                csv.writer(f).writerows(rows[middle + 1:])
+            expt.append_time_point_arrays(*tail.read())
+
+        self.assertEqual(set(expt.replicate_trial_dict), set(expected.replicate_trial_dict))
+        for replicate_key, replicate in expected.replicate_trial_dict.items():
+            for replicate_id, single_trial in replicate.single_trial_dict.items():
+                for analyte_name, time_course in single_trial.analyte_dict.items():
+                    streamed = expt.replicate_trial_dict[replicate_key].single_trial_dict[replicate_id] \
+                        .analyte_dict[analyte_name]
+                    self.assertTrue(np.allclose(streamed.time_vector, time_course.time_vector))
+                    self.assertTrue(np.allclose(streamed.data_vector, time_course.data_vector, equal_nan=True))
+
+    def test_register_parser(self):
+        import tempfile
+
+        parsed = []
+
+        @impact.parsers.register_parser('test_format', sheet_names=['titers'], layout='titers',
+                                        signature=lambda sheets: sheets['titers'][0][0] == 'test header')
+        def parse_test_format(experiment, data, id_type='CSV'):
+            parsed.append([list(row) for row in data['titers']])
+
+        try:
+            self.assertIs(impact.parsers.parser_case_dict['test_format'], parse_test_format)
+            with tempfile.TemporaryDirectory() as directory:
+                file_name = os.path.join(directory, 'test.xlsx')
+                from openpyxl import Workbook
+                workbook = Workbook()
+                workbook.active.title = 'titers'
+                workbook.active.append(['test header', 1])
+                workbook.save(file_name)
+
+                impact.parsers.parse_raw_data(file_name=file_name)
+                self.assertEqual(parsed, [[['test header', 1]]])
+
+                workbook.active['A1'] = 'unknown header'
+                workbook.save(file_name)
+                with self.assertRaises(Exception):
+                    impact.parsers.parse_raw_data(file_name=file_name)
+        finally:
+            del impact.parsers.parser_registry['test_format']
+            del impact.parsers.parser_case_dict['test_format']
+
+    def test_parse_many(self):
+        import csv
+        import tempfile
+
+        def write_plate(directory, times):
+            os.makedirs(directory)
+            identifiers = [['A,,,1', 'A,,,2', 'B,,,1', 'B,,,2'] + [None] * 8] + [[None] * 12 for _ in range(7)]
+            data = generate_spectromax_data(times=times, identifiers=identifiers)
+            for sheet_name in ['identifiers', 'data']:
+                with open(os.path.join(directory, sheet_name + '.csv'), 'w', newline='') as f:
+                    csv.writer(f).writerows([['' if elem is None else elem for elem in row]
+                                             for row in data[sheet_name]])
+            return directory
+
+        titers_file_name = os.path.join(BASE_DIR, 'tests/test_data/sample_input_data.xlsx')
+        with tempfile.TemporaryDirectory() as directory:
+            # The same wells read in two files
+            file_names = [write_plate(os.path.join(directory, 'plate_1'), ('0:00:00', '0:30:00')),
+                          write_plate(os.path.join(directory, 'plate_2'), ('1:00:00', '1:30:00', '2:00:00')),
+                          titers_file_name]
+
+            for workers in [1, 2]:
+                expt = impact.Experiment()
+                expt.parse_many(file_names, workers=workers)
+                self.assertEqual(len(expt.replicate_trial_dict), 9)
+
+                replicate = expt.replicate_trial_dict[[key for key in expt.replicate_trial_dict
+                                                        if key.startswith('A')][0]]
+                self.assertEqual(len(replicate.single_trial_dict), 2)
+                for single_trial in replicate.single_trial_dict.values():
+                    self.assertEqual(list(single_trial.analyte_dict['OD600'].time_vector), [0, 0.5, 1, 1.5, 2])
+
+            # Titers are parsed as in a single file
+            expected = impact.parsers.parse_raw_data(file_name=titers_file_name)
+            for replicate_key, replicate in expected.replicate_trial_dict.items():
+                for single_trial_key, single_trial in replicate.single_trial_dict.items():
+                    for analyte_name, time_course in single_trial.analyte_dict.items():
+                        merged = expt.replicate_trial_dict[replicate_key].single_trial_dict[single_trial_key]
+                        self.assertTrue(np.allclose(merged.analyte_dict[analyte_name].data_vector,
+                                                    time_course.data_vector, equal_nan=True))
+
+    def test_parse_plate_times(self):
+        labels = ['0:00:00', '30:00', ' 1:30:05', '100:00:00']
+        self.assertTrue(np.allclose(impact.parsers.parse_plate_times(labels), [0, 0.5, 1.5 + 5 / 3600, 100]))
+        self.assertEqual(len(impact.parsers.parse_plate_times([])), 0)
+        with self.assertRaises(Exception):
+            impact.parsers.parse_plate_times(['0:00:00', 'not a time'])
+
+    def test_extract_plate_blocks(self):
+        rows = [[], [], []]
+        for time in ['0:00', '30:00']:
+            rows += [[time, None, 1, 2], [None, None, 3]]
+        rows += [['~End'], ['after the data']]
+        table = np.full((len(rows), 4), '', dtype=object)
+        for i, row in enumerate(rows):
+            table[i, :len(row)] = ['' if cell is None else cell for cell in row]
+
+        # Streamed rows are read up to the end marker, ragged rows are padded
+        streamed = iter(rows)
+        for blocks in [impact.parsers.extract_plate_blocks(streamed, [2, 4], plate_spacing=2, plate_height=2),
+                       impact.parsers.extract_plate_blocks(table, [2, 4], plate_spacing=2, plate_height=2)]:
+            times, plates = blocks
+            np.testing.assert_array_equal(times, [0, 0.5])
+            np.testing.assert_array_equal(plates, [[[1, 2], [3, np.nan]]] * 2)
+        self.assertEqual(next(streamed), ['after the data'])
+
+    def test_plate_layouts(self):
+        parsers = {96  : impact.parsers.SpectromaxOD,
+                   384 : impact.parsers.SpectromaxOD384,
+                   1536: impact.parsers.SpectromaxOD1536}
+        for number_of_wells, parser in parsers.items():
+            rows, cols = impact.parsers.plate_geometries[number_of_wells]
+            identifiers = [[None] * cols for _ in range(rows)]
+            identifiers[0][0] = 'strain:A|rep:1'
+            identifiers[-1][-1] = 'strain:B|rep:1'
+
+            raw_data = [[None] * (cols + 2) for _ in range(3)]
+            for i, time in enumerate(['0:00:00', '1:00:00']):
+                for row in range(rows):
+                    raw_data.append([time if row == 0 else None, None]
+                                    + [i + 0.01 * row + 0.0001 * col for col in range(cols)])
+                raw_data.append([None] * (cols + 2))
+            raw_data.append(['~End'] + [None] * (cols + 1))
+
+            # Only the parser for the plate matches
+            sheets = {'data': raw_data[:10], 'identifiers': identifiers}
+            matching = [name for name, registered in impact.parsers.parser_registry.items()
+                        if not registered.text and registered.matches(sheets)]
+            self.assertEqual(matching, [name for name, registered in impact.parsers.parser_registry.items()
+                                        if registered.parse == parser.parse_data and not registered.text])
+
+            expt = impact.Experiment()
+            parser.parse_data(expt, {'data': iter(raw_data), 'identifiers': identifiers}, id_type='traverse')
+            time_courses = {replicate.trial_identifier.strain.name:
+                                replicate.single_trial_dict['1'].analyte_dict['OD600']
+                            for replicate in expt.replicate_trial_dict.values()}
+            self.assertEqual(list(time_courses['A'].time_vector), [0, 1])
+            self.assertTrue(np.allclose(time_courses['A'].data_vector, [0, 1]))
+            last_well = 0.01 * (rows - 1) + 0.0001 * (cols - 1)
+            self.assertTrue(np.allclose(time_courses['B'].data_vector, [last_well, 1 + last_well]))
+
+    def test_plate_layout_replicates(self):
+        layout = impact.parsers.PlateLayout.from_wells(96, replicates=3)
+        self.assertEqual(layout.data_x_coords, [2, 40])
+
+        data = generate_spectromax_data()
+        rows = [row[:14] + [None] + row[2:14] + [None] + [None] * 12 for row in data['data']]
+        times, plates = layout.extract(rows)
+        self.assertEqual(plates.shape, (3, 3, 8, 12))
+        self.assertTrue(np.all(np.isnan(plates[:, 2])))
+        self.assertTrue(np.array_equal(plates[:, 0], plates[:, 1]))
+
+        times, average = layout.extract_average(rows)
+        self.assertTrue(np.array_equal(average, plates[:, 0]))
+
+    def test_time_point_arrays(self):
+        trial_identifiers = []
+        for strain in ['A', 'B']:
+            ti = impact.TimeCourseIdentifier()
+            ti.parse_identifier('strain:%s|rep:1' % strain)
+            ti.analyte_name = 'OD600'
+            ti.analyte_type = 'biomass'
+            trial_identifiers.append(ti)
+
+        # Unsorted and interleaved time points
+        replicates = impact.parsers.parse_time_point_arrays(trial_identifiers,
+                                                            [1, 0, 1, 0, 0],
+                                                            [1, 2, 0, 0, 1],
+                                                            [0.2, 0.3, 0.1, 0.1, 0.2])
+        self.assertEqual(len(replicates), 2)
+        for replicate in replicates:
+            time_course = replicate.single_trial_dict['1'].analyte_dict['OD600']
+            self.assertEqual(list(time_course.time_vector), sorted(time_course.time_vector))
+            self.assertEqual(list(time_course.data_vector), sorted(time_course.data_vector))
+
+        with self.assertRaises(Exception):
+            impact.parsers.parse_time_point_arrays(trial_identifiers, [0, 0], [1, 1], [0.1, 0.2])
+
+    def test_parse_single_trial_list(self):
+        expt = impact.Experiment()
+        impact.parsers.SpectromaxOD.parse_data(expt, generate_spectromax_data(), id_type='traverse')
+        single_trials = [single_trial for replicate in expt.replicate_trial_dict.values()
+                         for single_trial in replicate.single_trial_dict.values()]
+
+        # Each replicate is returned once, regardless of the number of single trials
+        replicates = impact.parsers.parse_single_trial_list(single_trials)
+        self.assertEqual(len(replicates), 2)
+        self.assertCountEqual([len(replicate.single_trial_dict) for replicate in replicates], [2, 2])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import pandas as pd
+import impact
+from impact.core.ReplicateTrial import replicate_statistics
+
+
+class TestReplicateTrial(unittest.TestCase):
+    def create_single_trial(self, replicate_id, times, data):
+        ti = impact.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|rep:%i' % replicate_id)
+        ti.analyte_name = 'OD600'
+        ti.analyte_type = 'biomass'
+        single_trial = impact.SingleTrial()
+        single_trial.add_analyte_data(impact.Biomass.from_arrays(ti, times, data))
+        return single_trial
+
+    def test_replicate_statistics(self):
+        df = pd.DataFrame({'1': [1, 2, np.nan, 4], '2': [2, np.nan, np.nan, 5], '3': [3, 4, 5, np.nan]})
+        mean, std = replicate_statistics(df.values)
+        np.testing.assert_allclose(mean, df.mean(axis=1))
+        np.testing.assert_allclose(std, df.std(axis=1))
+
+    def test_calculate_statistics(self):
+        replicate = impact.ReplicateTrial()
+        replicate.add_replicate(self.create_single_trial(1, [0, 1, 2], [1, 2, 3]))
+        replicate.add_replicate(self.create_single_trial(2, [0, 2, 3], [3, 4, 5]))
+        for single_trial, growth_rate in zip(replicate.single_trials, [0.5, 0.7]):
+            single_trial.analyte_dict['OD600'].fit_params = {
+                'growth_rate': impact.core.AnalyteData.FitParameter('growth_rate', growth_rate)}
+
+        replicate.calculate_statistics()
+        avg = replicate.avg.analyte_dict['OD600']
+        self.assertEqual(list(avg.time_vector), [0, 1, 2, 3])
+        np.testing.assert_allclose(avg.data_vector, [2, 2, 3.5, 5])
+        self.assertAlmostEqual(replicate.std.analyte_dict['OD600'].data_vector[0], np.std([1, 3], ddof=1))
+        self.assertAlmostEqual(avg.fit_params['growth_rate'].parameter_value, 0.6)
+
+        # Bad replicates are excluded from the fit parameter statistics
+        replicate.bad_replicates = ['2']
+        replicate.calculate_statistics()
+        self.assertAlmostEqual(replicate.avg.analyte_dict['OD600'].fit_params['growth_rate'].parameter_value, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
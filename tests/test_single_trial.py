@@ -0,0 +1,33 @@
+import unittest
+import numpy as np
+import impact
+
+
+class TestSingleTrial(unittest.TestCase):
+    def create_analyte(self, analyte_name, times):
+        ti = impact.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|rep:1')
+        ti.analyte_name = analyte_name
+        ti.analyte_type = 'product'
+        return impact.Product.from_arrays(ti, times, np.array(times) * 2)
+
+    def test_analyte_df(self):
+        single_trial = impact.SingleTrial()
+        self.assertTrue(single_trial.analyte_df.empty)
+
+        single_trial.add_analyte_data(self.create_analyte('acetate', [0, 2, 4]))
+        self.assertEqual(list(single_trial.t), [0, 2, 4])
+
+        # Different time indices are merged, and the cached dataframe is rebuilt when analytes are added
+        single_trial.add_analyte_data(self.create_analyte('ethanol', [0, 1, 4]))
+        self.assertEqual(list(single_trial.t), [0, 1, 2, 4])
+        self.assertEqual(list(single_trial.analyte_df.columns), ['acetate', 'ethanol'])
+        self.assertTrue(np.isnan(single_trial.analyte_df['acetate'][1]))
+        self.assertEqual(single_trial.analyte_df['ethanol'][4], 8)
+
+        del single_trial.analyte_dict['ethanol']
+        self.assertEqual(list(single_trial.analyte_df.columns), ['acetate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import tempfile
+import datetime
+import numpy as np
+import impact
+from test_experiment import generate_experiment
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.expt = generate_experiment()
+        self.expt.title = 'storage test'
+        self.expt.start_date = datetime.date(2017, 1, 2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_time_courses_equal(self, expt, loaded, strains=None, analytes=None):
+        for replicate_key, replicate in expt.replicate_trial_dict.items():
+            if strains is not None and replicate.trial_identifier.strain.name not in strains:
+                self.assertNotIn(replicate_key, loaded.replicate_trial_dict)
+                continue
+            loaded_replicate = loaded.replicate_trial_dict[replicate_key]
+            for single_trial_key, single_trial in replicate.single_trial_dict.items():
+                loaded_single_trial = loaded_replicate.single_trial_dict[single_trial_key]
+                expected = [analyte for analyte in single_trial.analyte_dict
+                            if analytes is None or analyte in analytes]
+                self.assertEqual(sorted(loaded_single_trial.analyte_dict), sorted(expected))
+                for analyte in expected:
+                    time_course = single_trial.analyte_dict[analyte]
+                    loaded_time_course = loaded_single_trial.analyte_dict[analyte]
+                    self.assertIs(type(loaded_time_course), type(time_course))
+                    np.testing.assert_array_equal(loaded_time_course.time_vector, time_course.time_vector)
+                    np.testing.assert_array_equal(loaded_time_course.data_vector, time_course.data_vector)
+
+    def test_save_load(self):
+        self.expt.save(self.path)
+        loaded = impact.Experiment.load(self.path)
+        self.assertEqual(loaded.title, 'storage test')
+        self.assertEqual(loaded.start_date, datetime.date(2017, 1, 2))
+        self.assertEqual(sorted(loaded.replicate_trial_dict), sorted(self.expt.replicate_trial_dict))
+        self.assert_time_courses_equal(self.expt, loaded)
+
+    def test_identifiers(self):
+        ti = impact.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|strain__plasmid:pKDL|strain__ko:adhE,pta|media__cc:10 glc__D|'
+                            'media__base:M9|environment__labware:96MTP|environment__temperature:37|rep:2')
+        ti.analyte_name = 'OD600'
+        ti.analyte_type = 'biomass'
+        expt = impact.Experiment()
+        for replicate in impact.parsers.parse_time_point_arrays([ti], [0, 0, 0], [0, 1, 2], [0.1, 0.2, 0.4]):
+            expt.add_replicate_trial(replicate)
+        expt.save(self.path)
+
+        loaded = impact.Experiment.load(self.path)
+        loaded_ti = loaded.replicate_trials[0].get_time_courses()[0].trial_identifier
+        self.assertEqual(loaded_ti.unique_time_point(), ti.unique_time_point())
+        self.assertEqual(loaded_ti.media.parent.name, 'M9')
+
+    def test_identifier_without_replicate_id(self):
+        from impact.storage import IdentifierBuilder, identifier_record
+        ti = impact.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|rep:2')
+        builder = IdentifierBuilder()
+        self.assertEqual(builder.build(identifier_record(ti)).replicate_id, 2)
+
+        # e.g. identifiers which weren't built by a parser
+        ti.replicate_id = None
+        self.assertIsNone(builder.build(identifier_record(ti)).replicate_id)
+        self.assertIsNone(builder.build(dict(identifier_record(ti), replicate_id=float('nan'))).replicate_id)
+
+    def test_selection(self):
+        self.expt.save(self.path, row_group_size=20)
+        loaded = impact.Experiment.load(self.path, strains=['B'], analytes=['glucose'])
+        self.assertEqual(len(loaded.replicate_trial_dict), 1)
+        self.assert_time_courses_equal(self.expt, loaded, strains=['B'], analytes=['glucose'])
+
+        self.assertEqual(len(impact.Experiment.load(self.path, strains=['D']).replicate_trial_dict), 0)
+
+    def test_fit_params(self):
+        from impact.core.settings import settings
+        expt = generate_experiment(analytes=[('OD600', 'biomass')])
+        settings.perform_curve_fit = True
+        try:
+            expt.calculate()
+            expt.save(self.path)
+            loaded = impact.Experiment.load(self.path)
+            for replicate_key, replicate in loaded.replicate_trial_dict.items():
+                for single_trial_key, single_trial in replicate.single_trial_dict.items():
+                    fit_params = expt.replicate_trial_dict[replicate_key].single_trial_dict[single_trial_key]\
+                        .analyte_dict['OD600'].fit_params
+                    loaded_fit_params = single_trial.analyte_dict['OD600'].fit_params
+                    self.assertTrue(fit_params)
+                    self.assertEqual(sorted(loaded_fit_params), sorted(fit_params))
+                    for name in fit_params:
+                        self.assertEqual(loaded_fit_params[name].parameter_value, fit_params[name].parameter_value)
+
+            # The saved fit is used rather than fitting again
+            time_course = loaded.replicate_trials[0].single_trials[0].analyte_dict['OD600']
+            self.assertTrue(time_course._prefit)
+            time_course.calculate()
+            self.assertFalse(time_course._prefit)
+        finally:
+            settings.perform_curve_fit = False
+
+if __name__ == '__main__':
+    unittest.main()
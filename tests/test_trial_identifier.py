@@ -0,0 +1,53 @@
+import unittest
+import pickle
+import impact
+
+
+class TestTrialIdentifier(unittest.TestCase):
+    def setUp(self):
+        self.ti = impact.TimeCourseIdentifier()
+        self.ti.parse_identifier('strain:MG|strain__plasmid:pKDL|media__cc:10 glc__D|rep:1')
+        self.ti.analyte_name = 'OD600'
+
+    def test_cached_keys_invalidated(self):
+        key = self.ti.unique_single_trial()
+        self.assertIs(self.ti.unique_single_trial(), key)
+
+        # Changes to nested identifiers
+        self.ti.strain.name = 'MG1655'
+        self.assertIn('MG1655', self.ti.unique_single_trial())
+
+        self.ti.strain.plasmids.append(impact.Plasmid(name='pTrc'))
+        self.assertIn('pTrc', self.ti.unique_replicate_trial())
+
+        self.ti.media.add_component('IPTG', 1, 'M')
+        self.assertIn('IPTG', self.ti.unique_replicate_trial())
+
+        self.ti.replicate_id = 2
+        self.assertTrue(self.ti.unique_single_trial().endswith(' 2'))
+
+        self.ti.analyte_name = 'glucose'
+        self.assertTrue(self.ti.unique_time_point().endswith(' glucose'))
+
+    def test_group_id(self):
+        ti = impact.TimeCourseIdentifier()
+        ti.parse_identifier('strain:MG|strain__plasmid:pKDL|media__cc:10 glc__D|rep:1')
+        ti.analyte_name = 'OD600'
+        group_ids = {}
+        self.assertEqual(ti.get_group_id('time_point', group_ids), self.ti.get_group_id('time_point', group_ids))
+
+        ti.replicate_id = 2
+        self.assertEqual(ti.get_group_id('replicate_trial', group_ids),
+                         self.ti.get_group_id('replicate_trial', group_ids))
+        self.assertNotEqual(ti.get_group_id('single_trial', group_ids),
+                            self.ti.get_group_id('single_trial', group_ids))
+        self.assertEqual(len(group_ids), 4)
+
+    def test_pickle(self):
+        key = self.ti.unique_time_point()
+        ti = pickle.loads(pickle.dumps(self.ti))
+        self.assertEqual(ti.unique_time_point(), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+import asyncio
+import csv
+import io
+import os
+import tempfile
+import numpy as np
+import impact
+import impact.parsers
+from impact.watcher import DropFolderWatcher
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_titer_rows():
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(os.path.join(BASE_DIR, 'tests/test_data/sample_input_data.xlsx'), read_only=True,
+                             data_only=True)
+    rows = [['' if elem is None else elem for elem in row] for row in workbook['titers'].iter_rows(values_only=True)]
+    workbook.close()
+    return rows
+
+
+def to_csv(rows):
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue()
+
+
+class TestWatcher(unittest.TestCase):
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as directory:
+            watcher = DropFolderWatcher(directory, settle_time=2)
+            file_name = os.path.join(directory, 'read_1.csv')
+            with open(file_name, 'w') as f:
+                f.write('partial')
+            open(os.path.join(directory, 'empty.csv'), 'w').close()
+            open(os.path.join(directory, '~$read_1.xlsx'), 'w').close()
+            open(os.path.join(directory, 'notes.docx'), 'w').close()
+
+            self.assertEqual(watcher.scan(now=0), [])
+            self.assertEqual(watcher.scan(now=1), [])
+            self.assertEqual(watcher.status['pending_files'], 2)
+
+            # The file is still being written, it has to settle again
+            with open(file_name, 'a') as f:
+                f.write(' file')
+            self.assertEqual(watcher.scan(now=2.5), [])
+            self.assertEqual(watcher.scan(now=5), [file_name])
+            self.assertEqual(watcher.scan(now=10), [])
+            self.assertEqual(watcher.status['pending_files'], 1)
+
+            # An overwritten file is parsed again once it settles
+            with open(file_name, 'w') as f:
+                f.write('new read')
+            self.assertEqual(watcher.scan(now=11), [])
+            self.assertEqual(watcher.scan(now=13), [file_name])
+            self.assertEqual(watcher.scan(now=20), [])
+            self.assertEqual(watcher.queued_files, 2)
+
+    def test_watch_drop_folder(self):
+        rows = get_titer_rows()
+        # Split the measurements into two reads by time, the time is the last field of the identifier
+        times = np.array([float(row[0].split(',')[-1]) for row in rows[2:]])
+        reads = [rows[:2] + [row for row, time in zip(rows[2:], times) if time < 10],
+                 rows[:2] + [row for row, time in zip(rows[2:], times) if time >= 10]]
+
+        with tempfile.TemporaryDirectory() as directory:
+            expected = impact.parsers.parse_raw_data('default_titers',
+                                                     file_name=os.path.join(BASE_DIR,
+                                                                            'tests/test_data/sample_input_data.xlsx'))
+            os.mkdir(os.path.join(directory, 'expt1'))
+            watcher = DropFolderWatcher(directory, poll_interval=0.05, settle_time=0.3, max_queue_size=1)
+
+            async def drop_files():
+                # The first read is written in two parts, it shouldn't be parsed until it is complete
+                text = to_csv(reads[0])
+                with open(os.path.join(directory, 'expt1', 'read_1.csv'), 'w', newline='') as f:
+                    f.write(text[:len(text) // 2])
+                    f.flush()
+                    await asyncio.sleep(0.1)
+                    f.write(text[len(text) // 2:])
+                await watcher.wait_until_idle(timeout=60)
+                self.assertEqual(watcher.merged_files, 1)
+
+                with open(os.path.join(directory, 'expt1', 'read_2.csv'), 'w', newline='') as f:
+                    f.write(to_csv(reads[1]))
+                await watcher.wait_until_idle(timeout=60)
+                watcher.stop()
+
+            async def run():
+                await asyncio.gather(watcher.run(), drop_files())
+
+            asyncio.run(run())
+
+        status = watcher.status
+        self.assertEqual(status['merged_files'], 2)
+        self.assertEqual(status['failed_files'], 0, status['errors'])
+        self.assertEqual(status['parse_queue_depth'] + status['merge_queue_depth'], 0)
+        self.assertGreater(status['mean_parse_latency'], 0)
+
+        expt = watcher.experiments['expt1']
+        self.assertEqual(set(expt.replicate_trial_dict), set(expected.replicate_trial_dict))
+        for replicate_key, replicate in expected.replicate_trial_dict.items():
+            for replicate_id, single_trial in replicate.single_trial_dict.items():
+                for analyte_name, time_course in single_trial.analyte_dict.items():
+                    merged = expt.replicate_trial_dict[replicate_key].single_trial_dict[replicate_id] \
+                        .analyte_dict[analyte_name]
+                    self.assertTrue(np.allclose(merged.time_vector, time_course.time_vector))
+                    self.assertTrue(np.allclose(merged.data_vector, time_course.data_vector, equal_nan=True))
+
+    def test_watch_blank_subtraction(self):
+        from impact.core.settings import settings
+        times = np.arange(9.)
+        curve = 0.1 + 2 / (1 + np.exp(4 - times))
+
+        def read(read_times):
+            rows = [['', 'OD600'], ['', 'biomass']]
+            for time in read_times:
+                for rep in [1, 2]:
+                    rows.append(['strain:A|rep:%i|time:%g' % (rep, time), curve[int(time)]])
+                    rows.append(['strain:blank|rep:%i|time:%g' % (rep, time), 0.05])
+            return to_csv(rows)
+
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, 'expt1'))
+            watcher = DropFolderWatcher(directory, id_type='traverse', poll_interval=0.05, settle_time=0.2)
+
+            async def drop_files():
+                for i, read_times in enumerate([times[:3], times[3:6], times[6:]]):
+                    with open(os.path.join(directory, 'expt1', 'read_%i.csv' % i), 'w', newline='') as f:
+                        f.write(read(read_times))
+                    await watcher.wait_until_idle(timeout=60)
+                    if i == 0:
+                        expt = watcher.experiments['expt1']
+                        blank_key = [key for key in expt.replicate_trial_dict if 'blank' in key][0]
+                        expt.blank_key_list = [blank_key]
+                        for key, replicate in expt.replicate_trial_dict.items():
+                            if key != blank_key:
+                                replicate.set_blank(expt.replicate_trial_dict[blank_key])
+                watcher.stop()
+
+            async def run():
+                await asyncio.gather(watcher.run(), drop_files())
+
+            settings.live_calculations = True
+            try:
+                asyncio.run(run())
+            finally:
+                settings.live_calculations = False
+
+        self.assertEqual(watcher.status['merged_files'], 3, watcher.status['errors'])
+        # The blank is subtracted once from every read, although each merge recalculates the experiment
+        expt = watcher.experiments['expt1']
+        replicate = [replicate for key, replicate in expt.replicate_trial_dict.items() if 'blank' not in key][0]
+        for single_trial in replicate.single_trials:
+            np.testing.assert_allclose(single_trial.analyte_dict['OD600'].time_vector, times)
+            np.testing.assert_allclose(single_trial.analyte_dict['OD600'].data_vector, curve - 0.05)
+        np.testing.assert_allclose(replicate.avg.analyte_dict['OD600'].data_vector, curve - 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()